@@ -47,6 +47,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Outermost after security, so session and auth queries are counted too
+    'projectcv.instrumentation.QueryCountMiddleware',
+    # Before anything reads the database, see projectcv.routers
+    'projectcv.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,13 +83,66 @@ WSGI_APPLICATION = 'mycv.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# projectcv.backends.sqlite3 is the stock backend plus WAL and the pragmas in
+# projectcv/backends/sqlite3/base.py; connections are kept for a minute
+# instead of being reopened (and re-tuned) on every request.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'projectcv.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {'busy_timeout': 5000},
+        },
     }
 }
 
+# Reads of safe requests go to DATABASE_REPLICAS, writes and the reads that
+# follow them to DATABASE_PRIMARY; see projectcv/routers.py for a local
+# two-file setup.
+
+DATABASE_ROUTERS = ['projectcv.routers.PrimaryReplicaRouter']
+DATABASE_PRIMARY = 'default'
+DATABASE_REPLICAS = []
+REPLICA_PIN_SECONDS = 5
+
+# Write-behind votes: a star click only appends to projectcv_pendingvote and
+# `manage.py flush_votes --interval 1` applies them in batches (see
+# projectcv/vote_buffer.py). Off by default, votes are written directly.
+
+VOTE_WRITE_BEHIND = False
+
+# Background jobs (projectcv/jobs.py): image resizing, bulk search reindexing
+# and file cleanup are queued in projectcv_job and run by
+# `manage.py run_workers`. JOBS_INLINE runs them right after the commit in
+# the queuing process instead, for development without a worker; a running
+# job older than JOBS_TIMEOUT seconds is considered lost and tried again.
+
+JOBS_INLINE = False
+JOBS_TIMEOUT = 30 * 60
+
+
+# Cache
+# A file-based cache is shared by every worker process on the host, so the
+# facet version key in projectcv.facets is seen by all of them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+    },
+    # Rendered template fragments, keys carry the book / catalogue version
+    'fragments': {
+        'BACKEND': 'projectcv.cache.InstrumentedFileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'fragments',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -133,4 +190,27 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 AUTH_USER_MODEL = "projectcv.User"
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Per-view query budgets (projectcv.instrumentation): False only logs a warning
+# when a view goes over, the test runner turns it into a failure
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = "projectcv.testing.QueryBudgetTestRunner"
+
+# The per-request query lines and the queue metrics are INFO: on with DEBUG,
+# otherwise only warnings unless PROJECTCV_LOG_LEVEL=INFO asks for them
+PROJECTCV_LOG_LEVEL = os.environ.get("PROJECTCV_LOG_LEVEL", "INFO" if DEBUG else "WARNING")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        # One JSON line per request: queries, SQL time, repeated statements, budget
+        "projectcv.queries": {"handlers": ["console"], "level": PROJECTCV_LOG_LEVEL, "propagate": False},
+        # Job failures and the run_workers queue metrics
+        "projectcv.jobs": {"handlers": ["console"], "level": PROJECTCV_LOG_LEVEL, "propagate": False},
+    },
+}
\ No newline at end of file
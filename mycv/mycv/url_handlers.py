@@ -1,5 +1,5 @@
 
 from django.shortcuts import redirect
 
-def index_handler(request):
+async def index_handler(request):
     return redirect("book_index")
\ No newline at end of file
@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django import forms
+from django.db.models import Q
 
-from .models import Book, Genre, User, Tag, Comment, Vote
+from .models import Book, Genre, Job, User, Tag, Comment, Vote
+from .pagination import EstimatedCountPaginator
+from .search import search_books
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 
@@ -62,8 +65,11 @@ class Admin(UserAdmin):
 class BookAdmin(admin.ModelAdmin):
     list_display = ['title', 'author', 'publisher', 'get_genres', 'rating']
     list_filter = ['genre', 'rating', 'published_date']
-    search_fields = ['title', 'author', 'publisher']
-    filter_horizontal = ('genre', 'tags')
+    search_fields = ['title', 'author', 'publisher']  # searched through the full-text index, see get_search_results
+    autocomplete_fields = ('genre', 'tags')
+    # Constant-time changelist: no COUNT(*) over the whole table, estimated page count
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         ('Basic Information',{
@@ -86,17 +92,88 @@ class BookAdmin(admin.ModelAdmin):
         })
     )
 
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        # Only the changelist uses the slim listing queryset, the change form needs every column
+        if url_name == "projectcv_book_changelist":
+            qs = qs.with_listing_stats()
+        # Autocomplete results are labelled with Book.__str__, which lists genres and tags
+        elif url_name == "autocomplete":
+            qs = qs.prefetch_related("genre", "tags")
+        return qs
+
+    def get_search_results(self, request, queryset, search_term):
+        # FTS5 match instead of LIKE '%term%' scans over three columns
+        if not search_term.strip():
+            return queryset, False
+        return search_books(queryset, search_term), False
+
     def get_genres(self, obj):
-        return", ".join([genre.genre_name for genre in obj.genre.all()])
+        genres = getattr(obj, "genre_list", None)
+        if genres is None:
+            genres = obj.genre.all()
+        return ", ".join([genre.genre_name for genre in genres])
     get_genres.short_description = 'Genres'
 
 
 @admin.register(Vote)
 class VoteAdmin(admin.ModelAdmin):
-    list_display = ['user', 'book', 'rating', 'created_at']
+    list_display = ['get_user', 'get_book', 'rating', 'created_at']
     list_filter = ['rating', 'created_at']
-    search_fields = ['user', 'book']
-
-admin.site.register(Genre)
-admin.site.register(User, Admin)
-admin.site.register(Tag)
\ No newline at end of file
+    list_select_related = ['user', 'book']
+    search_fields = ['user__email', 'book__title']  # exact e-mail or full-text title, see get_search_results
+    autocomplete_fields = ['user', 'book']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # The columns shown; Book.__str__ would query genres and tags for every row
+        return super().get_queryset(request).only(
+            'rating', 'created_at', 'user__email', 'book__title',
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        # Unique e-mail index or the book full-text index - never a LIKE scan over the joined tables
+        books = search_books(Book.objects.all(), term).order_by().values('pk')
+        return queryset.filter(Q(user__email__in={term, term.lower()}) | Q(book__in=books)), False
+
+    def get_user(self, obj):
+        return obj.user.email
+    get_user.short_description = 'User'
+    get_user.admin_order_field = 'user__email'
+
+    def get_book(self, obj):
+        return obj.book.title
+    get_book.short_description = 'Book'
+    get_book.admin_order_field = 'book__title'
+
+
+@admin.register(Genre)
+class GenreAdmin(admin.ModelAdmin):
+    search_fields = ['genre_name']
+    ordering = ['genre_name']
+
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    search_fields = ['tag_title']
+    ordering = ['tag_title']
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Inspect failed background jobs; retry one by setting it back to pending"""
+    list_display = ['name', 'status', 'attempts', 'run_at', 'finished_at', 'worker']
+    list_filter = ['status', 'name']
+    readonly_fields = ['name', 'args', 'key', 'attempts', 'created_at', 'started_at', 'finished_at', 'worker',
+                       'last_error']
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(User, Admin)
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""JSON API, version 1.
+
+Rows are read with values() and serialized straight to JSON, no model
+instances are built. Lists use keyset (cursor) pagination on ``-id`` and
+every response carries a strong ETag. The one write is the bulk vote
+endpoint, for import tools and the mobile client.
+"""
+import hashlib
+import json
+from collections import defaultdict
+
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.views.decorators.http import require_GET, require_POST
+
+from .filters import INDEX_FILTERS, filter_books
+from .instrumentation import query_budget
+from .models import Book, Comment, Vote
+from .votes import MAX_VOTES, record_votes
+
+
+# One salt per endpoint: a cursor of one list does not verify on the other
+API_BOOK_CURSOR_SALT = "projectcv.api-book-cursor"
+API_COMMENT_CURSOR_SALT = "projectcv.api-comment-cursor"
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Book columns selectable with ?fields=, plus the two M2M lists
+BOOK_COLUMNS = (
+    "id", "title", "author", "publisher", "isbn", "ean", "published_date", "rating",
+    "average_rating", "vote_count", "blurb", "author_bio", "updated_at",
+)
+BOOK_RELATIONS = ("genres", "tags")
+BOOK_FIELDS = BOOK_COLUMNS + BOOK_RELATIONS
+DEFAULT_LIST_FIELDS = ("id", "title", "author", "publisher", "published_date", "average_rating", "vote_count", "genres")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def json_response(request, payload, status=200):
+    """Serialize once, tag with a strong ETag of the body and answer 304 when it matches"""
+    body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+    if status == 200:
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+    response = HttpResponse(body, status=status, content_type="application/json")
+    response["ETag"] = etag
+    return response
+
+
+def api_view(func):
+    """GET only, ApiError turned into a JSON error body"""
+    @require_GET
+    def wrapper(request, *args, **kwargs):
+        try:
+            return func(request, *args, **kwargs)
+        except ApiError as exc:
+            return json_response(request, {"error": exc.message}, status=exc.status)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def api_write_view(func):
+    """POST only, for a signed-in user, ApiError turned into a JSON error body"""
+    @require_POST
+    def wrapper(request, *args, **kwargs):
+        try:
+            if not request.user.is_authenticated:
+                raise ApiError(401, "Sign in to vote.")
+            return func(request, *args, **kwargs)
+        except ApiError as exc:
+            return json_response(request, {"error": exc.message}, status=exc.status)
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+def parse_fields(request, default):
+    """Sparse fieldset from ?fields=title,author; 'id' is always included"""
+    raw = request.GET.get("fields")
+    if not raw:
+        return list(default)
+    fields = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = sorted(set(fields) - set(BOOK_FIELDS))
+    if unknown:
+        raise ApiError(400, f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(BOOK_FIELDS)}.")
+    return ["id"] + [name for name in fields if name != "id"]
+
+
+def parse_limit(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError(400, "limit must be an integer.")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_filters(request):
+    """The book index filters of the query string; genre and rating are ids"""
+    filters = {name: request.GET.get(name, "") for name in INDEX_FILTERS}
+    for name in ("genre", "rating"):
+        if filters[name] and not filters[name].isdigit():
+            raise ApiError(400, f"{name} must be an integer.")
+    return filters
+
+
+def decode_token(token, salt, keys):
+    """Payload of a cursor token, it must have been signed with salt and carry keys"""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=salt)
+    except signing.BadSignature:
+        raise ApiError(400, "Invalid cursor.")
+    if not isinstance(data, dict) or not set(keys) <= data.keys():
+        raise ApiError(400, "Invalid cursor.")
+    return data
+
+
+def book_rows(queryset, fields):
+    """values() rows for the requested fields, genres / tags attached with one query each"""
+    rows = list(queryset.values(*[name for name in fields if name in BOOK_COLUMNS]))
+    ids = [row["id"] for row in rows]
+    relations = {
+        "genres": (Book.genre.through, "genre__genre_name"),
+        "tags": (Book.tags.through, "tag__tag_title"),
+    }
+    for name in BOOK_RELATIONS:
+        if name not in fields:
+            continue
+        through, label = relations[name]
+        names = defaultdict(list)
+        for book_id, value in through.objects.filter(book_id__in=ids).order_by(label).values_list("book_id", label):
+            names[book_id].append(value)
+        for row in rows:
+            row[name] = names[row["id"]]
+    return rows
+
+
+@query_budget(3)
+@api_view
+def book_list(request):
+    """GET /api/v1/books/?fields=&limit=&cursor=&q=&author=&genre=&rating="""
+    fields = parse_fields(request, DEFAULT_LIST_FIELDS)
+    limit = parse_limit(request)
+    cursor = decode_token(request.GET.get("cursor"), API_BOOK_CURSOR_SALT, ("pk", "f"))
+    # A cursor carries the filters of the first page, so next links stay short
+    filters = cursor["f"] if cursor else parse_filters(request)
+
+    # Ordered by id even for searches, a rank order cannot be paginated by keyset
+    qs = filter_books(Book.objects.all(), filters).order_by("-id")
+    if cursor:
+        qs = qs.filter(pk__lt=cursor["pk"])
+    rows = book_rows(qs[:limit + 1], fields)
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        token = signing.dumps({"pk": rows[-1]["id"], "f": filters}, salt=API_BOOK_CURSOR_SALT, compress=True)
+        query = {"cursor": token, "limit": limit}
+        if request.GET.get("fields"):
+            query["fields"] = request.GET["fields"]
+        next_url = request.build_absolute_uri(f"{reverse('api_book_list')}?{urlencode(query)}")
+    return json_response(request, {"results": rows, "next": next_url})
+
+
+def get_book_or_404(pk, fields):
+    rows = book_rows(Book.objects.filter(pk=pk), fields)
+    if not rows:
+        raise ApiError(404, "Book not found.")
+    return rows[0]
+
+
+@query_budget(3)
+@api_view
+def book_detail(request, pk):
+    """GET /api/v1/books/<pk>/?fields="""
+    return json_response(request, get_book_or_404(pk, parse_fields(request, BOOK_FIELDS)))
+
+
+@query_budget(3)
+@api_view
+def book_votes(request, pk):
+    """GET /api/v1/books/<pk>/votes/ - stored aggregates plus the 1-5 star distribution"""
+    book = get_book_or_404(pk, ("id", "vote_count", "average_rating"))
+    counts = dict(Vote.objects.filter(book_id=pk).order_by().values_list("rating").annotate(Count("id")))
+    book["distribution"] = {str(stars): counts.get(stars, 0) for stars in range(1, 6)}
+    return json_response(request, book)
+
+
+@query_budget(3)
+@api_view
+def book_comments(request, pk):
+    """GET /api/v1/books/<pk>/comments/?limit=&cursor= - newest first"""
+    get_book_or_404(pk, ("id",))
+    limit = parse_limit(request)
+    cursor = decode_token(request.GET.get("cursor"), API_COMMENT_CURSOR_SALT, ("created_at", "pk"))
+
+    qs = Comment.objects.filter(book_id=pk).order_by("-created_at", "-id")
+    if cursor:
+        try:
+            created_at = parse_datetime(cursor["created_at"])
+        except (TypeError, ValueError):
+            created_at = None
+        if created_at is None:
+            raise ApiError(400, "Invalid cursor.")
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=cursor["pk"]))
+    rows = list(qs.values("id", "content", "created_at", "user__email")[:limit + 1])
+
+    next_url = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        token = signing.dumps(
+            {"created_at": rows[-1]["created_at"].isoformat(), "pk": rows[-1]["id"]}, salt=API_COMMENT_CURSOR_SALT,
+        )
+        path = reverse("api_book_comments", kwargs={"pk": pk})
+        next_url = request.build_absolute_uri(f"{path}?{urlencode({'cursor': token, 'limit': limit})}")
+    for row in rows:
+        row["user"] = row.pop("user__email")
+    return json_response(request, {"results": rows, "next": next_url})
+
+
+def parse_votes(request):
+    """{book id: rating} from a {"votes": [{"book": <id>, "rating": <1-5>}, ...]} body, the last vote per book wins"""
+    try:
+        votes = json.loads(request.body)["votes"]
+        if not isinstance(votes, list):
+            raise TypeError
+        ratings = {}
+        for vote in votes:
+            # bool is a subclass of int, true would otherwise vote 1 on book 1
+            if any(isinstance(vote[key], bool) or not isinstance(vote[key], int) for key in ("book", "rating")):
+                raise TypeError
+            ratings[vote["book"]] = vote["rating"]
+    except (ValueError, KeyError, TypeError):
+        raise ApiError(400, 'Expected {"votes": [{"book": <id>, "rating": <1-5>}, ...]}.')
+    if len(ratings) > MAX_VOTES:
+        raise ApiError(400, f"At most {MAX_VOTES} votes at a time.")
+    return ratings
+
+
+@query_budget(30)
+@api_write_view
+def vote_bulk(request):
+    """POST /api/v1/votes/ - record or change the user's votes on many books at once"""
+    try:
+        created, changed = record_votes(request.user, parse_votes(request))
+    except ValueError as exc:
+        raise ApiError(400, str(exc))
+    return json_response(request, {"created": created, "changed": changed})
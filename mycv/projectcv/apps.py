@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProjectcvConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'projectcv'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (registers the signal receivers)
+        from . import tasks  # noqa: F401 (registers the background jobs)
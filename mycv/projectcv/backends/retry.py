@@ -0,0 +1,35 @@
+import functools
+import random
+import time
+
+from django.db import OperationalError, connections
+
+
+BUSY_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+
+def is_busy_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc) for message in BUSY_MESSAGES)
+
+
+def retry_on_busy(func=None, *, attempts=5, delay=0.05, using="default"):
+    """Run a write again when SQLite answers SQLITE_BUSY after busy_timeout ran out.
+
+    The call must be a whole transaction (update_or_create(), create() or an
+    atomic() block of its own): inside an outer atomic block nothing is
+    retried, since the outer transaction is already broken. Waits grow
+    exponentially with jitter so competing writers do not retry in step.
+    """
+    if func is None:
+        return functools.partial(retry_on_busy, attempts=attempts, delay=delay, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_busy_error(exc) or connections[using].in_atomic_block or attempt == attempts - 1:
+                    raise
+                time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
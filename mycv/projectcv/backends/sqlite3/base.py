@@ -0,0 +1,50 @@
+"""SQLite backend tuned for a web server: WAL, pragmas on connect, IMMEDIATE transactions.
+
+Use it as the ENGINE ``projectcv.backends.sqlite3``. Two extra OPTIONS keys
+are understood and not passed on to sqlite3.connect():
+
+``pragmas``
+    merged over DEFAULT_PRAGMAS and run on every new connection.
+``transaction_mode``
+    ``"IMMEDIATE"`` starts atomic blocks with BEGIN IMMEDIATE, so a
+    transaction takes the write lock up front and waits on busy_timeout,
+    instead of failing with "database is locked" when a read transaction
+    tries to upgrade to a write (Django 5.1 has the same option built in).
+"""
+from django.db.backends.sqlite3 import base
+
+
+# WAL lets readers run alongside the single writer; NORMAL is durable in WAL
+# mode except for the last commits on power loss
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,  # ms to wait for a lock before SQLITE_BUSY
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64000,  # negative: KiB, so 64 MB per connection
+    "temp_store": "MEMORY",
+}
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = {**DEFAULT_PRAGMAS, **kwargs.pop("pragmas", {})}
+        mode = kwargs.pop("transaction_mode", "DEFERRED").upper()
+        if mode not in TRANSACTION_MODES:
+            raise ValueError(f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}")
+        self.transaction_mode = mode
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            # journal_mode is persistent and cannot change inside a transaction; in-memory
+            # test databases answer "memory" and stay as they are
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f"BEGIN {self.transaction_mode}")
@@ -0,0 +1,15 @@
+"""Performance benchmarks: a synthetic catalogue generator and request scenarios.
+
+Generate a catalogue into an empty database with ``manage.py generate_catalogue``
+and measure it with ``manage.py run_benchmarks``; both are deterministic for a
+given seed, so baselines saved from two commits can be diffed:
+
+    python manage.py migrate projectcv && python manage.py migrate
+    python manage.py generate_catalogue --books 100000 --votes 10000000 --users 20000
+    python manage.py run_benchmarks --output benchmarks/before.json
+    python manage.py run_benchmarks --compare benchmarks/before.json --fail-on-regression
+
+(projectcv is migrated first because the other apps' migrations need its
+custom User model.) Point DATABASES at a scratch database: the vote
+scenario writes votes.
+"""
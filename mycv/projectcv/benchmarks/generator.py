@@ -0,0 +1,173 @@
+"""Deterministic synthetic catalogue.
+
+Popularity follows a Zipf law: books are ranked in a shuffled order and the
+book of rank r gets votes and comments in proportion to 1 / r ** skew, so a
+few books collect most of the activity and the long tail has none, as on a
+real site. Authors are drawn with the same skew. Everything comes from one
+random.Random(seed), so the same arguments always build the same catalogue.
+
+Rows are written with bulk_create(), which sends no signals; the vote
+aggregates, the search index, the leaderboards and the cached facets are
+rebuilt at the end.
+"""
+import random
+from itertools import accumulate
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from projectcv import facets, leaderboards, search
+from projectcv.conditional import touch_catalogue
+from projectcv.models import Book, Comment, Genre, Tag, User, Vote
+
+
+GENRES = (
+    "Fantasy", "Science Fiction", "Mystery", "Thriller", "Romance", "Horror", "Historical Fiction",
+    "Biography", "Memoir", "Poetry", "Drama", "Young Adult", "Children", "Self-help", "Philosophy",
+    "Psychology", "History", "Travel", "Cooking", "Art", "Science", "Economics", "Politics",
+    "Religion", "Christian", "Humor", "Graphic Novel", "Classics", "Short Stories", "Dystopian",
+)
+WORDS = (
+    "shadow", "river", "crown", "silent", "garden", "winter", "fire", "glass", "empire", "secret",
+    "house", "storm", "light", "forest", "stone", "letter", "summer", "iron", "city", "dream",
+    "ocean", "mirror", "song", "night", "orchard", "island", "bridge", "harbor", "wolf", "star",
+    "memory", "road", "queen", "meadow", "ember", "hollow", "tide", "lantern", "ashes", "thorn",
+)
+FIRST_NAMES = (
+    "Anna", "Jan", "Eva", "Petr", "Nicole", "Martin", "Lucie", "Tomas", "Sarah", "David",
+    "Maria", "John", "Elena", "Pavel", "Clara", "Adam", "Julia", "Marek", "Hana", "Oliver",
+)
+LAST_NAMES = (
+    "Novak", "Sager", "Svoboda", "Smith", "Dvorak", "Brown", "Cerny", "Miller", "Prochazka", "Wilson",
+    "Kucera", "Taylor", "Vesely", "Moore", "Horak", "Clark", "Nemec", "Walker", "Marek", "Hall",
+)
+PUBLISHERS = tuple(f"{word.title()} Press" for word in WORDS[:25]) + ("Independently published",)
+
+
+@dataclass
+class CatalogueSpec:
+    """Size of the catalogue. votes and comments are targets: a book gets at most
+    one vote per user and tail counts round down to zero, so fewer may be written."""
+    books: int = 10_000
+    users: int = 1_000
+    votes: int = 100_000
+    comments: int = 20_000
+    tags: int = 200
+    skew: float = 1.1
+    seed: int = 42
+    batch_size: int = 5_000
+
+
+def zipf_counts(total, size, skew, cap=None):
+    """Split total over size ranks in proportion to 1 / rank ** skew, each count at most cap"""
+    weights = [1 / rank ** skew for rank in range(1, size + 1)]
+    scale = total / sum(weights)
+    counts = [round(weight * scale) for weight in weights]
+    return [min(count, cap) for count in counts] if cap is not None else counts
+
+
+def _sentence(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high))).capitalize() + "."
+
+
+def _bulk(model, rows, batch_size):
+    """bulk_create() a stream of unsaved instances in batches, returns the pks in order"""
+    pks, batch = [], []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            pks.extend(obj.pk for obj in model.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        pks.extend(obj.pk for obj in model.objects.bulk_create(batch))
+    return pks
+
+
+def generate_catalogue(spec, log=lambda message: None):
+    """Write the catalogue described by spec, returns the number of rows per model"""
+    rng = random.Random(spec.seed)
+
+    genre_ids = _bulk(Genre, (Genre(genre_name=name) for name in GENRES), spec.batch_size)
+    tag_names = sorted({f"{rng.choice(WORDS)}-{rng.choice(WORDS)}" for _ in range(spec.tags * 3)})[:spec.tags]
+    tag_ids = _bulk(Tag, (Tag(tag_title=name[:30]) for name in tag_names), spec.batch_size)
+    log(f"{len(genre_ids)} genres, {len(tag_ids)} tags")
+
+    # "!" is an unusable password hash; the benchmark logs users in with force_login()
+    users = (User(email=f"bench-user-{n}@example.com", password="!") for n in range(spec.users))
+    user_ids = _bulk(User, users, spec.batch_size)
+    User.objects.create(email="bench-admin@example.com", password="!", is_admin=True)
+    log(f"{len(user_ids)} users")
+
+    authors = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {n}" for n in range(max(1, spec.books // 8))]
+    # Cumulative once, choices() would otherwise sum the weights for every book
+    author_weights = list(accumulate(1 / rank ** spec.skew for rank in range(1, len(authors) + 1)))
+
+    def books():
+        for n in range(spec.books):
+            yield Book(
+                title=" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).title(),
+                author=rng.choices(authors, cum_weights=author_weights)[0],
+                publisher=rng.choice(PUBLISHERS),
+                rating=rng.randint(1, 5) if rng.random() < 0.3 else None,
+                published_date=date(1950, 1, 1) + timedelta(days=rng.randrange(27_000)),
+                isbn=f"979{n:010d}",
+                blurb=" ".join(_sentence(rng, 6, 14) for _ in range(rng.randint(2, 5))),
+                author_bio=_sentence(rng, 8, 20) if rng.random() < 0.5 else None,
+            )
+    book_ids = _bulk(Book, books(), spec.batch_size)
+    log(f"{len(book_ids)} books")
+
+    def categories():
+        for book_id in book_ids:
+            for genre_id in rng.sample(genre_ids, rng.randint(1, 3)):
+                yield Book.genre.through(book_id=book_id, genre_id=genre_id)
+            for tag_id in rng.sample(tag_ids, rng.randint(0, min(5, len(tag_ids)))):
+                yield Book.tags.through(book_id=book_id, tag_id=tag_id)
+    _bulk_through(categories(), spec.batch_size)
+
+    # Popularity order: rank 1 is the most voted and most commented book
+    ranked = book_ids[:]
+    rng.shuffle(ranked)
+    vote_counts = zipf_counts(spec.votes, len(ranked), spec.skew, cap=len(user_ids))
+    comment_counts = zipf_counts(spec.comments, len(ranked), spec.skew)
+
+    def votes():
+        for book_id, count in zip(ranked, vote_counts):
+            # Each book has its own quality, ratings scatter around it
+            quality = rng.uniform(2.0, 4.8)
+            for user_id in rng.sample(user_ids, count):
+                rating = min(5, max(1, round(rng.gauss(quality, 1.0))))
+                yield Vote(book_id=book_id, user_id=user_id, rating=rating)
+    vote_total = len(_bulk(Vote, votes(), spec.batch_size))
+    log(f"{vote_total} votes")
+
+    def comments():
+        for book_id, count in zip(ranked, comment_counts):
+            for _ in range(count):
+                yield Comment(book_id=book_id, user_id=rng.choice(user_ids), content=_sentence(rng, 5, 40))
+    comment_total = len(_bulk(Comment, comments(), spec.batch_size))
+    log(f"{comment_total} comments")
+
+    Book.objects.recompute_vote_totals()
+    search.rebuild_index()
+    leaderboards.rebuild()
+    facets.invalidate()
+    touch_catalogue()
+    log("vote aggregates, search index, leaderboards and facets rebuilt")
+    return {
+        "genres": len(genre_ids), "tags": len(tag_ids), "users": len(user_ids) + 1,
+        "books": len(book_ids), "votes": vote_total, "comments": comment_total,
+    }
+
+
+def _bulk_through(rows, batch_size):
+    """bulk_create() M2M rows of both through models from one stream"""
+    batches = {}
+    for row in rows:
+        batch = batches.setdefault(type(row), [])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            type(row).objects.bulk_create(batch)
+            batch.clear()
+    for model, batch in batches.items():
+        if batch:
+            model.objects.bulk_create(batch)
@@ -0,0 +1,63 @@
+"""Full rebuild time of the similar books at catalogue sizes the database here does not hold.
+
+The feature arrays are drawn straight into NumPy with the shapes
+generate_catalogue gives them (a few tags and genres per book, authors with
+several books, Zipf-distributed votes), so a 1M book catalogue takes seconds
+to make instead of hours of inserts. The database write of the neighbours is
+left out; the command reports it separately for the real catalogue.
+"""
+import time
+
+import numpy as np
+
+from projectcv import recommendations
+from projectcv.benchmarks.generator import GENRES, zipf_counts
+
+
+def synthetic_arrays(spec):
+    rng = np.random.default_rng(spec.seed)
+    book_ids = np.arange(1, spec.books + 1, dtype=np.int64)
+
+    def per_book(low, high, choices):
+        counts = rng.integers(low, high + 1, spec.books)
+        pairs = np.stack([np.repeat(book_ids, counts), rng.integers(1, choices + 1, counts.sum())])
+        # Unique like the rows of an M2M table
+        return list(np.unique(pairs, axis=1))
+
+    tags = per_book(0, 5, spec.tags)
+    genres = per_book(1, 3, len(GENRES))
+    authors = [book_ids, rng.integers(0, max(1, spec.books // 5), spec.books)]
+    counts = np.array(zipf_counts(spec.votes, spec.books, spec.skew, cap=spec.users))
+    voted = np.repeat(rng.permutation(book_ids), counts)
+    votes = [voted, rng.integers(1, spec.users + 1, len(voted)), rng.integers(1, 6, len(voted))]
+    return book_ids, tags, genres, authors, votes
+
+
+def measure(spec, sample=None, k=recommendations.NEIGHBOURS, batch_size=recommendations.BATCH_SIZE, workers=None):
+    """Seconds to build the features and to find the neighbours of every book.
+
+    With sample set, only that many books (spread over the catalogue) are
+    searched and the neighbour time is extrapolated to all of them.
+    """
+    arrays = synthetic_arrays(spec)
+    started = time.perf_counter()
+    features = recommendations.build_features(*arrays)
+    build = time.perf_counter() - started
+
+    rows = np.arange(spec.books)
+    if sample and sample < spec.books:
+        rows = np.linspace(0, spec.books - 1, sample).astype(np.int64)
+    started = time.perf_counter()
+    for _ in recommendations.neighbour_batches(features, rows, k, batch_size, workers):
+        pass
+    search = (time.perf_counter() - started) * spec.books / len(rows)
+    return {
+        "books": spec.books,
+        "features": features.matrix.shape[1] + features.genres.shape[1],
+        "nonzeros": int(features.matrix.nnz + features.genres.nnz),
+        "genre_table": features.genre_table is not None,
+        "build_s": round(build, 2),
+        "neighbours_s": round(search, 2),
+        "sampled_books": len(rows),
+        "total_s": round(build + search, 2),
+    }
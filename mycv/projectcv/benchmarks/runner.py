@@ -0,0 +1,149 @@
+"""Run scenarios through the test client and compare results with a baseline.
+
+Latency is measured without tracing; peak memory comes from one extra
+request per scenario under tracemalloc, which slows it down too much to be
+timed. Queries are counted on the request thread's connection.
+"""
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from projectcv.models import Book, Comment, User, Vote
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class Runner:
+    def __init__(self, fixture, requests=50, warmup=5, seed=42, cold=False, host="localhost"):
+        self.fixture = fixture
+        self.requests = requests
+        self.warmup = warmup
+        self.seed = seed
+        self.cold = cold
+        self.host = host
+        self.clients = {}
+
+    def client_for(self, user):
+        # One client per user, so sessions stay logged in across requests
+        key = user.pk if user else None
+        if key not in self.clients:
+            client = Client(headers={"host": self.host})
+            if user:
+                client.force_login(user)
+            self.clients[key] = client
+        return self.clients[key]
+
+    def send(self, request):
+        client = self.client_for(request.user)
+        response = getattr(client, request.method)(request.path, request.data)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{request.method.upper()} {request.path} answered {response.status_code}")
+        return response
+
+    def run(self, name, scenario):
+        rng = random.Random(f"{self.seed}:{name}")
+        for _ in range(self.warmup):
+            self.send(scenario(rng, self.fixture))
+
+        latencies, queries = [], []
+        for _ in range(self.requests):
+            request = scenario(rng, self.fixture)
+            if self.cold:
+                for cache in caches.all():
+                    cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                self.send(request)
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+
+        tracemalloc.start()
+        try:
+            self.send(scenario(rng, self.fixture))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        latencies.sort()
+        queries.sort()
+        return {
+            "requests": len(latencies),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "queries_median": percentile(queries, 50),
+            "queries_max": queries[-1],
+            "peak_memory_kb": round(peak / 1024),
+        }
+
+
+def environment(seed, cold):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "seed": seed,
+        "cold_cache": cold,
+        "catalogue": {
+            "books": Book.objects.count(),
+            "users": User.objects.count(),
+            "votes": Vote.objects.count(),
+            "comments": Comment.objects.count(),
+        },
+    }
+
+
+def save(path, results):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+
+# Regression thresholds for compare(): relative latency growth, any extra query
+LATENCY_TOLERANCE = 0.15
+
+
+def compare(baseline, current):
+    """Lines describing each scenario against the baseline, and whether any regressed"""
+    lines, regressed = [], False
+    for name, now in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before is None:
+            lines.append(f"{name}: new scenario")
+            continue
+        flags = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if before[metric] and now[metric] > before[metric] * (1 + LATENCY_TOLERANCE):
+                flags.append(metric)
+        if now["queries_median"] > before["queries_median"]:
+            flags.append("queries")
+        regressed = regressed or bool(flags)
+        change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        lines.append(
+            f"{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms ({change:+.0f}%), "
+            f"queries {before['queries_median']} -> {now['queries_median']}"
+            + (f"  REGRESSION: {', '.join(flags)}" if flags else "")
+        )
+    return lines, regressed
@@ -0,0 +1,118 @@
+"""Request scenarios measured by run_benchmarks.
+
+A scenario turns a random.Random and the Fixture of the catalogue under test
+into one request; the runner calls it once per measured request, so pages,
+books and votes vary the way real traffic does, but reproducibly.
+"""
+from dataclasses import dataclass, field
+
+from django.db.models import Count, Max
+from django.utils.http import urlencode
+
+from projectcv.models import Book, Genre, User
+from projectcv.pagination import encode_cursor
+
+
+@dataclass
+class BenchRequest:
+    path: str
+    method: str = "get"
+    data: dict = field(default_factory=dict)
+    user: object = None  # logged in with force_login() when set
+
+
+@dataclass
+class Fixture:
+    """What the scenarios need to know about the catalogue, read once before the run"""
+    popular_books: list
+    tail_books: list
+    top_genre: int
+    max_book_id: int
+    users: list
+    admin: object
+    search_terms: list
+
+    @classmethod
+    def load(cls):
+        by_votes = Book.objects.order_by("-vote_count", "id").values_list("id", flat=True)
+        top_genre = Genre.objects.annotate(n=Count("book")).order_by("-n").values_list("id", flat=True).first()
+        titles = Book.objects.order_by("-vote_count").values_list("title", flat=True)[:50]
+        return cls(
+            popular_books=list(by_votes[:50]),
+            tail_books=list(Book.objects.order_by("vote_count", "-id").values_list("id", flat=True)[:500]),
+            top_genre=top_genre,
+            max_book_id=Book.objects.aggregate(top=Max("id"))["top"] or 0,
+            users=list(User.objects.filter(is_admin=False).order_by("id")[:200]),
+            admin=User.objects.filter(is_admin=True).order_by("id").first(),
+            search_terms=sorted({word for title in titles for word in title.lower().split()}) or ["book"],
+        )
+
+
+def _index(**params):
+    return "/projectcv/book_index/" + (f"?{urlencode(params)}" if params else "")
+
+
+def index(rng, fx):
+    return BenchRequest(_index())
+
+
+def index_filtered(rng, fx):
+    return BenchRequest(_index(genre=fx.top_genre, rating=rng.randint(1, 5)))
+
+
+def index_deep_page(rng, fx):
+    # Numbered pages far from the start: OFFSET cost grows with the page number
+    deepest = max(1, fx.max_book_id // 20 // 2)
+    return BenchRequest(_index(page=rng.randint(max(1, deepest // 2), deepest)))
+
+
+def index_deep_cursor(rng, fx):
+    boundary = rng.randint(1, max(1, fx.max_book_id // 2))
+    filters = {"q": "", "author": "", "genre": "", "rating": ""}
+    return BenchRequest(_index(cursor=encode_cursor("next", boundary, filters)))
+
+
+def detail_popular(rng, fx):
+    return BenchRequest(f"/projectcv/{rng.choice(fx.popular_books)}/book_detail/")
+
+
+def detail_tail(rng, fx):
+    return BenchRequest(f"/projectcv/{rng.choice(fx.tail_books)}/book_detail/")
+
+
+def vote(rng, fx):
+    return BenchRequest(
+        f"/projectcv/{rng.choice(fx.popular_books)}/book_detail/",
+        method="post", data={"vote_rating": str(rng.randint(1, 5))}, user=rng.choice(fx.users),
+    )
+
+
+def search(rng, fx):
+    return BenchRequest(_index(q=rng.choice(fx.search_terms)))
+
+
+def api_books(rng, fx):
+    return BenchRequest("/projectcv/api/v1/books/?limit=100")
+
+
+def admin_books(rng, fx):
+    return BenchRequest("/admin/projectcv/book/", user=fx.admin)
+
+
+def admin_votes(rng, fx):
+    return BenchRequest("/admin/projectcv/vote/", user=fx.admin)
+
+
+SCENARIOS = {
+    "index": index,
+    "index_filtered": index_filtered,
+    "index_deep_page": index_deep_page,
+    "index_deep_cursor": index_deep_cursor,
+    "detail_popular": detail_popular,
+    "detail_tail": detail_tail,
+    "vote": vote,
+    "search": search,
+    "api_books": api_books,
+    "admin_books": admin_books,
+    "admin_votes": admin_votes,
+}
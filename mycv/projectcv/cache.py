@@ -0,0 +1,33 @@
+import os
+import threading
+from collections import Counter
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+_missing = object()
+
+
+class InstrumentedFileBasedCache(FileBasedCache):
+    """File-based cache that counts hits and misses of get(), used for template fragments"""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, _missing, version)
+        with _stats_lock:
+            _stats["misses" if value is _missing else "hits"] += 1
+        return default if value is _missing else value
+
+
+def fragment_cache_stats():
+    """Hit/miss counters of this worker process since it started"""
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    lookups = hits + misses
+    return {
+        "pid": os.getpid(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / lookups, 3) if lookups else None,
+    }
@@ -0,0 +1,187 @@
+"""Streaming readers and writers for catalogue files (CSV, JSON Lines, ONIX 3.0).
+
+Every reader is a generator of plain dicts with the keys in COLUMNS and every
+writer a generator of text chunks, so a file is never held in memory as a
+whole whatever its size.
+"""
+import csv
+import json
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+
+
+# Columns shared by the import and export commands; genres and tags are lists
+COLUMNS = (
+    "title", "author", "publisher", "isbn", "ean", "published_date", "rating",
+    "blurb", "author_bio", "genres", "tags",
+)
+# Exports add the stored vote aggregates; the importer ignores them
+EXPORT_COLUMNS = COLUMNS + ("vote_count", "average_rating")
+LIST_SEPARATOR = "|"
+
+# ONIX code list 5: product identifier types
+ONIX_ISBN13 = "15"
+ONIX_GTIN13 = "03"
+
+
+def _split(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [part.strip() for part in str(value).split(LIST_SEPARATOR) if part.strip()]
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    for fmt in ("%Y-%m-%d", "%Y%m%d", "%Y"):
+        try:
+            return datetime.strptime(str(value).strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_rating(value):
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        return None
+    return rating if 1 <= rating <= 5 else None
+
+
+def normalize(record):
+    """Clean one raw record into the COLUMNS shape, empty strings and lists become None"""
+    row = {}
+    for column in COLUMNS:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = value.strip() or None
+        row[column] = value
+    # None, like an empty scalar, leaves the book's links as they are on import
+    row["genres"] = _split(record.get("genres")) or None
+    row["tags"] = _split(record.get("tags")) or None
+    row["published_date"] = _parse_date(row["published_date"])
+    row["rating"] = _parse_rating(row["rating"])
+    for column in ("isbn", "ean"):
+        if row[column]:
+            row[column] = str(row[column]).replace("-", "").replace(" ", "")
+    return row
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as fh:
+        for record in csv.DictReader(fh):
+            yield normalize(record)
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            if line.strip():
+                yield normalize(json.loads(line))
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text(element, *path):
+    """Text of the first descendant following the local tag names in path (namespace agnostic)"""
+    current = [element]
+    for name in path:
+        current = [child for parent in current for child in parent if _local(child.tag) == name]
+        if not current:
+            return None
+    return (current[0].text or "").strip() or None
+
+
+def _onix_product(product):
+    record = {"genres": [], "tags": []}
+    for identifier in (c for c in product if _local(c.tag) == "ProductIdentifier"):
+        id_type, value = _text(identifier, "ProductIDType"), _text(identifier, "IDValue")
+        if id_type == ONIX_ISBN13:
+            record["isbn"] = value
+        elif id_type == ONIX_GTIN13:
+            record["ean"] = value
+    record["title"] = _text(product, "DescriptiveDetail", "TitleDetail", "TitleElement", "TitleText")
+    record["author"] = _text(product, "DescriptiveDetail", "Contributor", "PersonName")
+    record["publisher"] = _text(product, "PublishingDetail", "Publisher", "PublisherName")
+    record["published_date"] = _text(product, "PublishingDetail", "PublishingDate", "Date")
+    record["blurb"] = _text(product, "CollateralDetail", "TextContent", "Text")
+    for detail in (c for c in product if _local(c.tag) == "DescriptiveDetail"):
+        for subject in (c for c in detail if _local(c.tag) == "Subject"):
+            heading = _text(subject, "SubjectHeadingText")
+            if heading:
+                record["genres"].append(heading)
+        for contributor in (c for c in detail if _local(c.tag) == "Contributor"):
+            bio = _text(contributor, "BiographicalNote")
+            if bio:
+                record["author_bio"] = bio
+                break
+    return normalize(record)
+
+
+def read_onix(path):
+    """ONIX 3.0 reference-tag feed, one <Product> in memory at a time"""
+    root = None
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = element
+        if event == "end" and _local(element.tag) == "Product":
+            yield _onix_product(element)
+            root.clear()  # drop finished products, not just their content
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl, "onix": read_onix}
+
+
+def guess_format(path):
+    lowered = str(path).lower()
+    if lowered.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    if lowered.endswith(".xml"):
+        return "onix"
+    return "csv"
+
+
+def export_rows(queryset, chunk_size=2000):
+    """Books as EXPORT_COLUMNS dicts.
+
+    iterator() with prefetch_related fetches genres and tags once per chunk,
+    and the vote aggregates are columns of Book, so memory stays flat and the
+    query count grows with the number of chunks, not rows.
+    """
+    books = queryset.only(*EXPORT_COLUMNS[:9], "vote_count", "average_rating").prefetch_related("genre", "tags")
+    for book in books.iterator(chunk_size=chunk_size):
+        row = {column: getattr(book, column) for column in EXPORT_COLUMNS if column not in ("genres", "tags")}
+        row["published_date"] = book.published_date.isoformat() if book.published_date else None
+        row["genres"] = [genre.genre_name for genre in book.genre.all()]
+        row["tags"] = [tag.tag_title for tag in book.tags.all()]
+        yield row
+
+
+class _Echo:
+    """File-like object whose write() hands back the line, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def write_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        values = dict(row, genres=LIST_SEPARATOR.join(row["genres"]), tags=LIST_SEPARATOR.join(row["tags"]))
+        yield writer.writerow(["" if values[c] is None else values[c] for c in EXPORT_COLUMNS])
+
+
+def write_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+WRITERS = {"csv": (write_csv, "text/csv"), "jsonl": (write_jsonl, "application/x-ndjson")}
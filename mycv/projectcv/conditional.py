@@ -0,0 +1,119 @@
+"""Validators for HTTP conditional GET on the book pages.
+
+Both pages contain per-user parts (staff buttons, the user's own vote, the
+e-mail in the footer, flash messages), so the ETag includes the user and
+Last-Modified is only sent to anonymous visitors. Every function here costs
+at most one indexed lookup and never loads the book, its comments or votes.
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from . import facets
+from .models import Book
+
+
+CATALOGUE_CHANGED_KEY = "projectcv:catalogue:changed"
+
+
+def touch_catalogue():
+    """Record that something shown on the book index changed, including deletes"""
+    cache.set(CATALOGUE_CHANGED_KEY, timezone.now(), timeout=None)
+
+
+def catalogue_changed():
+    changed = cache.get(CATALOGUE_CHANGED_KEY)
+    if changed is None:
+        # Cache was cleared: start a new validator, clients revalidate once
+        changed = timezone.now()
+        cache.add(CATALOGUE_CHANGED_KEY, changed, timeout=None)
+        changed = cache.get(CATALOGUE_CHANGED_KEY, changed)
+    return changed
+
+
+def can_revalidate(request):
+    # Pending flash messages must be rendered; len() does not mark them as read
+    return not len(get_messages(request))
+
+
+def _etag(request, version):
+    user = request.user.pk if request.user.is_authenticated else "anonymous"
+    raw = f"{version}|{user}|{request.get_full_path()}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _book_updated_at(request, pk):
+    # Shared by the ETag and Last-Modified functions, so one query per request
+    if not hasattr(request, "_book_updated_at"):
+        request._book_updated_at = Book.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+    return request._book_updated_at
+
+
+def book_etag(request, pk, *args, **kwargs):
+    if not can_revalidate(request):
+        return None
+    updated_at = _book_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return _etag(request, updated_at.isoformat())
+
+
+def book_last_modified(request, pk, *args, **kwargs):
+    if request.user.is_authenticated or not can_revalidate(request):
+        return None
+    return _book_updated_at(request, pk)
+
+
+def index_etag(request, *args, **kwargs):
+    if not can_revalidate(request):
+        return None
+    return _etag(request, f"{catalogue_changed().isoformat()}|{facets.get_version()}")
+
+
+def index_last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated or not can_revalidate(request):
+        return None
+    return catalogue_changed()
+
+
+def revalidated(etag_func, last_modified_func):
+    """Async view-method counterpart of ``views.revalidate`` plus ``condition()``.
+
+    In Django 4.2 condition(), cache_control() and vary_on_cookie() only wrap
+    sync views and method_decorator() hides that a method is a coroutine, so
+    the same headers are applied here. Both validators run in one
+    sync_to_async() call, as they read the session and the database.
+    """
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs)
+        last_modified = last_modified_func(request, *args, **kwargs)
+        if last_modified is not None and not timezone.is_aware(last_modified):
+            last_modified = timezone.make_aware(last_modified, datetime.timezone.utc)
+        return (
+            quote_etag(etag) if etag else None,
+            int(last_modified.timestamp()) if last_modified else None,
+        )
+
+    def decorator(method):
+        @wraps(method)
+        async def inner(self, request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await method(self, request, *args, **kwargs)
+            if last_modified and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault("ETag", etag)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ("Cookie",))
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,57 @@
+import time
+
+from django.core.cache import cache
+from django.db.models import Count, Min
+from django.db.models.functions import Lower
+
+from .models import Book, Genre
+
+
+VERSION_KEY = "projectcv:facets:version"
+FACETS_KEY = "projectcv:facets:{version}"
+FACETS_TIMEOUT = 60 * 60 * 24  # invalidation is signal driven, the timeout only evicts old versions
+
+
+def get_version():
+    """Current facet version, shared by every process that uses the same cache backend"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so an evicted version key can never revive an old entry
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate():
+    """Move every process on to a new version; the old entry simply expires"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def build_facets():
+    """Sidebar filter options with the number of books behind each"""
+    # One entry per author whatever the case of each spelling, as the author filter matches
+    authors = list(
+        Book.objects.values(author_lower=Lower("author")).order_by("author_lower")
+        .annotate(author=Min("author"), book_count=Count("id")).values("author", "book_count")
+    )
+    genres = list(
+        Genre.objects.order_by("genre_name").annotate(book_count=Count("book")).values("id", "genre_name", "book_count")
+    )
+    rating_counts = dict(
+        Book.objects.filter(rating__isnull=False).order_by().values_list("rating").annotate(Count("id"))
+    )
+    ratings = [{"value": value, "book_count": rating_counts.get(value, 0)} for value in range(1, 6)]
+    return {"authors": authors, "genres": genres, "ratings": ratings}
+
+
+def get_facets():
+    """Cached sidebar facets - no database query on a warm cache"""
+    key = FACETS_KEY.format(version=get_version())
+    facets = cache.get(key)
+    if facets is None:
+        facets = build_facets()
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
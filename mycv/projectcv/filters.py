@@ -0,0 +1,32 @@
+from django.db.models import Value
+from django.db.models.functions import Lower
+
+from .models import Book
+from .search import search_books
+
+
+# GET parameters of the book index, also accepted by the export view and command
+INDEX_FILTERS = ("q", "author", "genre", "rating")
+
+
+def filter_books(queryset, filters):
+    """Apply the book index filters (missing or empty values are ignored)"""
+    q = filters.get("q")
+    author = filters.get("author")
+    genre = filters.get("genre")
+    rating = filters.get("rating")
+
+    # Apply filters if parameters exist
+    if q:
+        queryset = search_books(queryset, q)  # ranked full-text search, best matches first
+    if author:
+        # Case-insensitive like the author facet; lower() on both sides, so the database folds case
+        # the same way on each and book_author_lower_idx is used
+        queryset = queryset.alias(author_lower=Lower("author")).filter(author_lower=Lower(Value(author)))
+    if genre:
+        # IN (subquery) rather than a join: the ids come out of book_genre_genre_book_idx in order,
+        # so ORDER BY -id needs no sort over every book of the genre
+        queryset = queryset.filter(pk__in=Book.genre.through.objects.filter(genre_id=genre).values("book_id"))
+    if rating:
+        queryset = queryset.filter(rating=rating)
+    return queryset
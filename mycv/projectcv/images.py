@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+
+# Widths generated per image field, never wider than the original
+DERIVATIVE_WIDTHS = {
+    "image": (160, 320, 640),
+    "author_photo": (96, 192, 384),
+}
+
+# Output formats in order of preference (modern first), with their Pillow save options
+FORMAT_OPTIONS = {
+    "avif": {"format": "AVIF", "quality": 55},
+    "webp": {"format": "WEBP", "quality": 75, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 80, "optimize": True, "progressive": True},
+}
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+# What transparent areas become, the derivatives are encoded without alpha
+BACKGROUND = (255, 255, 255)
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def available_formats():
+    """Output formats this Pillow build can encode, AVIF needs libavif"""
+    formats = []
+    for name in FORMAT_OPTIONS:
+        try:
+            supported = name == "jpeg" or features.check(name)
+        except ValueError:
+            supported = False
+        if supported:
+            formats.append(name)
+    return formats
+
+
+def file_digest(name, storage=default_storage):
+    """sha256 of a stored file, read in chunks"""
+    digest = hashlib.sha256()
+    with storage.open(name, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def flatten(image):
+    """RGB or L version of an image, transparent areas composited onto BACKGROUND.
+
+    convert("RGB") simply drops the alpha channel, which turns transparent
+    pixels (usually stored as black) black.
+    """
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        flat = Image.new("RGB", image.size, BACKGROUND)
+        flat.paste(image, mask=image.getchannel("A"))
+        return flat
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def derivative_name(source_name, digest, width, fmt):
+    """Name next to the original, unique per source content, width and format"""
+    directory, filename = posixpath.split(source_name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, f"{stem}.{digest[:12]}.{width}w.{fmt}")
+
+
+def build_variants(source_name, widths, source_storage=default_storage):
+    """Write resized copies of a stored image in every available format.
+
+    Returns the manifest saved on the book: the source name and, per format, a
+    list of [width, name] pairs. Derivatives always go through default_storage
+    under the names from derivative_name(); files that already exist are not
+    re-encoded, so running it twice over the same content is cheap.
+    """
+    storage = default_storage
+    digest = file_digest(source_name, source_storage)
+    with source_storage.open(source_name, "rb") as fh:
+        image = ImageOps.exif_transpose(Image.open(fh))
+        image.load()
+    image = flatten(image)
+
+    # Always keep one variant at the original width, but never upscale
+    targets = sorted({w for w in widths if w < image.width} | {min(max(widths), image.width)})
+    variants = {}
+    for fmt in available_formats():
+        variants[fmt] = []
+        for width in targets:
+            name = derivative_name(source_name, digest, width, fmt)
+            if not storage.exists(name):
+                height = max(1, round(image.height * width / image.width))
+                buffer = BytesIO()
+                image.resize((width, height), Image.LANCZOS).save(buffer, **FORMAT_OPTIONS[fmt])
+                storage.save(name, ContentFile(buffer.getvalue()))
+            variants[fmt].append([width, name])
+    return {"source": source_name, "sha256": digest, "variants": variants}
+
+
+def variants_for(field_file, manifest):
+    """Manifest to store for an image field - empty when there is no image or it cannot be read"""
+    if not field_file:
+        return {}
+    if manifest and manifest.get("source") == field_file.name:
+        return manifest
+    try:
+        return build_variants(field_file.name, DERIVATIVE_WIDTHS[field_file.field.name], field_file.storage)
+    except (OSError, UnidentifiedImageError):
+        logger.warning("Could not build image derivatives for %s", field_file.name, exc_info=True)
+        return {}
+
+
+def srcset(manifest, fmt):
+    return ", ".join(f"{default_storage.url(name)} {width}w" for width, name in manifest.get("variants", {}).get(fmt, []))
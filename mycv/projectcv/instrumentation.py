@@ -0,0 +1,173 @@
+"""Per-request SQL instrumentation and query budgets.
+
+QueryCountMiddleware counts the statements a request runs, their total time
+and the repeated ones (the same SQL text more than once - the signature of an
+N+1), whatever DEBUG is. The numbers go out as a Server-Timing header and as
+one JSON log line on the ``projectcv.queries`` logger.
+
+A view declares its budget with @query_budget(n); going over it logs a
+warning, or raises QueryBudgetExceeded when settings.QUERY_BUDGET_STRICT is
+set, which is how the tests fail on a regression.
+
+The middleware runs sync or async, as the handler it is part of. Statements
+are recorded by record_query(), installed once on every database connection,
+into the QueryStats of the request held in a ContextVar: sync_to_async()
+copies the context into its thread, so queries the async views run in worker
+threads (thread_sensitive=False included) count towards their request.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger("projectcv.queries")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """Declare the most queries one request to the decorated view (function or class) may run"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def get_query_budget(view_func):
+    # as_view() functions carry the class, the budget is declared on the class
+    budget = getattr(view_func, "query_budget", None)
+    if budget is None:
+        budget = getattr(getattr(view_func, "view_class", None), "query_budget", None)
+    return budget
+
+
+class QueryStats:
+    """Every statement of one request, recorded from whichever thread ran it"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, sql, duration):
+        with self.lock:
+            self.duration += duration
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        """Executions of a statement already run in this request"""
+        return sum(n - 1 for n in self.statements.values())
+
+    def most_repeated(self):
+        sql, n = self.statements.most_common(1)[0] if self.statements else ("", 0)
+        return (sql, n) if n > 1 else (None, 0)
+
+    def server_timing(self):
+        return f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries, {self.duplicates} repeated"'
+
+
+_request_stats = ContextVar("projectcv_query_stats", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper() of every connection, a no-op outside a request"""
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(sql, time.perf_counter() - started)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Connections of worker threads are opened during the request
+    install(connection)
+
+
+class QueryCountMiddleware:
+    """Measure the SQL of every request, see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def start(self):
+        for connection in connections.all(initialized_only=True):
+            install(connection)
+        stats = QueryStats()
+        return stats, _request_stats.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        total = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else None
+        budget = get_query_budget(match.func) if match else None
+        response.query_stats = stats
+        response.query_budget = budget
+        response["Server-Timing"] = f'{stats.server_timing()}, app;dur={total * 1000:.2f}'
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "queries": stats.count,
+            "sql_ms": round(stats.duration * 1000, 2),
+            "total_ms": round(total * 1000, 2),
+            "repeated": stats.duplicates,
+            "budget": budget,
+        }
+        if budget is not None and stats.count > budget:
+            sql, times = stats.most_repeated()
+            record["most_repeated"] = {"sql": sql, "times": times} if sql else None
+            message = f"{request.method} {request.path} ran {stats.count} queries, the budget of {view} is {budget}"
+            if getattr(settings, "QUERY_BUDGET_STRICT", False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(json.dumps(record), extra={"query_stats": record})
+        else:
+            logger.info(json.dumps(record), extra={"query_stats": record})
+        return response
@@ -0,0 +1,208 @@
+"""Background jobs kept in the database, run by `manage.py run_workers`.
+
+Work too slow for a request is registered with @task and queued with
+enqueue(): one Job row, written when the surrounding transaction commits,
+so a worker never looks for data the request has not committed yet. Jobs
+with the same name and arguments are queued once while one of them is
+pending (job_pending_key_uniq); once it is running an identical job can be
+queued again, as the data it read may already be stale.
+
+Workers take the next due job with a conditional UPDATE (pending ->
+running), so two processes never run the same job, on SQLite as well as
+on a database with SELECT ... FOR UPDATE SKIP LOCKED. A job that raises is
+tried again after an exponential backoff, up to its max_attempts, then left
+as failed with its traceback; a running job whose worker died is treated
+the same way once it has run for longer than settings.JOBS_TIMEOUT.
+
+With settings.JOBS_INLINE the jobs run in the process that queues them,
+still after the commit - for development without a worker running.
+
+No broker: the queue is the projectcv_job table, stats() reads its depth
+and the latency of the recently finished jobs.
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Count, F, Min
+from django.utils import timezone
+
+from .backends.retry import retry_on_busy
+from .models import Job
+
+logger = logging.getLogger("projectcv.jobs")
+
+
+REGISTRY = {}
+DEFAULT_MAX_ATTEMPTS = 5
+# First retry after about BACKOFF_SECONDS, doubling up to BACKOFF_MAX_SECONDS
+BACKOFF_SECONDS = 10
+BACKOFF_MAX_SECONDS = 60 * 60
+# Finished jobs kept for the latency figures
+KEEP_FINISHED = timedelta(days=7)
+# Jobs the latency percentiles are computed over
+STATS_SAMPLE = 1000
+
+
+def task(name, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register a function as the job `name`; its arguments must be JSON serializable.
+
+    It is called with the job's arguments and using=, the database the job was queued in.
+    """
+    def decorator(func):
+        REGISTRY[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def job_key(name, args):
+    raw = json.dumps([name, args], cls=DjangoJSONEncoder, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def timeout():
+    return timedelta(seconds=getattr(settings, "JOBS_TIMEOUT", 30 * 60))
+
+
+def enqueue(name, *args, delay=0, using=DEFAULT_DB_ALIAS):
+    """Queue the job `name` with args once the current transaction (if any) commits"""
+    if name not in REGISTRY:
+        raise LookupError(f"No job named {name!r}")
+    args = json.loads(json.dumps(list(args), cls=DjangoJSONEncoder))  # as the worker will see them
+
+    if getattr(settings, "JOBS_INLINE", False):
+        transaction.on_commit(lambda: REGISTRY[name][0](*args, using=using), using=using)
+        return
+
+    @retry_on_busy(using=using)
+    def insert():
+        now = timezone.now()
+        # An identical pending job is already queued when the INSERT is ignored
+        Job.objects.using(using).bulk_create([Job(
+            name=name, args=args, key=job_key(name, args), max_attempts=REGISTRY[name][1],
+            run_at=now + timedelta(seconds=delay), created_at=now,
+        )], ignore_conflicts=True)
+    transaction.on_commit(insert, using=using)
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker, using=DEFAULT_DB_ALIAS):
+    """Mark the next due job as running by this worker and return it, None when nothing is due"""
+    now = timezone.now()
+    due = Job.objects.using(using).filter(status=Job.PENDING, run_at__lte=now).order_by("run_at", "id")
+    for job in due.select_for_update(skip_locked=True)[:5]:
+        # Conditional: another worker may have taken it since the SELECT
+        taken = Job.objects.using(using).filter(pk=job.pk, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now, worker=worker, attempts=F("attempts") + 1,
+        )
+        if taken:
+            job.status, job.started_at, job.worker, job.attempts = Job.RUNNING, now, worker, job.attempts + 1
+            return job
+    return None
+
+
+def backoff(attempts):
+    """Seconds before the next try of a job that failed `attempts` times, with jitter"""
+    seconds = min(BACKOFF_MAX_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return seconds * random.uniform(0.5, 1.5)
+
+
+def _claimed(job, using):
+    """The job's row while still running as claimed: recover() may have handed it to another worker since"""
+    return Job.objects.using(using).filter(pk=job.pk, status=Job.RUNNING, worker=job.worker, attempts=job.attempts)
+
+
+def _failed(job, error, using):
+    now = timezone.now()
+    jobs = _claimed(job, using)
+    if job.attempts >= job.max_attempts:
+        jobs.update(status=Job.FAILED, finished_at=now, last_error=error)
+        logger.error("Job %s failed for good after %d attempts", job, job.attempts)
+        return
+    try:
+        with transaction.atomic(using=using):
+            jobs.update(status=Job.PENDING, run_at=now + timedelta(seconds=backoff(job.attempts)), last_error=error)
+    except IntegrityError:
+        # An identical job was queued meanwhile, it does the work
+        jobs.delete()
+
+
+def run(job, using=DEFAULT_DB_ALIAS):
+    """Run a claimed job and record the outcome, returns whether it succeeded"""
+    func, _ = REGISTRY.get(job.name, (None, None))
+    try:
+        if func is None:
+            raise LookupError(f"No job named {job.name!r}")
+        func(*job.args, using=using)
+    except Exception:
+        logger.warning("Job %s raised on attempt %d", job, job.attempts, exc_info=True)
+        retry_on_busy(_failed, using=using)(job, traceback.format_exc(), using)
+        return False
+    retry_on_busy(_claimed(job, using).update, using=using)(
+        status=Job.DONE, finished_at=timezone.now(), last_error="",
+    )
+    return True
+
+
+def run_next(worker, using=DEFAULT_DB_ALIAS):
+    """Claim and run one due job; None when nothing was due, else whether it succeeded"""
+    job = retry_on_busy(transaction.atomic(using=using)(claim), using=using)(worker, using)
+    return None if job is None else run(job, using)
+
+
+def recover(using=DEFAULT_DB_ALIAS):
+    """Fail (and so retry) the jobs running for longer than JOBS_TIMEOUT, their worker is gone"""
+    stuck = Job.objects.using(using).filter(status=Job.RUNNING, started_at__lt=timezone.now() - timeout())
+    for job in stuck:
+        _failed(job, f"Worker {job.worker} did not finish the job within {timeout()}", using)
+    return len(stuck)
+
+
+def prune(older_than=KEEP_FINISHED, using=DEFAULT_DB_ALIAS):
+    """Delete the jobs that succeeded before older_than; failed jobs stay for inspection"""
+    cutoff = timezone.now() - older_than
+    return Job.objects.using(using).filter(status=Job.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "p50": round(statistics.median(values), 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def stats(using=DEFAULT_DB_ALIAS):
+    """Queue depth per status and, over the last STATS_SAMPLE finished jobs, seconds waited and run"""
+    now = timezone.now()
+    jobs = Job.objects.using(using)
+    depth = dict.fromkeys(dict(Job.STATUSES), 0)
+    depth.update(jobs.order_by().values_list("status").annotate(Count("id")))
+    due = jobs.filter(status=Job.PENDING, run_at__lte=now).aggregate(count=Count("id"), oldest=Min("run_at"))
+    finished = list(
+        jobs.filter(status=Job.DONE, finished_at__isnull=False).order_by("-finished_at")
+        .values_list("run_at", "started_at", "finished_at")[:STATS_SAMPLE]
+    )
+    return {
+        "depth": depth,
+        "due": due["count"],
+        "oldest_due_seconds": round((now - due["oldest"]).total_seconds(), 3) if due["oldest"] else 0,
+        # From due to picked up by a worker, and from picked up to done
+        "wait_seconds": _percentiles([(started - run_at).total_seconds() for run_at, started, _ in finished]),
+        "run_seconds": _percentiles([(done - started).total_seconds() for _, started, done in finished]),
+    }
@@ -0,0 +1,183 @@
+"""Materialized leaderboards: top rated, trending and most discussed, overall and per genre.
+
+LeaderboardEntry holds one row per book and scope (the whole catalogue and
+each of the book's genres) with the score of every board, and an index per
+board ordered by its score, so a page is one index range read whatever the
+size of Vote and Comment.
+
+top_rated is the Bayesian average (m * C + sum of ratings) / (m + votes),
+with C the mean of all votes and m = PRIOR_VOTES: a book with two 5-star
+votes does not outrank one with hundreds of 4.5s. trending counts the votes
+of the last TRENDING_DAYS, most discussed the comments.
+
+Writes keep the rows current with one UPDATE of the book's rows
+(projectcv.signals): a vote recomputes top_rated from the stored aggregates
+and counts towards recent_votes, a comment towards comment_count. Votes
+leave the trending window only when the refresh_leaderboards command,
+run on a schedule, rebuilds the table; it also takes a fresh C.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Greatest
+from django.utils import timezone
+
+from .models import Book, Comment, LeaderboardEntry, Vote
+
+
+@dataclass(frozen=True)
+class Board:
+    field: str
+    title: str
+
+
+BOARDS = {
+    "top_rated": Board("top_rated", "Top rated"),
+    "trending": Board("recent_votes", "Trending"),
+    "most_discussed": Board("comment_count", "Most discussed"),
+}
+PAGE_SIZE = 50
+PRIOR_VOTES = 10
+TRENDING_DAYS = 7
+MEAN_RATING_KEY = "projectcv:leaderboards:mean_rating"
+
+
+def mean_rating(using=DEFAULT_DB_ALIAS):
+    """Mean of all votes (C of the Bayesian average), kept in the cache until the next refresh"""
+    mean = cache.get(MEAN_RATING_KEY)
+    if mean is None:
+        totals = Book.objects.using(using).aggregate(votes=Sum("vote_count"), total=Sum("vote_sum"))
+        mean = totals["total"] / totals["votes"] if totals["votes"] else 3.0
+        cache.set(MEAN_RATING_KEY, mean, timeout=None)
+    return mean
+
+
+def trending_since():
+    return timezone.now() - timedelta(days=TRENDING_DAYS)
+
+
+def page(board, genre_id=None, limit=PAGE_SIZE):
+    """Entries of one leaderboard, best first, with their books"""
+    field = BOARDS[board].field
+    return (
+        LeaderboardEntry.objects.filter(genre_id=genre_id)
+        .order_by(f"-{field}", "-book_id")
+        .select_related("book")
+        .only(field, "book", "book__title", "book__author", "book__vote_count", "book__average_rating",
+              "book__rating")[:limit]
+    )
+
+
+# Incremental updates, called from projectcv.signals
+
+def _changed(book_id, using, **updates):
+    return LeaderboardEntry.objects.using(using).filter(book_id=book_id).update(**updates)
+
+
+def vote_changed(book_id, recent_delta=0, using=DEFAULT_DB_ALIAS):
+    """Recompute top_rated from the book's stored vote aggregates, move recent_votes by recent_delta"""
+    return votes_changed([book_id], recent_delta, using)
+
+
+def votes_changed(book_ids, recent_delta=0, using=DEFAULT_DB_ALIAS):
+    """vote_changed() for several books in one UPDATE"""
+    book = Book.objects.filter(pk=OuterRef("book_id"))
+    total = Cast(Subquery(book.values("vote_sum")), FloatField())
+    count = Cast(Subquery(book.values("vote_count")), FloatField())
+    updates = {"top_rated": (Value(PRIOR_VOTES * mean_rating(using)) + total) / (Value(float(PRIOR_VOTES)) + count)}
+    if recent_delta:
+        updates["recent_votes"] = Greatest(F("recent_votes") + recent_delta, 0)
+    return LeaderboardEntry.objects.using(using).filter(book_id__in=list(book_ids)).update(**updates)
+
+
+def comment_changed(book_id, delta, using=DEFAULT_DB_ALIAS):
+    return _changed(book_id, using, comment_count=Greatest(F("comment_count") + delta, 0))
+
+
+def book_added(book_id, using=DEFAULT_DB_ALIAS):
+    """Catalogue-wide row of a new book; its genre rows follow as the genres are added"""
+    books_added([book_id], using)
+
+
+def books_added(book_ids, using=DEFAULT_DB_ALIAS):
+    """book_added() for books created without signals (bulk_create)"""
+    mean = mean_rating(using)
+    LeaderboardEntry.objects.using(using).bulk_create(
+        [LeaderboardEntry(book_id=book_id, top_rated=mean) for book_id in book_ids],
+        batch_size=500, ignore_conflicts=True,
+    )
+
+
+def genres_added(pairs, using=DEFAULT_DB_ALIAS):
+    """Rows for (book id, genre id) pairs, scores copied from the books' catalogue-wide rows"""
+    pairs = list(pairs)
+    for start in range(0, len(pairs), 500):
+        batch = pairs[start:start + 500]
+        overall = {
+            entry.book_id: entry
+            for entry in LeaderboardEntry.objects.using(using).filter(
+                book_id__in={book_id for book_id, _ in batch}, genre__isnull=True,
+            )
+        }
+        LeaderboardEntry.objects.using(using).bulk_create(
+            [
+                LeaderboardEntry(
+                    book_id=book_id, genre_id=genre_id, top_rated=overall[book_id].top_rated,
+                    recent_votes=overall[book_id].recent_votes, comment_count=overall[book_id].comment_count,
+                )
+                for book_id, genre_id in batch if book_id in overall
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def genres_removed(book_ids=None, genre_ids=None, using=DEFAULT_DB_ALIAS):
+    """Drop genre rows of the given books and/or genres (all genres of the books when genre_ids is None)"""
+    entries = LeaderboardEntry.objects.using(using).filter(genre__isnull=False)
+    if book_ids is not None:
+        entries = entries.filter(book_id__in=list(book_ids))
+    if genre_ids is not None:
+        entries = entries.filter(genre_id__in=list(genre_ids))
+    return entries.delete()[0]
+
+
+# Full rebuild
+
+def _rebuild_sql():
+    entries = LeaderboardEntry._meta.db_table
+    columns = "book_id, genre_id, top_rated, recent_votes, comment_count"
+    # GROUP BY +book_id: grouping on the bare column would walk every vote in book_id index order
+    # to save the sort, instead of reading the window's range of vote_created_book_idx
+    overall = (
+        f"INSERT INTO {entries} ({columns}) "
+        f"SELECT b.id, NULL, (%s + b.vote_sum) / (%s + b.vote_count), COALESCE(rv.n, 0), COALESCE(cc.n, 0) "
+        f"FROM {Book._meta.db_table} b "
+        f"LEFT JOIN (SELECT book_id, COUNT(*) AS n FROM {Vote._meta.db_table} "
+        f"WHERE created_at >= %s GROUP BY +book_id) rv ON rv.book_id = b.id "
+        f"LEFT JOIN (SELECT book_id, COUNT(*) AS n FROM {Comment._meta.db_table} GROUP BY book_id) cc "
+        f"ON cc.book_id = b.id"
+    )
+    per_genre = (
+        f"INSERT INTO {entries} ({columns}) "
+        f"SELECT bg.book_id, bg.genre_id, e.top_rated, e.recent_votes, e.comment_count "
+        f"FROM {Book.genre.through._meta.db_table} bg "
+        f"JOIN {entries} e ON e.book_id = bg.book_id AND e.genre_id IS NULL"
+    )
+    return overall, per_genre
+
+
+def rebuild(using=DEFAULT_DB_ALIAS):
+    """Recompute every row from Book, Vote and Comment, returns the number of rows written"""
+    cache.delete(MEAN_RATING_KEY)
+    mean = mean_rating(using)
+    overall, per_genre = _rebuild_sql()
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {LeaderboardEntry._meta.db_table}")
+        cursor.execute(overall, [PRIOR_VOTES * mean, float(PRIOR_VOTES), trending_since()])
+        written = cursor.rowcount
+        cursor.execute(per_genre)
+        written += cursor.rowcount
+    return written
@@ -0,0 +1,78 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client
+
+
+DEFAULT_PATHS = ["/projectcv/book_index/", "/projectcv/book_index/?page=2", "/projectcv/1/book_detail/"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the WSGI and ASGI request handlers on the read pages: the same requests, "
+        "N at a time, through threads (WSGI) or one event loop (ASGI)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+        parser.add_argument("--requests", type=int, default=300, help="Requests per handler")
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+
+    def handle(self, *args, **options):
+        urls = [options["paths"][i % len(options["paths"])] for i in range(options["requests"])]
+        headers = {"host": options["host"]}
+        for name, run in (("wsgi", self.run_wsgi), ("asgi", self.run_asgi)):
+            run(urls[:options["concurrency"]], options["concurrency"], headers)  # warm caches and connections
+            started = time.perf_counter()
+            latencies = run(urls, options["concurrency"], headers)
+            self.report(name, latencies, time.perf_counter() - started)
+
+    def run_wsgi(self, urls, concurrency, headers):
+        def worker(chunk):
+            client = Client(headers=headers)
+            latencies = []
+            try:
+                for url in chunk:
+                    started = time.perf_counter()
+                    self.expect_ok(client.get(url), url)
+                    latencies.append(time.perf_counter() - started)
+            finally:
+                connections.close_all()
+            return latencies
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            chunks = [urls[i::concurrency] for i in range(concurrency)]
+            return [latency for result in pool.map(worker, chunks) for latency in result]
+
+    def run_asgi(self, urls, concurrency, headers):
+        async def main():
+            client = AsyncClient(headers=headers)
+            slots = asyncio.Semaphore(concurrency)
+            latencies = []
+
+            async def fetch(url):
+                async with slots:
+                    started = time.perf_counter()
+                    self.expect_ok(await client.get(url), url)
+                    latencies.append(time.perf_counter() - started)
+
+            await asyncio.gather(*(fetch(url) for url in urls))
+            return latencies
+        return asyncio.run(main())
+
+    def expect_ok(self, response, url):
+        if response.status_code >= 400:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+
+    def report(self, name, latencies, elapsed):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f"{name}: {len(latencies) / elapsed:.1f} req/s, "
+            f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms"
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projectcv.benchmarks.generator import CatalogueSpec
+
+
+class Command(BaseCommand):
+    help = "Time a full similar-books rebuild on a synthetic catalogue (1M books by default), without the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=50_000)
+        parser.add_argument("--votes", type=int, default=10_000_000)
+        parser.add_argument("--tags", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--sample", type=int, help="Search the neighbours of N books only and extrapolate")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    def handle(self, *args, **options):
+        try:
+            from projectcv import recommendations
+            from projectcv.benchmarks.recommendations import measure
+        except ImportError as exc:
+            raise CommandError(f"Recommendations need NumPy and SciPy: {exc}")
+
+        spec = CatalogueSpec(
+            books=options["books"], users=options["users"], votes=options["votes"],
+            tags=options["tags"], seed=options["seed"],
+        )
+        result = measure(
+            spec, options["sample"], batch_size=options["batch_size"] or recommendations.BATCH_SIZE,
+            workers=options["workers"],
+        )
+        self.stdout.write(
+            f"{result['books']} books, {result['features']} features, {result['nonzeros']} non-zeros: "
+            f"matrix {result['build_s']} s, neighbours {result['neighbours_s']} s"
+            + (f" (extrapolated from {result['sampled_books']} books)" if result["sampled_books"] < result["books"] else "")
+            + f", total {result['total_s']} s"
+        )
@@ -0,0 +1,154 @@
+import random
+import statistics
+import threading
+import time
+
+from django.db import IntegrityError, OperationalError, connections
+from django.db.models import Count, Sum
+
+from projectcv import vote_buffer, votes
+from projectcv.backends.retry import is_busy_error, retry_on_busy
+from projectcv.models import Book, PendingVote, User, Vote
+
+from .sqlite_load_test import VARIANTS, Command as LoadTestCommand
+
+
+class Command(LoadTestCommand):
+    help = (
+        "Votes from many threads on a few hot books, on copies of the database: update_or_create() "
+        "(the former direct path), the single-statement upsert of projectcv.votes and write-behind "
+        "(settings.VOTE_WRITE_BEHIND) with a flusher running alongside. Reports vote latency, "
+        "unique constraint failures, and checks Vote and the aggregates afterwards."
+    )
+    paths = ("update_or_create", "upsert", "write_behind")
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument("--books", type=int, default=3, help="Hot books the votes go to")
+        parser.add_argument("--flush-interval", type=float, default=0.2, help="Seconds between flushes")
+        parser.add_argument("--backend", choices=sorted(VARIANTS), default="tuned",
+                            help="Database settings every vote path runs with")
+        parser.add_argument("--shared-users", action="store_true",
+                            help="Threads vote as the same users, so first votes of a pair can collide "
+                                 "(only the aggregates are checked then)")
+
+    def handle(self, *args, **options):
+        # Same settings for every path, only the vote path differs
+        self.variants = dict.fromkeys(self.paths, VARIANTS[options["backend"]])
+        super().handle(*args, **options)
+
+    def run(self, alias, variant, book_ids, user_ids, options):
+        hot = book_ids[:options["books"]]
+        deadline = time.perf_counter() + options["duration"]
+        latencies, errors, conflicts, expected = [], [0], [0], {}
+        lock = threading.Lock()
+        if variant == "update_or_create":
+            vote = retry_on_busy(
+                lambda user_id, book_id, rating: Vote.objects.using(alias).update_or_create(
+                    user_id=user_id, book_id=book_id, defaults={"rating": rating}),
+                using=alias,
+            )
+        elif variant == "upsert":
+            vote = lambda user_id, book_id, rating: votes.record_votes(User(pk=user_id), {book_id: rating}, alias)
+        else:
+            vote = retry_on_busy(
+                lambda user_id, book_id, rating: PendingVote.objects.using(alias).create(
+                    user_id=user_id, book_id=book_id, rating=rating),
+                using=alias,
+            )
+
+        def worker(seed, users):
+            # Each thread votes as its own users (unless --shared-users), so the last rating of every pair is known
+            rng = random.Random(seed)
+            times, last, busy, failed = [], {}, 0, 0
+            try:
+                while time.perf_counter() < deadline:
+                    pair = (rng.choice(users), rng.choice(hot))
+                    rating = rng.randint(1, 5)
+                    started = time.perf_counter()
+                    try:
+                        vote(*pair, rating)
+                    except OperationalError as exc:
+                        if not is_busy_error(exc):
+                            raise
+                        busy += 1
+                        continue
+                    except IntegrityError:
+                        failed += 1  # the vote is lost, as in a request answering 500
+                        continue
+                    times.append(time.perf_counter() - started)
+                    if not options["shared_users"]:
+                        last[pair] = rating
+            finally:
+                connections.close_all()
+                with lock:
+                    latencies.extend(times)
+                    expected.update(last)
+                    errors[0] += busy
+                    conflicts[0] += failed
+
+        stop = threading.Event()
+
+        def flusher():
+            try:
+                while not stop.wait(options["flush_interval"]):
+                    try:
+                        vote_buffer.flush_all(using=alias)
+                    except OperationalError as exc:
+                        if not is_busy_error(exc):
+                            raise  # locked even after the retries: the next round picks the votes up
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(
+                target=worker, args=(i, user_ids if options["shared_users"] else user_ids[i::options["threads"]]),
+            )
+            for i in range(options["threads"])
+        ]
+        if variant == "write_behind":
+            threads.append(threading.Thread(target=flusher))
+        for thread in threads:
+            thread.start()
+        for thread in threads[:options["threads"]]:
+            thread.join()
+        stop.set()
+        for thread in threads[options["threads"]:]:
+            thread.join()
+
+        started = time.perf_counter()
+        vote_buffer.flush_all(using=alias)
+        drain = time.perf_counter() - started
+        return {
+            "latencies": latencies, "errors": errors[0], "conflicts": conflicts[0], "drain": drain,
+            "mismatches": self.verify(alias, hot, expected),
+        }
+
+    def verify(self, alias, hot, expected):
+        """Pairs whose stored vote is not the last one cast, plus books whose aggregates disagree with Vote"""
+        stored = dict(
+            ((user_id, book_id), rating) for user_id, book_id, rating in
+            Vote.objects.using(alias).filter(book_id__in=hot).values_list("user_id", "book_id", "rating")
+        )
+        mismatches = sum(stored.get(pair) != rating for pair, rating in expected.items())
+        totals = {
+            row["book_id"]: (row["count"], row["total"]) for row in
+            Vote.objects.using(alias).filter(book_id__in=hot).order_by().values("book_id")
+            .annotate(count=Count("id"), total=Sum("rating"))
+        }
+        for book in Book.objects.using(alias).filter(pk__in=hot).only("vote_count", "vote_sum"):
+            mismatches += totals.get(book.pk, (0, 0)) != (book.vote_count, book.vote_sum)
+        connections[alias].close()
+        return mismatches
+
+    def report(self, variant, result, duration):
+        latencies = sorted(result["latencies"])
+        if not latencies:
+            self.stdout.write(f"{variant}: no vote got through, {result['errors']} busy errors")
+            return
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        self.stdout.write(
+            f"{variant}: {len(latencies) / duration:.1f} votes/s, median {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p99 {p99 * 1000:.1f} ms, {result['errors']} busy errors, {result['conflicts']} unique violations, "
+            f"queue drained in {result['drain'] * 1000:.0f} ms, {result['mismatches']} mismatches"
+        )
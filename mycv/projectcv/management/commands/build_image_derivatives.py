@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from projectcv import images
+from projectcv.models import Book
+
+
+def _build(book_id, field_name, source_name):
+    # Runs in a worker process: only touches files, the parent writes the manifests
+    manifest = images.build_variants(source_name, images.DERIVATIVE_WIDTHS[field_name])
+    return book_id, field_name, manifest
+
+
+class Command(BaseCommand):
+    help = "Build resized WebP/AVIF/JPEG derivatives for existing book covers and author photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument("--force", action="store_true", help="Rebuild manifests even when they look current")
+
+    def handle(self, *args, **options):
+        jobs = []
+        books = Book.objects.only("id", "image", "author_photo", "image_variants", "author_photo_variants")
+        for book in books.iterator(chunk_size=1000):
+            for field_name in images.DERIVATIVE_WIDTHS:
+                field_file = getattr(book, field_name)
+                manifest = getattr(book, f"{field_name}_variants")
+                if field_file and (options["force"] or manifest.get("source") != field_file.name):
+                    jobs.append((book.pk, field_name, field_file.name))
+
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS("All image derivatives are up to date."))
+            return
+
+        # Forked workers must not inherit the open SQLite connection
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = [pool.submit(_build, *job) for job in jobs]
+            for future in as_completed(futures):
+                try:
+                    book_id, field_name, manifest = future.result()
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"Failed: {exc}")
+                    continue
+                Book.objects.filter(pk=book_id).update(updated_at=timezone.now(), **{f"{field_name}_variants": manifest})
+                done += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built derivatives for {done} image(s), {failed} failed."))
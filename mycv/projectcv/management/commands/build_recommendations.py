@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the similar books shown on the book page, for the whole catalogue or only "
+        "for books changed since the last run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale", action="store_true",
+            help="Only books whose tags, genres or votes changed since their neighbours were computed",
+        )
+        parser.add_argument("--neighbours", type=int, default=None, help="Neighbours kept per book")
+        parser.add_argument("--batch-size", type=int, default=None, help="Books multiplied against the catalogue at once")
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        try:
+            from projectcv import recommendations
+        except ImportError as exc:
+            raise CommandError(f"Recommendations need NumPy and SciPy: {exc}")
+
+        settings = {
+            "k": options["neighbours"] or recommendations.NEIGHBOURS,
+            "batch_size": options["batch_size"] or recommendations.BATCH_SIZE,
+            "workers": options["workers"],
+            "using": options["database"],
+        }
+        started = time.perf_counter()
+        if options["stale"]:
+            count = recommendations.refresh(**settings)
+        else:
+            count = recommendations.rebuild(**settings)
+        self.stdout.write(self.style.SUCCESS(
+            f"Computed the neighbours of {count} book(s) in {time.perf_counter() - started:.1f} s."
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projectcv.query_plans import check_plans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN QUERY PLAN the queries the views run per request and fail on full scans or unbounded sorts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan, not only failing ones")
+
+    def handle(self, *args, **options):
+        try:
+            results = check_plans(options["database"])
+        except NotImplementedError as exc:
+            raise CommandError(str(exc))
+
+        failed = 0
+        for name, plan, problems in results:
+            if problems:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"{name}: {'; '.join(problems)}"))
+            elif options["verbose_plans"]:
+                self.stdout.write(self.style.SUCCESS(name))
+            if problems or options["verbose_plans"]:
+                self.stdout.write("\n".join(f"    {line}" for line in plan))
+        if failed:
+            raise CommandError(f"{failed} of {len(results)} hot queries fall back to a scan or sort")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} hot query plans use indexes"))
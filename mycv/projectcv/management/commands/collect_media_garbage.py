@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from projectcv import images
+from projectcv.models import Book
+from projectcv.storage import content_addressed_storage
+
+
+class Command(BaseCommand):
+    help = "Delete stored book images and derivatives that no Book row references"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list what would be deleted")
+        parser.add_argument(
+            "--min-age", type=int, default=24,
+            help="Keep files younger than this many hours (uploads whose Book is not saved yet)",
+        )
+
+    def referenced_names(self):
+        names = set()
+        rows = Book.objects.values_list("image", "author_photo", "image_variants", "author_photo_variants")
+        for image, author_photo, *manifests in rows.iterator(chunk_size=2000):
+            names.update(name for name in (image, author_photo) if name)
+            for manifest in manifests:
+                for variants in (manifest or {}).get("variants", {}).values():
+                    names.update(name for _width, name in variants)
+        return names
+
+    def handle(self, *args, **options):
+        referenced = self.referenced_names()
+        root = content_addressed_storage.location
+        cutoff = time.time() - options["min_age"] * 3600
+        removed = freed = 0
+
+        for upload_to in {Book._meta.get_field(name).upload_to for name in images.DERIVATIVE_WIDTHS}:
+            top = os.path.join(root, upload_to)
+            for dirpath, _dirnames, filenames in os.walk(top):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, root).replace(os.sep, "/")
+                    if name in referenced or os.path.getmtime(path) > cutoff:
+                        continue
+                    size = os.path.getsize(path)
+                    self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleting'} {name} ({size} bytes)")
+                    if not options["dry_run"]:
+                        os.remove(path)
+                    removed += 1
+                    freed += size
+
+        verb = "Would free" if options["dry_run"] else "Freed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {freed} bytes in {removed} file(s)."))
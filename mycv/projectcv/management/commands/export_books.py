@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from projectcv import catalogue_io
+from projectcv.filters import INDEX_FILTERS, filter_books
+from projectcv.models import Book
+
+
+class Command(BaseCommand):
+    help = "Stream the catalogue to CSV or JSON Lines, optionally filtered like the book index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(catalogue_io.WRITERS), default="csv")
+        parser.add_argument("--output", help="Output file (default: standard output)")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Books fetched per query")
+        for name in INDEX_FILTERS:
+            parser.add_argument(f"--{name}", help=f"Same as the '{name}' filter of the book index")
+
+    def handle(self, *args, **options):
+        writer, _content_type = catalogue_io.WRITERS[options["format"]]
+        qs = filter_books(Book.objects.order_by("-id"), options)
+        rows = catalogue_io.export_rows(qs, chunk_size=options["chunk_size"])
+
+        out = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else sys.stdout
+        try:
+            for chunk in writer(rows):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
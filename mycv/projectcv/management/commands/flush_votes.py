@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError
+
+from projectcv import vote_buffer
+from projectcv.backends.retry import is_busy_error
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the votes queued in write-behind mode (settings.VOTE_WRITE_BEHIND) to Vote and the "
+        "book aggregates, once or every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, help="Keep flushing every N seconds")
+        parser.add_argument("--batch-size", type=int, default=vote_buffer.FLUSH_BATCH_SIZE,
+                            help="Pending votes applied per transaction")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            try:
+                read, created, changed = vote_buffer.flush_all(options["batch_size"], options["database"])
+            except OperationalError as exc:
+                if not (options["interval"] and is_busy_error(exc)):
+                    raise
+                # Still locked after the retries, the votes stay queued for the next round
+                self.stderr.write(f"Database busy, retrying in {options['interval']} s")
+                time.sleep(options["interval"])
+                continue
+            if read or not options["interval"]:
+                self.stdout.write(
+                    f"{read} pending vote(s): {created} new, {changed} changed "
+                    f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+                )
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,30 @@
+from dataclasses import fields
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from projectcv.benchmarks.generator import CatalogueSpec, generate_catalogue
+from projectcv.models import Book
+
+
+class Command(BaseCommand):
+    help = "Fill an empty database with a deterministic synthetic catalogue for benchmarking"
+
+    def add_arguments(self, parser):
+        defaults = CatalogueSpec()
+        for spec_field in fields(CatalogueSpec):
+            parser.add_argument(
+                f"--{spec_field.name.replace('_', '-')}", type=spec_field.type,
+                default=getattr(defaults, spec_field.name),
+            )
+        parser.add_argument(
+            "--allow-existing", action="store_true", help="Add to a database that already has books",
+        )
+
+    def handle(self, *args, **options):
+        if Book.objects.exists() and not options["allow_existing"]:
+            raise CommandError("The database already has books; point DATABASES at an empty one or pass --allow-existing.")
+        spec = CatalogueSpec(**{f.name: options[f.name] for f in fields(CatalogueSpec)})
+        with transaction.atomic():
+            counts = generate_catalogue(spec, log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{count} {name}" for name, count in counts.items())))
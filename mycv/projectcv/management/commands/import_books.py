@@ -0,0 +1,192 @@
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from projectcv import catalogue_io, conditional, facets, leaderboards, search
+from projectcv.models import Book, Genre, Tag
+
+
+BOOK_FIELDS = ("title", "author", "publisher", "isbn", "ean", "published_date", "rating", "blurb", "author_bio")
+# Names looked up per query, well below SQLite's limit on bound parameters
+NAME_LOOKUP_SIZE = 500
+
+
+class NameCache:
+    """In-memory name -> id lookup for Genre / Tag, creating missing rows in bulk"""
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.ids = {}
+
+    def resolve(self, names):
+        missing = {}
+        for name in names:
+            if name.lower() not in self.ids:
+                missing.setdefault(name.lower(), name)
+        lowered = sorted(missing)
+        for start in range(0, len(lowered), NAME_LOOKUP_SIZE):
+            # lower() = IN (...) rather than one OR of iexact per name, the expression stays flat
+            rows = (
+                self.model.objects.alias(name_lower=Lower(self.field))
+                .filter(name_lower__in=lowered[start:start + NAME_LOOKUP_SIZE])
+                .order_by("pk").values_list("pk", self.field)
+            )
+            for pk, name in rows:
+                self.ids.setdefault(name.lower(), pk)
+        new = [name for lower, name in missing.items() if lower not in self.ids]
+        created = self.model.objects.bulk_create([self.model(**{self.field: name}) for name in new])
+        for obj in created:
+            self.ids[getattr(obj, self.field).lower()] = obj.pk
+        return {name.lower(): self.ids[name.lower()] for name in names}
+
+
+class Command(BaseCommand):
+    help = "Stream a catalogue file (CSV, JSON Lines or ONIX 3.0) into Book, upserting by ISBN / EAN"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file")
+        parser.add_argument("--format", choices=sorted(catalogue_io.READERS), help="Default: from the file extension")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows written per transaction")
+        parser.add_argument(
+            "--checkpoint", help="JSON file recording progress; an interrupted import resumes after the last batch",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist.")
+        reader = catalogue_io.READERS[options["format"] or catalogue_io.guess_format(path)]
+        batch_size = options["batch_size"]
+        checkpoint = options["checkpoint"]
+
+        done = self.load_checkpoint(checkpoint, path)
+        records = islice(reader(path), done, None)
+        if done:
+            self.stdout.write(f"Resuming after {done} row(s).")
+
+        self.genres = NameCache(Genre, "genre_name")
+        self.tags = NameCache(Tag, "tag_title")
+        started = time.monotonic()
+        created = updated = skipped = 0
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            c, u, s = self.write_batch(batch)
+            created, updated, skipped = created + c, updated + u, skipped + s
+            done += len(batch)
+            self.save_checkpoint(checkpoint, path, done)
+            rate = (created + updated + skipped) / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"{done} rows ({created} new, {updated} updated, {skipped} skipped) - {rate:,.0f} rows/s")
+
+        # bulk_create skips signals: refresh what the receivers would have updated
+        facets.invalidate()
+        conditional.touch_catalogue()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {created + updated} book(s): {created} new, {updated} updated, {skipped} skipped."
+        ))
+
+    def write_batch(self, rows):
+        valid = [row for row in rows if row["title"] and row["author"]]
+        skipped = len(rows) - len(valid)
+
+        with transaction.atomic():
+            existing = self.find_existing(valid)
+            new_books, changed_books, changed_ids, relations = [], [], set(), []
+            for row in valid:
+                book = existing.get(("isbn", row["isbn"])) or existing.get(("ean", row["ean"]))
+                if book is None:
+                    book = Book()
+                    new_books.append(book)
+                elif book.pk is not None and book.pk not in changed_ids:
+                    changed_ids.add(book.pk)
+                    changed_books.append(book)
+                for field in BOOK_FIELDS:
+                    value = row[field]
+                    if value is not None or book.pk is None:
+                        setattr(book, field, value)
+                relations.append((book, row))
+                # Later rows of the same batch with the same identifiers update this book
+                for key in ("isbn", "ean"):
+                    if row[key]:
+                        existing[(key, row[key])] = book
+
+            Book.objects.bulk_create(new_books)
+            if changed_books:
+                # auto_now is not applied by bulk_update(), the ETags and cached rows key on updated_at
+                now = timezone.now()
+                for book in changed_books:
+                    book.updated_at = now
+                Book.objects.bulk_update(changed_books, (*BOOK_FIELDS, "updated_at"))
+            self.write_relations(relations)
+            search.index_books({book.pk for book, _row in relations})
+            leaderboards.books_added([book.pk for book in new_books])
+            self.write_leaderboard_genres(relations)
+        return len(new_books), len(changed_books), skipped
+
+    def find_existing(self, rows):
+        isbns = {row["isbn"] for row in rows if row["isbn"]}
+        eans = {row["ean"] for row in rows if row["ean"]}
+        existing = {}
+        if isbns or eans:
+            for book in Book.objects.filter(Q(isbn__in=isbns) | Q(ean__in=eans)).only(*BOOK_FIELDS):
+                if book.isbn:
+                    existing.setdefault(("isbn", book.isbn), book)
+                if book.ean:
+                    existing.setdefault(("ean", book.ean), book)
+        return existing
+
+    @staticmethod
+    def supplied(relations, column):
+        """{book id: names} of the rows that have the list column, a later row of a book wins"""
+        return {book.pk: row[column] for book, row in relations if row[column] is not None}
+
+    def write_relations(self, relations):
+        """Replace the genres / tags the rows supply with two bulk inserts; books of other rows keep theirs"""
+        for column, through, field, cache in (
+            ("genres", Book.genre.through, "genre_id", self.genres), ("tags", Book.tags.through, "tag_id", self.tags),
+        ):
+            books = self.supplied(relations, column)
+            ids = cache.resolve({name for names in books.values() for name in names})
+            through.objects.filter(book_id__in=list(books)).delete()
+            through.objects.bulk_create(
+                [through(book_id=book_id, **{field: ids[name.lower()]}) for book_id, names in books.items()
+                 for name in names],
+                ignore_conflicts=True,
+            )
+
+    def write_leaderboard_genres(self, relations):
+        """Genre rows of the leaderboards for the batch's books, as the genre receivers would write them"""
+        books = self.supplied(relations, "genres")
+        leaderboards.genres_removed(books)
+        genre_ids = self.genres.resolve({name for names in books.values() for name in names})
+        leaderboards.genres_added(
+            {(book_id, genre_ids[name.lower()]) for book_id, names in books.items() for name in names}
+        )
+
+    @staticmethod
+    def load_checkpoint(checkpoint, path):
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+        with open(checkpoint) as fh:
+            state = json.load(fh)
+        if state.get("source") != os.path.abspath(path):
+            raise CommandError(f"Checkpoint {checkpoint} belongs to {state.get('source')}, not {path}.")
+        return state["rows_done"]
+
+    @staticmethod
+    def save_checkpoint(checkpoint, path, rows_done):
+        if not checkpoint:
+            return
+        tmp = f"{checkpoint}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump({"source": os.path.abspath(path), "rows_done": rows_done}, fh)
+        os.replace(tmp, checkpoint)
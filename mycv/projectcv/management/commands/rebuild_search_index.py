@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from projectcv import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the SQLite FTS5 book search index from the Book, Tag and Genre tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Database alias to rebuild")
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        if not search.is_fts_available(using):
+            raise CommandError("Full-text index is only used on SQLite, nothing to rebuild.")
+        written = search.rebuild_index(using=using)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {written} book(s)."))
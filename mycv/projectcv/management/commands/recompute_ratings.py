@@ -0,0 +1,45 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from projectcv.models import Book, Vote
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored vote aggregates on Book from the Vote table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Only compare stored values with the Vote table, fail if any book is out of date",
+        )
+
+    def handle(self, *args, **options):
+        # One grouped query over Vote, then stream the books and compare
+        totals = {
+            row["book_id"]: (row["count"], row["total"])
+            for row in Vote.objects.order_by().values("book_id").annotate(count=Count("id"), total=Sum("rating"))
+        }
+        stale = []
+        books = Book.objects.only("id", "title", "vote_count", "vote_sum", "average_rating")
+        for book in books.iterator(chunk_size=2000):
+            count, total = totals.get(book.pk, (0, 0))
+            # Half-up rounding to match SQL ROUND() used by BookQuerySet.adjust_vote_totals
+            average = float((Decimal(total) / count).quantize(Decimal("0.1"), ROUND_HALF_UP)) if count else None
+            if (book.vote_count, book.vote_sum, book.average_rating) != (count, total, average):
+                stale.append(book.pk)
+                self.stdout.write(
+                    f"Book {book.pk} ({book.title}): stored {book.vote_count}/{book.vote_sum}/{book.average_rating}, "
+                    f"expected {count}/{total}/{average}"
+                )
+
+        if not stale:
+            self.stdout.write(self.style.SUCCESS("All book rating aggregates are up to date."))
+            return
+        if options["check"]:
+            raise CommandError(f"{len(stale)} book(s) have stale rating aggregates.")
+
+        for start in range(0, len(stale), 500):
+            Book.objects.filter(pk__in=stale[start:start + 500]).recompute_vote_totals()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed rating aggregates for {len(stale)} book(s)."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from projectcv import leaderboards
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the leaderboards from Book, Vote and Comment: drops votes older than the trending window "
+        "and takes a fresh mean rating. Run it on a schedule (e.g. hourly from cron)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default", help="Database alias to rebuild")
+
+    def handle(self, *args, **options):
+        written = leaderboards.rebuild(using=options["database"])
+        self.stdout.write(self.style.SUCCESS(f"Ranked {written} leaderboard row(s)."))
@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projectcv.benchmarks import runner
+from projectcv.benchmarks.scenarios import SCENARIOS, Fixture
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure latency percentiles, queries per request and peak memory of the request scenarios "
+        "and save them as a JSON baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"Scenarios to run (default: all): {', '.join(SCENARIOS)}")
+        parser.add_argument("--requests", type=int, default=50, help="Measured requests per scenario")
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--cold", action="store_true", help="Clear every cache before each measured request")
+        parser.add_argument("--host", default="localhost", help="Host header, must be in ALLOWED_HOSTS")
+        parser.add_argument("--output", help="Where to save the results (default: benchmarks/<commit>.json)")
+        parser.add_argument("--compare", help="Baseline JSON to compare the results with")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        unknown = set(options["scenarios"]) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        fixture = Fixture.load()
+        if not fixture.popular_books or fixture.admin is None:
+            raise CommandError("No catalogue to measure, run generate_catalogue first.")
+
+        bench = runner.Runner(
+            fixture, requests=options["requests"], warmup=options["warmup"], seed=options["seed"],
+            cold=options["cold"], host=options["host"],
+        )
+        results = {"environment": runner.environment(options["seed"], options["cold"]), "scenarios": {}}
+        for name in options["scenarios"] or SCENARIOS:
+            stats = bench.run(name, SCENARIOS[name])
+            results["scenarios"][name] = stats
+            self.stdout.write(
+                f"{name:20} p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  p99 {stats['p99_ms']:8.2f} ms"
+                f"  {stats['queries_median']:3} queries  {stats['peak_memory_kb']:6} KiB"
+            )
+
+        commit = results["environment"]["commit"] or "local"
+        output = Path(options["output"] or settings.BASE_DIR / "benchmarks" / f"{commit}.json")
+        runner.save(output, results)
+        self.stdout.write(f"Saved {output}")
+
+        if options["compare"]:
+            baseline = json.loads(Path(options["compare"]).read_text())
+            lines, regressed = runner.compare(baseline, results)
+            self.stdout.write("\n".join(lines))
+            if regressed and options["fail_on_regression"]:
+                raise CommandError("Slower or more queries than the baseline.")
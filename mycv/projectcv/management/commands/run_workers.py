@@ -0,0 +1,92 @@
+import json
+import multiprocessing
+import os
+import signal
+from multiprocessing.connection import wait
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from projectcv import jobs
+from projectcv.backends.retry import is_busy_error
+
+
+def _work(stop, poll, once, using):
+    # Runs in a forked process: Ctrl-C reaches the parent, which lets the current job finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = jobs.worker_name()
+    try:
+        while not stop.is_set():
+            try:
+                ran = jobs.run_next(worker, using)
+            except OperationalError as exc:
+                if not is_busy_error(exc):
+                    raise
+                ran = None  # still locked after the retries, try again after the poll interval
+            if ran is None:
+                if once:
+                    break
+                stop.wait(poll)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the background jobs queued in the database (projectcv.jobs) with a pool of worker "
+        "processes, until interrupted; logs the queue depth and latency every --stats-interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Worker processes")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds an idle worker waits for new jobs")
+        parser.add_argument("--stats-interval", type=float, default=60,
+                            help="Seconds between metrics, recovery of lost jobs and pruning of finished ones")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        jobs.recover(using)
+        # Forked workers must not inherit the open SQLite connection
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        stop = context.Event()
+        workers = [
+            context.Process(target=_work, args=(stop, options["poll"], options["once"], using), daemon=True)
+            for _ in range(max(1, options["processes"]))
+        ]
+        for worker in workers:
+            worker.start()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write(f"{len(workers)} worker(s) running")
+
+        try:
+            while any(worker.is_alive() for worker in workers):
+                # Wakes up when a worker exits (--once) or after the interval
+                wait([worker.sentinel for worker in workers if worker.is_alive()], options["stats_interval"])
+                if not stop.is_set():
+                    self.maintain(using)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping after the running jobs")
+            stop.set()
+        for worker in workers:
+            worker.join()
+        self.report(using)
+
+    def maintain(self, using):
+        try:
+            recovered = jobs.recover(using)
+            pruned = jobs.prune(using=using)
+        except OperationalError as exc:
+            if not is_busy_error(exc):
+                raise
+            return
+        if recovered or pruned:
+            self.stdout.write(f"{recovered} lost job(s) queued again, {pruned} finished job(s) pruned")
+        self.report(using)
+
+    def report(self, using):
+        metrics = jobs.stats(using)
+        jobs.logger.info(json.dumps(metrics), extra={"job_stats": metrics})
+        connections.close_all()
@@ -0,0 +1,116 @@
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from projectcv.backends.retry import is_busy_error, retry_on_busy
+from projectcv.models import Book, User, Vote
+
+
+VARIANTS = {
+    # What a stock settings file gets: rollback journal, a new connection per request, DEFERRED transactions
+    "stock": {"ENGINE": "django.db.backends.sqlite3", "CONN_MAX_AGE": 0, "OPTIONS": {}},
+    "tuned": {
+        "ENGINE": "projectcv.backends.sqlite3",
+        "CONN_MAX_AGE": None,
+        "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Mixed read/write load on copies of the database, once with the stock SQLite settings and "
+        "once with projectcv.backends.sqlite3 (WAL, pragmas, kept connections, busy retries)"
+    )
+    variants = VARIANTS
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=10, help="Seconds per variant")
+        parser.add_argument("--write-ratio", type=float, default=0.2, help="Share of operations that vote")
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS, help="Database to copy")
+
+    def handle(self, *args, **options):
+        source = connections[options["database"]]
+        if source.vendor != "sqlite":
+            raise CommandError("The load test copies a SQLite database file")
+        book_ids = list(Book.objects.using(source.alias).order_by("-vote_count").values_list("id", flat=True)[:200])
+        user_ids = list(User.objects.using(source.alias).filter(is_admin=False).values_list("id", flat=True)[:500])
+        if not book_ids or not user_ids:
+            raise CommandError("The database needs books and users, see generate_catalogue")
+
+        with tempfile.TemporaryDirectory() as directory:
+            for variant, settings_dict in self.variants.items():
+                alias = f"loadtest_{variant}"
+                path = Path(directory) / f"{variant}.sqlite3"
+                self.copy(source.settings_dict["NAME"], path)
+                connections.settings[alias] = connections.configure_settings(
+                    {DEFAULT_DB_ALIAS: source.settings_dict, alias: {**settings_dict, "NAME": path}}
+                )[alias]
+                try:
+                    result = self.run(alias, variant, book_ids, user_ids, options)
+                finally:
+                    connections.close_all()
+                    del connections.settings[alias]
+                self.report(variant, result, options["duration"])
+
+    def copy(self, source, target):
+        # The backup API gives a consistent copy even while the source is in WAL mode
+        with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+            src.backup(dst)
+            dst.execute("PRAGMA journal_mode = DELETE")
+
+    def run(self, alias, variant, book_ids, user_ids, options):
+        totals = {"reads": 0, "writes": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options["duration"]
+        vote = Vote.objects.using(alias).update_or_create
+        if variant == "tuned":
+            vote = retry_on_busy(vote, using=alias)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            counts = dict.fromkeys(totals, 0)
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        if rng.random() < options["write_ratio"]:
+                            vote(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids),
+                                 defaults={"rating": rng.randint(1, 5)})
+                            counts["writes"] += 1
+                        else:
+                            # The index page query, for a random rating
+                            list(Book.objects.using(alias).with_listing_stats()
+                                 .filter(rating=rng.randint(1, 5)).order_by("-id")[:20])
+                            counts["reads"] += 1
+                    except OperationalError as exc:
+                        if not is_busy_error(exc):
+                            raise
+                        counts["errors"] += 1
+                    finally:
+                        if variant == "stock":
+                            connections[alias].close()  # CONN_MAX_AGE = 0 closes at the end of every request
+            finally:
+                connections.close_all()
+                with lock:
+                    for key, value in counts.items():
+                        totals[key] += value
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options["threads"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totals
+
+    def report(self, variant, result, duration):
+        self.stdout.write(
+            f"{variant}: {result['reads'] / duration:.1f} reads/s, {result['writes'] / duration:.1f} writes/s, "
+            f"{result['errors']} busy errors"
+        )
@@ -0,0 +1,41 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from projectcv.routers import primary_alias, replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over its replicas - the stand-in for replication when "
+        "two SQLite files play primary and replica locally"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("aliases", nargs="*", help="Replicas to refresh, all of DATABASE_REPLICAS by default")
+        parser.add_argument("--interval", type=float, help="Keep copying every N seconds")
+
+    def handle(self, *args, **options):
+        primary = connections[primary_alias()]
+        aliases = options["aliases"] or replica_aliases()
+        if not aliases:
+            raise CommandError("No replicas: set DATABASE_REPLICAS")
+        for alias in [primary.alias, *aliases]:
+            if connections[alias].vendor != "sqlite":
+                raise CommandError(f"{alias} is not a SQLite database, replicate it with the database's own tools")
+
+        while True:
+            for alias in aliases:
+                started = time.perf_counter()
+                # The backup API copies a consistent snapshot and takes the replica's locks while writing it;
+                # a sqlite3 connection's own context manager only commits, closing() lets --interval not leak them
+                with closing(sqlite3.connect(primary.settings_dict["NAME"])) as src, \
+                        closing(sqlite3.connect(connections[alias].settings_dict["NAME"])) as dst:
+                    src.backup(dst)
+                self.stdout.write(f"{primary.alias} -> {alias} in {(time.perf_counter() - started) * 1000:.0f} ms")
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -8,6 +8,10 @@ class Migration(migrations.Migration):
     dependencies = [
         ('projectcv', '0002_remove_genre_title_book_genre'),
     ]
+    # AUTH_USER_MODEL is created here, not in 0001_initial the swappable dependency of admin resolves to
+    run_before = [
+        ('admin', '0001_initial'),
+    ]
 
     operations = [
         migrations.CreateModel(
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:17
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_vote_aggregates(apps, schema_editor):
+    Book = apps.get_model('projectcv', 'Book')
+    Vote = apps.get_model('projectcv', 'Vote')
+    totals = Vote.objects.values('book_id').annotate(count=Count('id'), total=Sum('rating'))
+    for row in totals:
+        Book.objects.filter(pk=row['book_id']).update(
+            vote_count=row['count'],
+            vote_sum=row['total'],
+            average_rating=float((Decimal(row['total']) / row['count']).quantize(Decimal('0.1'), ROUND_HALF_UP)),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0010_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='average_rating',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='vote_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_vote_aggregates, migrations.RunPython.noop),
+    ]
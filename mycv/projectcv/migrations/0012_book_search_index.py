@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import projectcv.models
+
+
+def create_search_table(apps, schema_editor):
+    # FTS5 is SQLite only, other backends use the icontains fallback in projectcv.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from projectcv import search
+    search.create_search_table(schema_editor.connection)
+    search.rebuild_index(using=schema_editor.connection.alias)
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS projectcv_book_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0011_book_vote_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchEntry',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='projectcv.book')),
+                ('document', projectcv.models.SearchDocumentField(db_column='projectcv_book_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'projectcv_book_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
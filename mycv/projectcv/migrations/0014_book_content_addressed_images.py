@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:23
+
+from django.db import migrations, models
+import projectcv.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0013_book_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='author_photo',
+            field=models.ImageField(blank=True, null=True, storage=projectcv.storage.ContentAddressedStorage(), upload_to='author_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=projectcv.storage.ContentAddressedStorage(), upload_to='book_covers/'),
+        ),
+    ]
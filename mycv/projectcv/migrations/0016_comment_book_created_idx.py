@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0015_book_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', 'created_at'], name='comment_book_created_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:39
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0016_comment_book_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(django.db.models.functions.text.Lower('author'), models.F('id'), name='book_author_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['rating', 'id'], name='book_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['isbn'], name='book_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['ean'], name='book_ean_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['book', 'rating'], name='vote_book_rating_idx'),
+        ),
+        # The auto-created genre through table cannot declare indexes; (genre_id, book_id) hands
+        # the genre filter its book ids in order, so the newest-first page needs no sort
+        migrations.RunSQL(
+            'CREATE INDEX "book_genre_genre_book_idx" ON "projectcv_book_genre" ("genre_id", "book_id")',
+            'DROP INDEX "book_genre_genre_book_idx"',
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_leaderboards(apps, schema_editor):
+    # The incremental updates only change existing rows, the books already there need theirs
+    from projectcv import leaderboards
+    leaderboards.rebuild(using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projectcv', '0018_similarbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('top_rated', models.FloatField(default=0)),
+                ('recent_votes', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['created_at', 'book'], name='vote_created_book_idx'),
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='book',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to='projectcv.book'),
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='genre',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='projectcv.genre'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['genre', '-top_rated', '-book'], name='leaderboard_top_rated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['genre', '-recent_votes', '-book'], name='leaderboard_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardentry',
+            index=models.Index(fields=['genre', '-comment_count', '-book'], name='leaderboard_discussed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('book', 'genre'), name='leaderboard_book_genre_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('genre__isnull', True)), fields=('book',), name='leaderboard_book_overall_uniq'),
+        ),
+        migrations.RunPython(populate_leaderboards, migrations.RunPython.noop),
+    ]
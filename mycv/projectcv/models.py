@@ -1,6 +1,12 @@
 from django.db import models
+from django.db.models import Lookup
+from django.db.models import Count, F, FloatField, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, Lower, NullIf, Round
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, AbstractUser
 
+from .storage import content_addressed_storage
+
 
 # Create your models here.
 
@@ -20,6 +26,52 @@ class Tag(models.Model):
         verbose_name = "Tag"
         verbose_name_plural = "Tags"
 
+class BookQuerySet(models.QuerySet):
+    # Columns the listing pages never render
+    LISTING_DEFERRED_FIELDS = (
+        "blurb", "author_bio", "image", "author_photo", "image_variants", "author_photo_variants",
+        "facebook_url", "instagram_url", "amazon_url",
+    )
+
+    def with_listing_stats(self):
+        """Queryset for book listings: genres prefetched into ``genre_list``, heavy columns deferred.
+
+        Rating and vote count come from the stored aggregates, so no per-row query or
+        GROUP BY over Vote is needed whatever the number of votes.
+        """
+        return self.defer(*self.LISTING_DEFERRED_FIELDS).prefetch_related(
+            Prefetch("genre", queryset=Genre.objects.order_by("genre_name"), to_attr="genre_list")
+        )
+
+    def adjust_vote_totals(self, count_delta, sum_delta):
+        """Apply a vote delta to the stored rating aggregates in a single UPDATE"""
+        new_count = F("vote_count") + count_delta
+        new_sum = F("vote_sum") + sum_delta
+        return self.update(
+            updated_at=timezone.now(),
+            vote_count=new_count,
+            vote_sum=new_sum,
+            # NULLIF turns a zero count into NULL, so a book without votes has no average
+            average_rating=Round(Cast(new_sum, FloatField()) / NullIf(new_count, 0), 1),
+        )
+
+    def touch(self):
+        """Mark books as changed for HTTP revalidation without running save() and its signals"""
+        return self.update(updated_at=timezone.now())
+
+    def recompute_vote_totals(self):
+        """Recalculate the stored rating aggregates from the Vote table"""
+        votes = Vote.objects.filter(book=OuterRef("pk")).order_by().values("book")
+        count = Subquery(votes.annotate(c=Count("id")).values("c"))
+        total = Subquery(votes.annotate(s=Sum("rating")).values("s"))
+        return self.update(
+            updated_at=timezone.now(),
+            vote_count=Coalesce(count, 0),
+            vote_sum=Coalesce(total, 0),
+            average_rating=Round(Cast(total, FloatField()) / NullIf(count, 0), 1),
+        )
+
+
 class Book(models.Model):
     title= models.CharField(max_length=250)
     author= models.CharField(max_length=150)
@@ -29,22 +81,37 @@ class Book(models.Model):
     rating = models.IntegerField(null=True, blank=True, choices=[(i, i) for i in range(1, 6)]) # range marks 1-5
 
     # Layout
-    image = models.ImageField(upload_to='book_covers/', null=True, blank=True)
+    image = models.ImageField(upload_to='book_covers/', storage=content_addressed_storage, null=True, blank=True)
     published_date = models.DateField(null=True, blank=True)
     ean = models.CharField(max_length=13, null=True, blank=True)
     isbn = models.CharField(max_length=17, null=True, blank=True)
     author_bio = models.TextField(null=True, blank=True)
-    author_photo = models.ImageField(upload_to='author_photos/', null=True, blank=True)
+    author_photo = models.ImageField(
+        upload_to='author_photos/', storage=content_addressed_storage, null=True, blank=True
+    )
     blurb = models.TextField(null=True, blank=True, help_text="Short description of the book")
+    # Resized WebP/AVIF/JPEG copies of the images, built by projectcv.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    author_photo_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     # Social Media Links
     facebook_url = models.URLField(max_length=200, null=True, blank=True, help_text="Facebook page URL")
     instagram_url = models.URLField(max_length=200, null=True, blank=True, help_text="Instagram page URL")
     amazon_url = models.URLField(max_length=200, null=True, blank=True, help_text="Amazon page URL")
 
+    # Denormalized vote aggregates, maintained by projectcv.signals on every vote write
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+    vote_sum = models.PositiveIntegerField(default=0, editable=False)
+    average_rating = models.FloatField(null=True, blank=True, editable=False)
+
+    # Bumped on every change shown on the book pages (votes, comments, genres, tags, images)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BookQuerySet.as_manager()
+
     def __str__(self):
         tags = [i.tag_title for i in self.tags.all()]
-        genre_names = [g.genre_name for g in self.genre.all()] if self.genre.exists() else ["None"]
+        genre_names = [g.genre_name for g in self.genre.all()] or ["None"]
         genre_display = ", ".join(genre_names)
 
         return f"Title: {self.title} | Author: {self.author} | Genres: {genre_display} | Tags: {tags}"
@@ -52,18 +119,25 @@ class Book(models.Model):
     class Meta:
         verbose_name = "Book"
         verbose_name_plural = "Books"
+        # Access paths of the views, checked by the check_query_plans command
+        indexes = [
+            # Index author filter, case-insensitive (see filters.filter_books), newest first,
+            # and the author facet grouped the same way
+            models.Index(Lower('author'), 'id', name='book_author_lower_idx'),
+            # Index rating filter, newest first
+            models.Index(fields=['rating', 'id'], name='book_rating_id_idx'),
+            # Upserts by identifier in import_books
+            models.Index(fields=['isbn'], name='book_isbn_idx'),
+            models.Index(fields=['ean'], name='book_ean_idx'),
+        ]
 
     def get_average_rating(self):
-        """Calculate average rating from votes"""
-        votes = self.vote_set.all()
-        if votes.exists():
-            total = sum(vote.rating for vote in votes)
-            return round(total / votes.count(), 1) # Round to 1 decimal place
-        return None
+        """Get stored average rating from votes (None when nobody has voted)"""
+        return self.average_rating
 
     def get_vote_count(self):
-        """Get total number of votes"""
-        return self.vote_set.count()
+        """Get stored total number of votes"""
+        return self.vote_count
 
     def get_user_vote(self, user):
         """Get specific user's vote for this book"""
@@ -137,6 +211,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Comment pages of one book, newest first (see pagination.paginate_comments)
+            models.Index(fields=['book', 'created_at'], name='comment_book_created_idx'),
+        ]
 
 
 class Vote(models.Model):
@@ -149,6 +227,152 @@ class Vote(models.Model):
         unique_together = ('user', 'book') # Ensures one vote per user per book
         verbose_name = 'Vote'
         verbose_name_plural = 'Votes'
+        indexes = [
+            # Covers the rating distribution and aggregate recomputation of one book without reading rows
+            models.Index(fields=['book', 'rating'], name='vote_book_rating_idx'),
+            # Recent votes of the trending leaderboard
+            models.Index(fields=['created_at', 'book'], name='vote_created_book_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded rating so an update can adjust the book aggregates by the difference
+        instance._loaded_rating = instance.rating if "rating" in field_names else None
+        return instance
 
     def __str__(self):
-        return f"{self.user.email} voted {self.rating}/5 for {self.book.title}"
\ No newline at end of file
+        return f"{self.user.email} voted {self.rating}/5 for {self.book.title}"
+
+
+class PendingVote(models.Model):
+    """A vote accepted in write-behind mode and not applied yet, see projectcv.vote_buffer.
+
+    Append-only: a user voting twice adds two rows, the flush keeps the newest.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_index=False)
+    rating = models.IntegerField(choices=[(i, i) for i in range(1, 6)])
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The user's own pending vote on the book page, newest (highest id) first
+            models.Index(fields=['user', 'book'], name='pendingvote_user_book_idx'),
+            # Cascade deletes of a book
+            models.Index(fields=['book'], name='pendingvote_book_idx'),
+        ]
+
+
+class LeaderboardEntry(models.Model):
+    """Ranking scores of a book within one scope, maintained by projectcv.leaderboards.
+
+    A book has one row for the whole catalogue (genre is None) and one per
+    genre, so every leaderboard page is a range of one index.
+    """
+    # No single-column indexes, the constraints and indexes below start with these
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="leaderboard_entries", db_index=False)
+    genre = models.ForeignKey(
+        Genre, on_delete=models.CASCADE, null=True, blank=True, related_name="+", db_index=False,
+    )
+    top_rated = models.FloatField(default=0)  # Bayesian average rating
+    recent_votes = models.PositiveIntegerField(default=0)  # votes within leaderboards.TRENDING_DAYS
+    comment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'genre'], name='leaderboard_book_genre_uniq'),
+            # NULLs are distinct in a unique index, the catalogue-wide row needs its own
+            models.UniqueConstraint(
+                fields=['book'], condition=models.Q(genre__isnull=True), name='leaderboard_book_overall_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['genre', '-top_rated', '-book'], name='leaderboard_top_rated_idx'),
+            models.Index(fields=['genre', '-recent_votes', '-book'], name='leaderboard_trending_idx'),
+            models.Index(fields=['genre', '-comment_count', '-book'], name='leaderboard_discussed_idx'),
+        ]
+
+
+class SimilarBook(models.Model):
+    """One precomputed neighbour of a book, written by projectcv.recommendations"""
+    # No index of its own, similarbook_book_rank_uniq starts with the book
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="similar_entries", db_index=False)
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()  # 0 is the closest
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [
+            # Also the index the book page reads its neighbours through
+            models.UniqueConstraint(fields=['book', 'rank'], name='similarbook_book_rank_uniq'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, queued and run by projectcv.jobs"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    name = models.CharField(max_length=100)  # registered with @jobs.task
+    args = models.JSONField(default=list)
+    # name and args hashed, identical pending jobs are queued once
+    key = models.CharField(max_length=40)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)  # not before, moved on by the retry backoff
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)  # host:pid of the process running it
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['key'], condition=models.Q(status="pending"), name='job_pending_key_uniq',
+            ),
+        ]
+        indexes = [
+            # The next job due, the queue depth and stuck running jobs
+            models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx'),
+            # Latency of the recently finished jobs
+            models.Index(fields=['status', 'finished_at'], name='job_status_finished_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}{tuple(self.args)} [{self.status}]"
+
+
+class SearchDocumentField(models.TextField):
+    """The hidden FTS5 column named after its table, the left-hand side of MATCH"""
+
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class BookSearchEntry(models.Model):
+    """Row of the SQLite FTS5 table ``projectcv_book_fts``, kept in sync by projectcv.search"""
+    book = models.OneToOneField(
+        Book, primary_key=True, db_column="rowid", on_delete=models.DO_NOTHING, related_name="search_entry"
+    )
+    document = SearchDocumentField(db_column="projectcv_book_fts")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "projectcv_book_fts"
+
@@ -0,0 +1,159 @@
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+CURSOR_SALT = "projectcv.book-index-cursor"
+COMMENT_CURSOR_SALT = "projectcv.comment-cursor"
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never runs an unbounded COUNT(*) to number its pages.
+
+    An unfiltered queryset is estimated from the highest primary key (one index
+    lookup); a filtered one is counted up to ``count_limit`` rows only.
+
+    Only the cost of the COUNT is gone: a numbered page is still read with
+    LIMIT/OFFSET, so page 500 costs 500 pages' worth of index entries. Deep
+    navigation belongs to keyset pagination (paginate_by_cursor()). Deleted
+    books leave gaps in the ids, so the estimate runs ahead of the real count
+    and its last pages come out empty; a view that finds one empty calls
+    aclamp() and sends the reader to the last page that has rows.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if not qs.query.where:
+            return qs.model._default_manager.using(qs.db).aggregate(top=Max("pk"))["top"] or 0
+        return qs.order_by()[:self.count_limit].count()
+
+    async def acount(self):
+        """Async version of count, caches the value the sync property returns"""
+        if "count" not in self.__dict__:
+            qs = self.object_list
+            if not qs.query.where:
+                top = await qs.model._default_manager.using(qs.db).aaggregate(top=Max("pk"))
+                self.__dict__["count"] = top["top"] or 0
+            else:
+                self.__dict__["count"] = await qs.order_by()[:self.count_limit].acount()
+        return self.count
+
+    async def aclamp(self):
+        """Replace the estimate with the exact count - one COUNT(*), only past the real last page"""
+        self.__dict__["count"] = await self.object_list.order_by().acount()
+        self.__dict__["is_estimated"] = False
+        self.__dict__.pop("num_pages", None)
+        return self.count
+
+    @cached_property
+    def is_estimated(self):
+        return not self.object_list.query.where or self.count >= self.count_limit
+
+
+def encode_cursor(direction, pk, filters):
+    """Opaque, signed token holding the page boundary and the filters it was built with"""
+    return signing.dumps({"d": direction, "pk": pk, "f": filters}, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    """Return (direction, pk, filters), or None for a missing or tampered token"""
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        return data["d"], int(data["pk"]), dict(data["f"])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+
+
+class CursorPage:
+    """Page of a keyset pagination over ``-id``, duck-typed after Django's Page for the template"""
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _cursor_window(queryset, token, per_page):
+    """Direction, boundary pk and the sliced queryset (one row more than a page) for a cursor token"""
+    cursor = decode_cursor(token)
+    direction, boundary = (cursor[0], cursor[1]) if cursor else ("next", None)
+    if direction == "prev":
+        return direction, boundary, queryset.filter(pk__gt=boundary).order_by("id")[:per_page + 1]
+    if boundary is not None:
+        queryset = queryset.filter(pk__lt=boundary)
+    return direction, boundary, queryset.order_by("-id")[:per_page + 1]
+
+
+def _cursor_page(rows, direction, boundary, per_page, filters):
+    more = len(rows) > per_page
+    if direction == "prev":
+        rows = rows[:per_page][::-1]
+        has_next, has_previous = True, more
+    else:
+        rows = rows[:per_page]
+        has_next, has_previous = more, boundary is not None
+
+    next_cursor = encode_cursor("next", rows[-1].pk, filters) if rows and has_next else None
+    previous_cursor = encode_cursor("prev", rows[0].pk, filters) if rows and has_previous else None
+    return CursorPage(rows, next_cursor, previous_cursor)
+
+
+def paginate_by_cursor(queryset, token, per_page, filters):
+    """Keyset-paginate a queryset ordered by ``-id``.
+
+    Every page is an indexed range scan with LIMIT, so its cost does not depend
+    on how deep into the catalogue the reader is.
+    """
+    direction, boundary, window = _cursor_window(queryset, token, per_page)
+    return _cursor_page(list(window), direction, boundary, per_page, filters)
+
+
+async def apaginate_by_cursor(queryset, token, per_page, filters):
+    """Async version of paginate_by_cursor()"""
+    direction, boundary, window = _cursor_window(queryset, token, per_page)
+    return _cursor_page([row async for row in window], direction, boundary, per_page, filters)
+
+
+def paginate_comments(queryset, token, per_page):
+    """Keyset-paginate comments newest first on (created_at, id).
+
+    The id breaks ties between comments posted in the same instant. Returns
+    (comments, next_token), next_token is None on the last page.
+    """
+    queryset = queryset.select_related("user").order_by("-created_at", "-id")
+    try:
+        created_at, pk = signing.loads(token, salt=COMMENT_CURSOR_SALT) if token else (None, None)
+        created_at = parse_datetime(created_at) if created_at else None
+    except (signing.BadSignature, TypeError, ValueError):
+        created_at = None
+    if created_at is not None:
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    comments = list(queryset[:per_page + 1])
+    next_token = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        last = comments[-1]
+        next_token = signing.dumps([last.created_at.isoformat(), last.pk], salt=COMMENT_CURSOR_SALT)
+    return comments, next_token
@@ -0,0 +1,127 @@
+"""EXPLAIN QUERY PLAN checks for the queries the views run on every request.
+
+Each entry of HOT_QUERIES builds a queryset the way the view does (with
+placeholder values - the plan does not depend on them) and states what is
+acceptable for it. check_plans() flags a plan that reads a whole large table
+or sorts every matching row; the check_query_plans command runs it.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from django.db import connections
+from django.db.models import Count, Q
+
+from . import leaderboards
+from .filters import INDEX_FILTERS, filter_books
+from .models import Book, Comment, Genre, Job, PendingVote, SimilarBook, Vote
+
+
+# Lookup tables small enough to read whole
+SMALL_TABLES = {"projectcv_genre", "projectcv_tag"}
+
+SCAN_RE = re.compile(r"\bSCAN (?:TABLE )?(\w+)(.*)")
+SORT_RE = re.compile(r"USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)")
+
+
+@dataclass
+class HotQuery:
+    build: Callable
+    # Walks the table in primary key order and stops at the LIMIT (the unfiltered newest-first page)
+    ordered_scan: bool = False
+    # Sorts a result that is already bounded (full-text matches, one book's genres)
+    bounded_sort: bool = False
+
+
+def _listing(**filters):
+    values = dict.fromkeys(INDEX_FILTERS, "")
+    values.update(filters)
+    return filter_books(Book.objects.with_listing_stats().order_by("-id"), values)
+
+
+HOT_QUERIES = {
+    # BookIndex and its estimated-count paginator
+    "index": HotQuery(lambda: _listing()[:21], ordered_scan=True),
+    "index_author": HotQuery(lambda: _listing(author="Nicole Sager")[:21]),
+    "index_rating": HotQuery(lambda: _listing(rating="4")[:21]),
+    "index_genre": HotQuery(lambda: _listing(genre="1")[:21]),
+    "index_author_rating": HotQuery(lambda: _listing(author="Nicole Sager", rating="4")[:21]),
+    "index_search": HotQuery(lambda: _listing(q="shadow")[:21], bounded_sort=True),
+    "index_count_rating": HotQuery(lambda: _listing(rating="4").order_by()[:10000]),
+    "index_count_author": HotQuery(lambda: _listing(author="Nicole Sager").order_by()[:10000]),
+    "index_cursor": HotQuery(lambda: _listing().filter(pk__lt=1000)[:21]),
+    "index_genre_prefetch": HotQuery(lambda: Genre.objects.filter(book__in=[1, 2, 3]).order_by("genre_name"),
+                                     bounded_sort=True),
+    # CurrentBook, BookComments and the HTTP validators
+    "detail_book": HotQuery(lambda: Book.objects.filter(pk=1)),
+    "detail_updated_at": HotQuery(lambda: Book.objects.filter(pk=1).values_list("updated_at")),
+    "detail_user_vote": HotQuery(lambda: Vote.objects.filter(book_id=1, user_id=1)),
+    "detail_pending_vote": HotQuery(lambda: PendingVote.objects.filter(user_id=1, book_id=1).order_by("-id")[:1]),
+    "detail_comments": HotQuery(
+        lambda: Comment.objects.filter(book_id=1).select_related("user").order_by("-created_at", "-id")[:21]
+    ),
+    "detail_comments_after": HotQuery(
+        lambda: Comment.objects.filter(book_id=1).filter(
+            Q(created_at__lt=datetime(2025, 1, 1, tzinfo=timezone.utc))
+            | Q(created_at=datetime(2025, 1, 1, tzinfo=timezone.utc), id__lt=100)
+        ).order_by("-created_at", "-id")[:21]
+    ),
+    "detail_similar": HotQuery(lambda: SimilarBook.objects.filter(book=1).select_related("similar")),
+    # Leaderboards, one range read of each board's index
+    **{
+        f"leaderboard_{board}{scope}": HotQuery(lambda board=board, genre=genre: leaderboards.page(board, genre))
+        for board in leaderboards.BOARDS for scope, genre in (("", None), ("_genre", 1))
+    },
+    # JSON API
+    "api_books": HotQuery(lambda: Book.objects.order_by("-id").values("id", "title", "author")[:101],
+                          ordered_scan=True),
+    "api_vote_distribution": HotQuery(
+        lambda: Vote.objects.filter(book_id=1).order_by().values_list("rating").annotate(Count("id"))
+    ),
+    # run_workers: the next due job, the latency sample of jobs.stats()
+    "job_claim": HotQuery(
+        lambda: Job.objects.filter(status=Job.PENDING, run_at__lte=datetime(2025, 1, 1, tzinfo=timezone.utc))
+        .order_by("run_at", "id")[:5]
+    ),
+    "job_latency": HotQuery(
+        lambda: Job.objects.filter(status=Job.DONE, finished_at__isnull=False).order_by("-finished_at")
+        .values_list("run_at", "started_at", "finished_at")[:1000]
+    ),
+    # import_books upserts
+    "import_lookup": HotQuery(lambda: Book.objects.filter(Q(isbn__in=["9780000000001"]) | Q(ean__in=["1"]))),
+}
+
+
+def explain(queryset):
+    """EXPLAIN QUERY PLAN detail lines of a queryset (SQLite only)"""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems(plan, hot_query):
+    found = []
+    for line in plan:
+        scan = SCAN_RE.search(line)
+        if scan and not hot_query.ordered_scan:
+            table, rest = scan.groups()
+            # A SCAN reads the whole table or index, even "USING INDEX"; only SEARCH narrows it
+            if table not in SMALL_TABLES and "VIRTUAL TABLE" not in rest:
+                found.append(f"full scan of {table}{rest}")
+        sort = SORT_RE.search(line)
+        if sort and not hot_query.bounded_sort:
+            found.append(f"temporary B-tree for {sort.group(1)}")
+    return found
+
+
+def check_plans(using="default"):
+    """[(name, plan lines, problems)] for every hot query"""
+    if connections[using].vendor != "sqlite":
+        raise NotImplementedError("Query plans are only checked on SQLite")
+    results = []
+    for name, hot_query in HOT_QUERIES.items():
+        plan = explain(hot_query.build().using(using))
+        results.append((name, plan, problems(plan, hot_query)))
+    return results
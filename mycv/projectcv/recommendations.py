@@ -0,0 +1,250 @@
+"""Precomputed "similar books".
+
+Every book is a sparse row of features in four blocks: its tags, its
+genres, its author and the ratings users gave it (centred on 3, so opposite
+opinions pull books apart). Each block is L2-normalised per row and scaled
+by the square root of its weight, so the dot product of two rows is the
+weighted sum of their per-block cosine similarities. Neighbours are found a
+batch of books at a time with one sparse product against the whole
+catalogue, and the best NEIGHBOURS of each book are stored in SimilarBook,
+which the book page reads with one indexed query.
+
+Genres are too broad to find candidates with: a genre shared by 100k books
+would make every row of the product that dense (ten times the tags, which
+come next). They only re-rank the candidates the other blocks found, read
+from a table of similarities between the few genre combinations in use.
+
+refresh() only recomputes the books changed since their neighbours were
+computed (Book.updated_at moves on tag, genre and vote changes, see
+projectcv.signals); books listing a changed book keep its old score until
+the next rebuild(). A book without tags, genres or votes has no neighbours
+and is looked at again on every refresh.
+
+NumPy and SciPy are needed here only, by the build_recommendations command;
+the web process never imports this module.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+
+import numpy as np
+from scipy import sparse
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .models import Book, SimilarBook, Vote
+
+
+BLOCK_WEIGHTS = {"tags": 1.0, "genres": 0.6, "author": 0.4, "votes": 1.5}
+NEIGHBOURS = 8
+# Rows multiplied against the catalogue at once, bounds the memory of the product
+BATCH_SIZE = 512
+# Distinct genre combinations up to which their pairwise similarities are kept in
+# one table (6000 ** 2 float32 is 144 MB, up to 3 of 30 genres is 4525 of them);
+# past it the pairs are multiplied out, several times slower
+MAX_GENRE_PROFILES = 6000
+
+
+@dataclass
+class Features:
+    book_ids: np.ndarray  # row number -> Book.id, ascending
+    matrix: sparse.csr_matrix  # tags, author and votes: candidates come from here
+    genres: sparse.csr_matrix  # added to the candidates' scores
+    genre_profile: np.ndarray = None  # row number -> its genre combination
+    genre_table: np.ndarray = None  # similarity of two genre combinations
+
+    def __post_init__(self):
+        # The product runs against the transpose for every batch, convert it once
+        self.matrix_t = self.matrix.T.tocsr()
+        self.genres.sort_indices()
+        counts = np.diff(self.genres.indptr)
+        # A combination is the row's genre columns, padded with -1 to the widest row
+        combos = np.full((self.genres.shape[0], max(1, counts.max(initial=0))), -1, dtype=np.int64)
+        row_of = np.repeat(np.arange(self.genres.shape[0]), counts)
+        combos[row_of, np.arange(self.genres.nnz) - self.genres.indptr[row_of]] = self.genres.indices
+        combos, first, self.genre_profile = np.unique(combos, axis=0, return_index=True, return_inverse=True)
+        self.genre_profile = self.genre_profile.ravel()
+        if len(combos) <= MAX_GENRE_PROFILES:
+            profiles = self.genres[first]
+            self.genre_table = (profiles @ profiles.T).toarray()
+
+    def genre_scores(self, rows, columns):
+        """Genre similarity of the pairs rows[i], columns[i]"""
+        if self.genre_table is not None:
+            return self.genre_table[self.genre_profile[rows], self.genre_profile[columns]]
+        return np.asarray(self.genres[rows].multiply(self.genres[columns]).sum(axis=1)).ravel()
+
+    def rows_of(self, book_ids):
+        """Row numbers of the given books, books missing from the matrix are left out"""
+        book_ids = np.asarray(sorted(book_ids), dtype=np.int64)
+        rows = np.searchsorted(self.book_ids, book_ids)
+        found = rows < len(self.book_ids)
+        found[found] = self.book_ids[rows[found]] == book_ids[found]
+        return rows[found]
+
+
+def _columns(queryset):
+    """A values_list() queryset as one NumPy array per column"""
+    rows = list(queryset.order_by().iterator(chunk_size=10000))
+    if not rows:
+        return [np.empty(0, dtype=np.int64) for _ in queryset._fields]
+    return [np.asarray(column) for column in zip(*rows)]
+
+
+def _block(book_ids, books, keys, values, weight):
+    """Normalised, weighted book x feature block from parallel (book id, feature key, value) arrays"""
+    rows = np.searchsorted(book_ids, books)
+    keys, columns = np.unique(keys, return_inverse=True)
+    block = sparse.csr_matrix(
+        (values.astype(np.float32), (rows, columns)), shape=(len(book_ids), len(keys)), dtype=np.float32,
+    )
+    block.sum_duplicates()
+    block.eliminate_zeros()
+    norms = np.sqrt(np.asarray(block.multiply(block).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(np.sqrt(weight) / norms) @ block).tocsr()
+
+
+def build_features(book_ids, tags, genres, authors, votes, weights=BLOCK_WEIGHTS):
+    """Features from (book, tag), (book, genre), (book, author) and (book, user, rating) arrays"""
+    blocks = [
+        _block(book_ids, *tags, np.ones(len(tags[0])), weights["tags"]),
+        _block(book_ids, *authors, np.ones(len(authors[0])), weights["author"]),
+        _block(book_ids, votes[0], votes[1], votes[2] - 3, weights["votes"]),
+    ]
+    return Features(
+        book_ids,
+        sparse.hstack(blocks, format="csr", dtype=np.float32),
+        _block(book_ids, *genres, np.ones(len(genres[0])), weights["genres"]),
+    )
+
+
+def load_features(using=DEFAULT_DB_ALIAS, weights=BLOCK_WEIGHTS):
+    # One transaction, so every block sees the same catalogue
+    with transaction.atomic(using=using):
+        (book_ids,) = _columns(Book.objects.using(using).values_list("id"))
+        tags = _columns(Book.tags.through.objects.using(using).values_list("book_id", "tag_id"))
+        genres = _columns(Book.genre.through.objects.using(using).values_list("book_id", "genre_id"))
+        authors = _columns(Book.objects.using(using).values_list("id", Lower("author")))
+        votes = _columns(Vote.objects.using(using).values_list("book_id", "user_id", "rating"))
+    book_ids = np.sort(book_ids.astype(np.int64))
+    return build_features(book_ids, tags, genres, authors, votes, weights)
+
+
+def nearest(features, rows, k=NEIGHBOURS):
+    """Best k neighbour rows of each row and their scores, best first, padded with -1 / 0"""
+    scores = (features.matrix[rows] @ features.matrix_t).tocsr()
+    owner = np.repeat(np.arange(len(rows)), np.diff(scores.indptr))
+    keep = (scores.indices != rows[owner]) & (scores.data > 0)
+    owner, columns = owner[keep], scores.indices[keep]
+    data = scores.data[keep] + features.genre_scores(rows[owner], columns)
+
+    neighbours = np.full((len(rows), k), -1, dtype=np.int64)
+    best = np.zeros((len(rows), k), dtype=np.float32)
+    bounds = np.searchsorted(owner, np.arange(len(rows) + 1))
+    for i in range(len(rows)):
+        row_columns, row_data = columns[bounds[i]:bounds[i + 1]], data[bounds[i]:bounds[i + 1]]
+        if len(row_data) > k:
+            top = np.argpartition(-row_data, k)[:k]
+            row_columns, row_data = row_columns[top], row_data[top]
+        order = np.lexsort((row_columns, -row_data))  # equal scores: the older book first, so runs are reproducible
+        neighbours[i, :len(order)] = row_columns[order]
+        best[i, :len(order)] = row_data[order]
+    return neighbours, best
+
+
+def store(features, rows, neighbours, scores, using=DEFAULT_DB_ALIAS):
+    """Replace the stored neighbours of the given rows, returns the ids of books whose list changed.
+
+    Those books get updated_at = computed_at, so the cached page fragments and
+    HTTP validators move on while stale_book_ids() still sees them as current.
+    """
+    now = timezone.now()
+    book_ids = [int(features.book_ids[row]) for row in rows]
+    entries, lists = [], {}
+    for book_id, row_neighbours, row_scores in zip(book_ids, neighbours, scores):
+        lists[book_id] = []
+        for rank, (neighbour, score) in enumerate(zip(row_neighbours, row_scores)):
+            if neighbour < 0:
+                break
+            similar_id = int(features.book_ids[neighbour])
+            lists[book_id].append(similar_id)
+            entries.append(SimilarBook(
+                book_id=book_id, similar_id=similar_id, rank=rank, score=round(float(score), 4), computed_at=now,
+            ))
+
+    stored = SimilarBook.objects.using(using).filter(book_id__in=book_ids)
+    previous = {book_id: [] for book_id in book_ids}
+    for book_id, similar_id in stored.values_list("book_id", "similar_id"):  # in rank order
+        previous[book_id].append(similar_id)
+    changed = [book_id for book_id in book_ids if lists[book_id] != previous[book_id]]
+
+    with transaction.atomic(using=using):
+        stored.delete()
+        SimilarBook.objects.using(using).bulk_create(entries, batch_size=500)
+        Book.objects.using(using).filter(pk__in=changed).update(updated_at=now)
+    return changed
+
+
+# Set in the parent just before the workers fork, so they share it instead of unpickling a copy
+_worker_features = None
+
+
+def _nearest_batch(rows, k):
+    # Runs in a worker process: only computes, the parent writes the results
+    return (rows, *nearest(_worker_features, rows, k))
+
+
+def neighbour_batches(features, rows, k=NEIGHBOURS, batch_size=BATCH_SIZE, workers=None):
+    """(rows, neighbours, scores) batch after batch, computed by forked worker processes.
+
+    workers defaults to the CPU count; with one the batches run in this process.
+    """
+    global _worker_features
+    batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+    workers = min(workers or os.cpu_count() or 1, len(batches))
+    if workers <= 1:
+        for batch in batches:
+            yield (batch, *nearest(features, batch, k))
+        return
+    # Forked workers must not inherit the open SQLite connection
+    connections.close_all()
+    _worker_features = features
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as pool:
+            yield from pool.map(_nearest_batch, batches, repeat(k))
+    finally:
+        _worker_features = None
+
+
+def rebuild(book_ids=None, k=NEIGHBOURS, batch_size=BATCH_SIZE, workers=None, using=DEFAULT_DB_ALIAS):
+    """Recompute the neighbours of the given books (all of them by default), returns how many"""
+    features = load_features(using)
+    rows = np.arange(len(features.book_ids)) if book_ids is None else features.rows_of(book_ids)
+    for batch, neighbours, scores in neighbour_batches(features, rows, k, batch_size, workers):
+        store(features, batch, neighbours, scores, using=using)
+    return len(rows)
+
+
+def stale_book_ids(using=DEFAULT_DB_ALIAS):
+    """Books changed since their neighbours were computed, or never computed"""
+    computed_at = SimilarBook.objects.filter(book=OuterRef("pk")).order_by("rank").values("computed_at")[:1]
+    return list(
+        Book.objects.using(using)
+        .alias(neighbours_at=Subquery(computed_at))
+        .filter(Q(neighbours_at__isnull=True) | Q(updated_at__gt=F("neighbours_at")))
+        .values_list("pk", flat=True)
+    )
+
+
+def refresh(k=NEIGHBOURS, batch_size=BATCH_SIZE, workers=None, using=DEFAULT_DB_ALIAS):
+    """Recompute the stale books only, returns how many"""
+    stale = stale_book_ids(using)
+    if not stale:
+        return 0
+    return rebuild(stale, k, batch_size, workers, using)
@@ -0,0 +1,135 @@
+"""Send reads to replica databases and writes to the primary.
+
+Settings:
+
+``DATABASE_PRIMARY``
+    alias every write goes to (``"default"``).
+``DATABASE_REPLICAS``
+    aliases reads are spread over; with none configured everything uses
+    the primary and the router does nothing.
+``REPLICA_PIN_SECONDS``
+    how long a client that wrote keeps reading from the primary, long
+    enough to cover the replication lag.
+
+Replicas only serve reads of requests that went through
+ReplicaPinningMiddleware and are safe (GET, HEAD, ...): a POST reads what
+it is about to change from the primary, and management commands and
+background work outside a request always use the primary. Once a request
+writes, its later reads go to the primary as well, and the response sets a
+cookie pinning the client's next requests there, so a user sees their own
+vote or comment straight away.
+
+Two SQLite files stand in for a real primary and replica locally::
+
+    DATABASES["replica"] = {**DATABASES["default"], "NAME": BASE_DIR / "db-replica.sqlite3",
+                            "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS = ["replica"]
+
+and ``python manage.py sync_replica`` copies the primary over the replica
+(``--interval`` keeps doing it, to play a replication delay).
+"""
+import random
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = "db_primary"
+# Small, written on every request (sessions): a stale read would log the user out
+PRIMARY_ONLY_APPS = {"sessions"}
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+@dataclass
+class RequestState:
+    pinned: bool = False  # read from the primary
+    wrote: bool = False
+
+
+# Mutated, not replaced, so a write in a sync_to_async() thread is seen by the request
+_request_state = ContextVar("projectcv_db_request_state", default=None)
+
+
+def primary_alias():
+    return getattr(settings, "DATABASE_PRIMARY", DEFAULT_DB_ALIAS)
+
+
+def replica_aliases():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        state = _request_state.get()
+        if not replicas or state is None or state.pinned or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return primary_alias()
+        # Related objects are read from where their parent came from
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return primary_alias()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {primary_alias(), *replica_aliases()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Let PrimaryReplicaRouter know about the request, see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        # sync_to_async() copies the context into its thread, the state object is shared with it
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        return self.finish(response, state)
+
+    def start(self, request):
+        state = RequestState(pinned=request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES)
+        return state, _request_state.set(state)
+
+    def finish(self, response, state):
+        if state.wrote and replica_aliases():
+            response.set_cookie(
+                PIN_COOKIE, "1", max_age=getattr(settings, "REPLICA_PIN_SECONDS", 5), httponly=True, samesite="Lax",
+            )
+        return response
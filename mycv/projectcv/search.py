@@ -0,0 +1,113 @@
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Book
+
+
+FTS_TABLE = "projectcv_book_fts"
+FTS_COLUMNS = ("title", "author", "publisher", "blurb", "author_bio", "tags", "genres")
+# bm25 weight per column, in FTS_COLUMNS order - a hit in the title counts most
+FTS_WEIGHTS = (10.0, 6.0, 2.0, 1.0, 1.0, 3.0, 3.0)
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def is_fts_available(using="default"):
+    return connections[using].vendor == "sqlite"
+
+
+def create_search_table(connection):
+    """Create the FTS5 table and store the column weights as its default rank function"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{', '.join(FTS_COLUMNS)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', 'bm25({weights})')")
+
+
+def build_match_query(text):
+    """Turn free user input into an FTS5 query: every word quoted and matched as a prefix"""
+    terms = TERM_RE.findall(text or "")
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def _batches(ids, size=500):
+    """Split ids into lists small enough for SQLite's bound-parameter limit"""
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _populate_sql(where=""):
+    """INSERT ... SELECT building the search rows straight from the book and M2M tables"""
+    book_table = Book._meta.db_table
+    tags_table = Book.tags.through._meta.db_table
+    genre_table = Book.genre.through._meta.db_table
+    return (
+        f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) "
+        f"SELECT b.id, b.title, b.author, COALESCE(b.publisher, ''), COALESCE(b.blurb, ''), "
+        f"COALESCE(b.author_bio, ''), "
+        f"COALESCE((SELECT group_concat(t.tag_title, ' ') FROM {tags_table} bt "
+        f"JOIN projectcv_tag t ON t.id = bt.tag_id WHERE bt.book_id = b.id), ''), "
+        f"COALESCE((SELECT group_concat(g.genre_name, ' ') FROM {genre_table} bg "
+        f"JOIN projectcv_genre g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '') "
+        f"FROM {book_table} b {where}"
+    )
+
+
+def index_books(book_ids, using="default"):
+    """(Re)write the search rows for the given books, dropping rows of books that no longer exist"""
+    if not is_fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        for batch in _batches(book_ids):
+            placeholders = ", ".join(["%s"] * len(batch))
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", batch)
+            cursor.execute(_populate_sql(f"WHERE b.id IN ({placeholders})"), batch)
+
+
+def remove_books(book_ids, using="default"):
+    if not is_fts_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        for batch in _batches(book_ids):
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def rebuild_index(using="default"):
+    """Index the whole catalogue again in one statement, returns the number of rows written"""
+    if not is_fts_available(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(_populate_sql())
+        written = cursor.rowcount
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+    return written
+
+
+def search_books(queryset, text):
+    """Filter a Book queryset by full-text search, best matches first.
+
+    On SQLite the FTS5 table is joined and ordered by its bm25 rank; other
+    backends fall back to icontains over the same fields.
+    """
+    match = build_match_query(text)
+    if not match:
+        return queryset.none()
+    if is_fts_available(queryset.db):
+        return queryset.filter(search_entry__document__match=match).order_by("search_entry__rank", "-id")
+
+    fallback = Q()
+    for term in TERM_RE.findall(text):
+        fallback &= (
+            Q(title__icontains=term) | Q(author__icontains=term) | Q(publisher__icontains=term)
+            | Q(blurb__icontains=term) | Q(author_bio__icontains=term)
+            | Q(pk__in=Book.objects.filter(tags__tag_title__icontains=term).values("pk"))
+            | Q(pk__in=Book.objects.filter(genre__genre_name__icontains=term).values("pk"))
+        )
+    return queryset.filter(fallback)
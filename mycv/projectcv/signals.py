@@ -0,0 +1,213 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import conditional, facets, images, jobs, leaderboards, search
+from .models import Book, Comment, Genre, Tag, Vote
+
+
+@receiver(post_save, sender=Vote)
+def vote_saved(sender, instance, created, using, **kwargs):
+    """Keep Book.vote_count / vote_sum / average_rating in step with a new or changed vote"""
+    books = Book.objects.using(using).filter(pk=instance.book_id)
+    if created:
+        books.adjust_vote_totals(1, instance.rating)
+    else:
+        previous = getattr(instance, "_loaded_rating", None)
+        if previous is None:
+            # Instance was not loaded from the database, fall back to a full recount for this book
+            books.recompute_vote_totals()
+        elif previous != instance.rating:
+            books.adjust_vote_totals(0, instance.rating - previous)
+    instance._loaded_rating = instance.rating
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted(sender, instance, using, **kwargs):
+    rating = getattr(instance, "_loaded_rating", None) or instance.rating
+    Book.objects.using(using).filter(pk=instance.book_id).adjust_vote_totals(-1, -rating)
+
+
+# Full-text search index
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, using, **kwargs):
+    search.index_books([instance.pk], using)
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, using, **kwargs):
+    search.remove_books([instance.pk], using)
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_categories_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            search.index_books([instance.pk], using)
+        return
+    # Reverse side: instance is a Tag or Genre and the affected books, possibly thousands, are reindexed by a job
+    if action == "pre_clear":
+        instance._affected_book_ids = list(instance.book_set.values_list("pk", flat=True))
+    elif action == "post_clear":
+        jobs.enqueue("search.index_books", getattr(instance, "_affected_book_ids", []), using=using)
+    elif action in ("post_add", "post_remove"):
+        jobs.enqueue("search.index_books", sorted(pk_set), using=using)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Genre)
+def category_saved(sender, instance, created, using, **kwargs):
+    if not created:
+        jobs.enqueue("search.index_category", sender._meta.model_name, instance.pk, using=using)
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Genre)
+def category_deleting(sender, instance, **kwargs):
+    instance._affected_book_ids = list(instance.book_set.values_list("pk", flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Genre)
+def category_deleted(sender, instance, using, **kwargs):
+    jobs.enqueue("search.index_books", getattr(instance, "_affected_book_ids", []), using=using)
+
+
+# Index sidebar facets
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def facet_source_changed(sender, **kwargs):
+    facets.invalidate()
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        facets.invalidate()
+
+
+# Image derivatives
+
+@receiver(post_save, sender=Book)
+def book_images_saved(sender, instance, raw, using, **kwargs):
+    if raw:
+        return
+    for field_name in images.DERIVATIVE_WIDTHS:
+        field_file = getattr(instance, field_name)
+        if (getattr(instance, f"{field_name}_variants") or {}).get("source") != (field_file.name or None):
+            # Resizing takes seconds per image, a worker does it (projectcv.tasks)
+            jobs.enqueue("images.build_book_variants", instance.pk, using=using)
+            return
+
+
+@receiver(post_delete, sender=Book)
+def book_images_deleted(sender, instance, using, **kwargs):
+    files = []
+    for field_name in images.DERIVATIVE_WIDTHS:
+        field_file = getattr(instance, field_name)
+        if field_file:
+            manifest = getattr(instance, f"{field_name}_variants") or {}
+            derivatives = [name for variants in manifest.get("variants", {}).values() for _, name in variants]
+            files.append([field_file.name, derivatives])
+    if files:
+        jobs.enqueue("images.delete_unreferenced", files, using=using)
+
+
+# HTTP validators (Book.updated_at and the catalogue timestamp)
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Vote)
+@receiver(post_delete, sender=Vote)
+def catalogue_changed(sender, **kwargs):
+    # Book.save() sets updated_at itself, vote receivers above bump it through adjust_vote_totals()
+    conditional.touch_catalogue()
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, using, **kwargs):
+    Book.objects.using(using).filter(pk=instance.book_id).touch()
+
+
+@receiver(m2m_changed, sender=Book.tags.through)
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_relations_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        Book.objects.using(using).filter(pk=instance.pk).touch()
+    elif pk_set:
+        Book.objects.using(using).filter(pk__in=pk_set).touch()
+    else:
+        # Reverse clear: the relations are already gone, their ids were kept at pre_clear
+        Book.objects.using(using).filter(pk__in=getattr(instance, "_affected_book_ids", [])).touch()
+    conditional.touch_catalogue()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Genre)
+def category_renamed(sender, instance, created, using, **kwargs):
+    if not created:
+        instance.book_set.using(using).touch()
+    conditional.touch_catalogue()
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Genre)
+def category_removed(sender, instance, using, **kwargs):
+    Book.objects.using(using).filter(pk__in=getattr(instance, "_affected_book_ids", [])).touch()
+    conditional.touch_catalogue()
+
+
+# Leaderboards (after the vote aggregates above, top_rated is computed from them)
+
+@receiver(post_save, sender=Vote)
+def vote_ranked(sender, instance, created, using, **kwargs):
+    leaderboards.vote_changed(instance.book_id, 1 if created else 0, using)
+
+
+@receiver(post_delete, sender=Vote)
+def vote_unranked(sender, instance, using, **kwargs):
+    recent = instance.created_at is not None and instance.created_at >= leaderboards.trending_since()
+    leaderboards.vote_changed(instance.book_id, -1 if recent else 0, using)
+
+
+@receiver(post_save, sender=Comment)
+def comment_ranked(sender, instance, created, using, **kwargs):
+    if created:
+        leaderboards.comment_changed(instance.book_id, 1, using)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_unranked(sender, instance, using, **kwargs):
+    leaderboards.comment_changed(instance.book_id, -1, using)
+
+
+@receiver(post_save, sender=Book)
+def book_ranked(sender, instance, created, using, **kwargs):
+    if created:
+        leaderboards.book_added(instance.pk, using)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_ranked(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action == "post_add":
+        if reverse:
+            leaderboards.genres_added([(book_id, instance.pk) for book_id in pk_set], using)
+        else:
+            leaderboards.genres_added([(instance.pk, genre_id) for genre_id in pk_set], using)
+    elif action == "post_remove":
+        if reverse:
+            leaderboards.genres_removed(pk_set, [instance.pk], using)
+        else:
+            leaderboards.genres_removed([instance.pk], pk_set, using)
+    elif action == "post_clear":
+        if reverse:
+            leaderboards.genres_removed(genre_ids=[instance.pk], using=using)
+        else:
+            leaderboards.genres_removed([instance.pk], using=using)
@@ -0,0 +1,56 @@
+"""Jobs the signal receivers queue instead of running them inside the request (see projectcv.jobs)"""
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import timezone
+
+from . import images, search
+from .jobs import task
+from .models import Book, Genre, Tag
+from .storage import content_addressed_storage
+
+
+@task("images.build_book_variants")
+def build_book_variants(book_id, using=DEFAULT_DB_ALIAS):
+    """Resize the book's cover and author photo; the pages serve the originals until this ran"""
+    fields = [*images.DERIVATIVE_WIDTHS, *(f"{name}_variants" for name in images.DERIVATIVE_WIDTHS)]
+    book = Book.objects.using(using).filter(pk=book_id).only(*fields).first()
+    if book is None:
+        return
+    changes = {}
+    for field_name in images.DERIVATIVE_WIDTHS:
+        manifest_field = f"{field_name}_variants"
+        current = getattr(book, manifest_field)
+        manifest = images.variants_for(getattr(book, field_name), current)
+        if manifest != current:
+            changes[manifest_field] = manifest
+    if changes:
+        # update() rather than save() so the Book receivers do not run (and queue this job) again
+        Book.objects.using(using).filter(pk=book_id).update(updated_at=timezone.now(), **changes)
+
+
+@task("images.delete_unreferenced")
+def delete_unreferenced(files, using=DEFAULT_DB_ALIAS):
+    """Delete [[original name, [derivative names]], ...] of a deleted book that no other book uses.
+
+    Uploads are content addressed, another book with the same picture has the same names.
+    """
+    for source, derivatives in files:
+        if Book.objects.using(using).filter(Q(image=source) | Q(author_photo=source)).exists():
+            continue
+        content_addressed_storage.delete(source)
+        for name in derivatives:
+            default_storage.delete(name)
+
+
+@task("search.index_books")
+def index_books(book_ids, using=DEFAULT_DB_ALIAS):
+    search.index_books(book_ids, using)
+
+
+@task("search.index_category")
+def index_category(model_name, pk, using=DEFAULT_DB_ALIAS):
+    """Reindex every book of a renamed tag or genre"""
+    category = {"tag": Tag, "genre": Genre}[model_name].objects.using(using).filter(pk=pk).first()
+    if category is not None:  # a deleted one queued its books itself
+        search.index_books(category.book_set.values_list("pk", flat=True), using)
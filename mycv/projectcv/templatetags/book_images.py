@@ -0,0 +1,31 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html, format_html_join
+
+from projectcv import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(field_file, manifest, sizes="100vw", **attrs):
+    """<picture> with AVIF/WebP sources and a JPEG srcset, falling back to the original upload.
+
+    Usage: {% responsive_image book.image book.image_variants sizes="320px" alt=book.title class="book-cover" %}
+    """
+    if not field_file:
+        return ""
+    manifest = manifest or {}
+    if manifest.get("source") != field_file.name:
+        # Derivatives not built (yet) for this upload, serve the original as before
+        return format_html("<img src=\"{}\"{}>", field_file.url, flatatt(attrs))
+
+    sources = format_html_join(
+        "", "<source type=\"{}\" srcset=\"{}\" sizes=\"{}\">",
+        (
+            (images.MIME_TYPES[fmt], images.srcset(manifest, fmt), sizes)
+            for fmt in manifest["variants"] if fmt != "jpeg"
+        ),
+    )
+    img_attrs = dict(attrs, sizes=sizes, srcset=images.srcset(manifest, "jpeg"))
+    return format_html("<picture>{}<img src=\"{}\"{}></picture>", sources, field_file.url, flatatt(img_attrs))
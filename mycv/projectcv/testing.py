@@ -0,0 +1,26 @@
+"""Test helpers: query budgets enforced in the test-suite, assertions on a response's SQL"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Default test runner (settings.TEST_RUNNER): a request over its view's query budget fails the test"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
+
+
+class QueryStatsAssertions:
+    """TestCase mixin for the stats QueryCountMiddleware attaches to every response"""
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        stats = response.query_stats
+        budget = response.query_budget if budget is None else budget
+        if budget is None:
+            self.fail(f"{response.wsgi_request.path} has no query budget")
+        self.assertLessEqual(stats.count, budget, f"{stats.count} queries, budget {budget}")
+
+    def assertNoRepeatedQueries(self, response, allowed=0):
+        sql, times = response.query_stats.most_repeated()
+        self.assertLessEqual(response.query_stats.duplicates, allowed, f"ran {times} times: {sql}")
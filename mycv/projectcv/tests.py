@@ -1,3 +1,1164 @@
-from django.test import TestCase
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse
+from django.db import OperationalError, connection, router, transaction
+from django.db.models import Count, Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import catalogue_io, facets, images, jobs, leaderboards, query_plans, recommendations, search, vote_buffer, votes
+from .api import API_COMMENT_CURSOR_SALT
+from .backends.retry import retry_on_busy
+from .backends.sqlite3.base import DatabaseWrapper
+from .filters import filter_books
+from .instrumentation import QueryBudgetExceeded, QueryCountMiddleware, query_budget
+from .management.commands.import_books import NAME_LOOKUP_SIZE, NameCache
+from .models import Book, Comment, Genre, Job, LeaderboardEntry, PendingVote, SimilarBook, Tag, Vote
+from .routers import PIN_COOKIE, ReplicaPinningMiddleware
+from .storage import content_addressed_storage
+from .testing import QueryStatsAssertions
+
+
+# The site's caches are files under BASE_DIR, the tests get their own in memory
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "projectcv-tests"},
+    "fragments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "projectcv-tests-fragments"},
+}
+
+
+def create_user(email="reader@example.com", **fields):
+    user = get_user_model().objects.create_user(email, "correct horse battery staple")
+    if fields:
+        get_user_model().objects.filter(pk=user.pk).update(**fields)
+        user.refresh_from_db()
+    return user
+
+
+def create_books(count, genres=(), voters=(), rating=4, author="Ann Author", **fields):
+    """count books with the given genres, each voted `rating` by every voter"""
+    books = []
+    for i in range(count):
+        book = Book.objects.create(title=f"Book {i}", author=author, **fields)
+        book.genre.set(genres)
+        for user in voters:
+            Vote.objects.create(user=user, book=book, rating=rating)
+        books.append(book)
+    return books
+
+
+@query_budget(1)
+def over_budget(request):
+    return HttpResponse(str(Book.objects.count() + Genre.objects.count()))
+
+
+@query_budget(1)
+async def over_budget_async(request):
+    # The second count in a thread of its own, as BookIndex reads its facets
+    books = await Book.objects.acount()
+    genres = await sync_to_async(Genre.objects.count, thread_sensitive=False)()
+    return HttpResponse(str(books + genres))
+
+
+async def routed(request):
+    """Where Book reads go before and after an optional write, both asked from threads of their own"""
+    before = await sync_to_async(router.db_for_read, thread_sensitive=False)(Book)
+    if "write" in request.GET:
+        await sync_to_async(router.db_for_write, thread_sensitive=False)(Book)
+    after = await sync_to_async(router.db_for_read)(Book)
+    return JsonResponse({"before": before, "after": after})
+
+
+# Jobs of JobTests: the calls they got, and one that always raises
+job_calls = []
+
+
+@jobs.task("tests.record")
+def record_job(value, using):
+    job_calls.append((value, using))
+
+
+@jobs.task("tests.fail", max_attempts=2)
+def failing_job(using):
+    raise RuntimeError("Nothing works")
+
+
+# ROOT_URLCONF of the tests that need views of their own: the site, two views over their
+# budgets and one reporting the router's choices
+urlpatterns = [
+    path("projectcv/", include("projectcv.urls")),
+    path("over-budget/", over_budget),
+    path("over-budget-async/", over_budget_async),
+    path("routed/", routed),
+]
+
+
+def clear_caches():
+    for alias in TEST_CACHES:
+        caches[alias].clear()
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class CatalogueTestCase(TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ThreadedCatalogueTestCase(TransactionTestCase):
+    """For the views that also read in threads of their own (views.index_snapshot()).
+
+    Those threads have connections of their own, which see committed rows only.
+    """
+
+    def setUp(self):
+        clear_caches()
+
+
+class BookIndexQueryTests(QueryStatsAssertions, ThreadedCatalogueTestCase):
+
+    def test_query_count_does_not_grow_with_books_or_votes(self):
+        genres = [Genre.objects.create(genre_name=name) for name in ("Fantasy", "History")]
+        voters = [create_user(f"voter{i}@example.com") for i in range(6)]
+        counts = {}
+        for total, voter_count in [(3, 1), (25, 3), (65, 6)]:
+            create_books(total - Book.objects.count(), genres=genres, voters=voters[:voter_count])
+            for page in range(1, (total - 1) // 20 + 2):
+                clear_caches()
+                response = self.client.get(reverse("book_index"), {"page": page})
+                self.assertEqual(len(response.context["books"]), min(20, total - (page - 1) * 20))
+                counts[total, page] = response.query_stats.count
+        # MAX(id) for the estimated count, one page of books, their genres prefetched, and the three
+        # queries of the facets in index_snapshot()'s thread, whatever the books, votes and page
+        self.assertEqual(set(counts.values()), {6}, counts)
+
+    def test_listing_stats_come_from_the_stored_aggregates(self):
+        genres = [Genre.objects.create(genre_name=name) for name in ("Fantasy", "History")]
+        create_books(3, genres=genres, voters=[create_user(f"voter{i}@example.com") for i in range(3)])
+        books = self.client.get(reverse("book_index")).context["books"]
+        self.assertEqual({tuple(genre.genre_name for genre in book.genre_list) for book in books},
+                         {("Fantasy", "History")})
+        self.assertEqual({(book.vote_count, book.display_rating) for book in books}, {(3, 4.0)})
+
+    def test_cached_rows_are_not_queried(self):
+        create_books(3)
+        first = self.client.get(reverse("book_index"))
+        # The rows fragment and the facets are cached now: only MAX(id) for the page numbers
+        second = self.client.get(reverse("book_index"))
+        self.assertEqual(second.query_stats.count, 1)
+        self.assertEqual(first.content, second.content)
+
+
+class EstimatedCountPaginationTests(ThreadedCatalogueTestCase):
+
+    def test_page_past_the_real_end_shows_the_last_page(self):
+        books = create_books(30)
+        # MAX(id) still estimates 30 books, two pages of 20, but only 15 are left
+        Book.objects.filter(pk__in=[book.pk for book in books[1:16]]).delete()
+
+        response = self.client.get(reverse("book_index"), {"page": 2, "rating": ""})
+        self.assertRedirects(response, f"{reverse('book_index')}?page=1&rating=", fetch_redirect_response=False)
+        page = self.client.get(response.url).context["page_obj"]
+        self.assertEqual((page.number, len(page.object_list)), (1, 15))
+
+    def test_pages_within_the_estimate_stay_estimated(self):
+        create_books(25)
+        response = self.client.get(reverse("book_index"), {"page": 2})
+        page = response.context["page_obj"]
+        self.assertEqual((page.number, len(page.object_list)), (2, 5))
+        self.assertTrue(page.paginator.is_estimated)
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT in a temporary directory, removed after the test"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class FacetCacheTests(CatalogueTestCase):
+
+    def counts(self):
+        sidebar = facets.get_facets()
+        return (
+            {row["author"]: row["book_count"] for row in sidebar["authors"]},
+            {row["genre_name"]: row["book_count"] for row in sidebar["genres"]},
+            {row["value"]: row["book_count"] for row in sidebar["ratings"] if row["book_count"]},
+        )
+
+    def test_cached_until_a_book_or_genre_changes(self):
+        fantasy = Genre.objects.create(genre_name="Fantasy")
+        book = Book.objects.create(title="Dune", author="Ann Author", rating=4)
+        book.genre.add(fantasy)
+        self.assertEqual(self.counts(), ({"Ann Author": 1}, {"Fantasy": 1}, {4: 1}))
+        version = facets.get_version()
+
+        # Votes feed the stored aggregates, not the facets: still served from the cache
+        Vote.objects.create(user=create_user(), book=book, rating=5)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), ({"Ann Author": 1}, {"Fantasy": 1}, {4: 1}))
+        self.assertEqual(facets.get_version(), version)
+
+        def rate(rating):
+            book.refresh_from_db()
+            book.rating = rating
+            book.save()
+
+        writes = [
+            (lambda: Book.objects.create(title="Emma", author="Bob Writer"),
+             ({"Ann Author": 1, "Bob Writer": 1}, {"Fantasy": 1}, {4: 1})),
+            (lambda: rate(2), ({"Ann Author": 1, "Bob Writer": 1}, {"Fantasy": 1}, {2: 1})),
+            (lambda: Genre.objects.create(genre_name="History"),
+             ({"Ann Author": 1, "Bob Writer": 1}, {"Fantasy": 1, "History": 0}, {2: 1})),
+            (lambda: book.genre.clear(), ({"Ann Author": 1, "Bob Writer": 1}, {"Fantasy": 0, "History": 0}, {2: 1})),
+            (lambda: book.delete(), ({"Bob Writer": 1}, {"Fantasy": 0, "History": 0}, {})),
+        ]
+        for write, expected in writes:
+            write()
+            self.assertNotEqual(facets.get_version(), version)
+            version = facets.get_version()
+            self.assertEqual(self.counts(), expected)
+
+
+class SearchTests(CatalogueTestCase):
+
+    def search(self, text):
+        return [book.title for book in search.search_books(Book.objects.all(), text)]
+
+    def test_ranked_prefix_search(self):
+        Book.objects.create(title="War with the Newts", author="Karel Čapek")
+        Book.objects.create(title="Notes", author="Someone Else", blurb="A study of the war years")
+        self.assertEqual(self.search("capek"), ["War with the Newts"])
+        self.assertEqual(self.search("new"), ["War with the Newts"])
+        # The title hit outweighs the blurb one
+        self.assertEqual(self.search("war"), ["War with the Newts", "Notes"])
+        self.assertEqual(self.search("  "), [])
+
+    def test_index_follows_book_writes(self):
+        book = Book.objects.create(title="Dune", author="Frank Herbert")
+        self.assertEqual(self.search("dune"), ["Dune"])
+
+        book.title = "Children of Dune"
+        book.save()
+        self.assertEqual(self.search("children"), ["Children of Dune"])
+
+        space = Genre.objects.create(genre_name="Space")
+        book.genre.add(space)
+        self.assertEqual(self.search("space"), ["Children of Dune"])
+        book.genre.remove(space)
+        self.assertEqual(self.search("space"), [])
+
+        book.delete()
+        self.assertEqual(self.search("dune"), [])
+
+    def test_renamed_genre_is_reindexed_by_a_job(self):
+        book = Book.objects.create(title="Dune", author="Frank Herbert")
+        genre = Genre.objects.create(genre_name="Space")
+        book.genre.add(genre)
+        genre.genre_name = "Desert planet"
+        with self.captureOnCommitCallbacks(execute=True):
+            genre.save()
+        self.assertEqual(self.search("desert"), [])
+        self.assertTrue(jobs.run_next("worker"))
+        self.assertEqual(self.search("desert"), ["Dune"])
+
+
+class ConditionalGetTests(ThreadedCatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.book, = create_books(1)
+        # An hour old, so a change moves Last-Modified on by more than its one second resolution
+        Book.objects.filter(pk=self.book.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        self.url = reverse("book_detail", args=[self.book.pk])
+
+    def test_book_page_answers_304_until_the_book_changes(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        etag, last_modified = first["ETag"], first["Last-Modified"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        Vote.objects.create(user=create_user(), book=self.book, rating=5)
+        Book.objects.get(pk=self.book.pk).save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_signed_in_users_get_an_etag_of_their_own(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.force_login(create_user())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_index_answers_304_until_the_catalogue_changes(self):
+        url = reverse("book_index")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        create_books(1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ImageVariantTests(TemporaryMediaMixin, CatalogueTestCase):
+
+    def store(self, image, name="book_covers/cover.png"):
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    def decoded_variants(self, manifest):
+        for fmt, variants in manifest["variants"].items():
+            for width, name in variants:
+                with default_storage.open(name, "rb") as fh:
+                    yield fmt, width, Image.open(fh).convert("RGB")
+
+    def test_transparent_areas_become_white(self):
+        # Left half transparent black, right half opaque red
+        image = Image.new("RGBA", (200, 100), (0, 0, 0, 0))
+        image.paste((255, 0, 0, 255), (100, 0, 200, 100))
+        manifest = images.build_variants(self.store(image), (160,))
+
+        self.assertEqual(set(manifest["variants"]), set(images.available_formats()))
+        for fmt, width, variant in self.decoded_variants(manifest):
+            self.assertEqual(variant.width, width)
+            left, right = variant.getpixel((5, 5)), variant.getpixel((variant.width - 5, 5))
+            self.assertTrue(all(channel > 240 for channel in left), f"{fmt} {width}w: {left}")
+            self.assertTrue(right[0] > 200 and right[1] < 60, f"{fmt} {width}w: {right}")
+
+    def test_palette_transparency_becomes_white(self):
+        image = Image.new("P", (120, 60), 0)
+        image.putpalette([0, 0, 0, 0, 0, 255] + [0, 0, 0] * 254)
+        image.paste(1, (60, 0, 120, 60))
+        image.info["transparency"] = 0
+        manifest = images.build_variants(self.store(image), (96,))
+        for fmt, width, variant in self.decoded_variants(manifest):
+            left, right = variant.getpixel((3, 3)), variant.getpixel((variant.width - 3, 3))
+            self.assertTrue(all(channel > 240 for channel in left), f"{fmt} {width}w: {left}")
+            self.assertTrue(right[2] > 200 and right[0] < 60, f"{fmt} {width}w: {right}")
+
+
+class MediaStorageTests(TemporaryMediaMixin, CatalogueTestCase):
+
+    def age(self, name, hours):
+        then = time.time() - hours * 3600
+        os.utime(content_addressed_storage.path(name), (then, then))
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command("collect_media_garbage", *args, stdout=out)
+        return out.getvalue()
+
+    def test_same_bytes_are_stored_once(self):
+        first = content_addressed_storage.save("book_covers/cover.JPG", ContentFile(b"cover bytes"))
+        second = content_addressed_storage.save("book_covers/other.jpg", ContentFile(b"cover bytes"))
+        other = content_addressed_storage.save("book_covers/cover.jpg", ContentFile(b"other bytes"))
+
+        digest = hashlib.sha256(b"cover bytes").hexdigest()
+        self.assertEqual(first, f"book_covers/{digest[:2]}/{digest}.jpg")
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        files = [name for _dirs, _subdirs, names in os.walk(self.media_root) for name in names]
+        self.assertEqual(len(files), 2)
+
+    def test_garbage_collection_keeps_referenced_and_recent_files(self):
+        cover = content_addressed_storage.save("book_covers/cover.jpg", ContentFile(b"cover"))
+        variant = content_addressed_storage.save("book_covers/cover-160.webp", ContentFile(b"variant"))
+        photo = content_addressed_storage.save("author_photos/photo.jpg", ContentFile(b"photo"))
+        orphan = content_addressed_storage.save("book_covers/orphan.jpg", ContentFile(b"orphan"))
+        recent = content_addressed_storage.save("book_covers/recent.jpg", ContentFile(b"recent"))
+        Book.objects.create(
+            title="Dune", author="Frank Herbert", image=cover, author_photo=photo,
+            image_variants={"variants": {"webp": [[160, variant]]}},
+        )
+        for name in (cover, variant, photo, orphan):
+            self.age(name, hours=48)
+
+        self.assertIn(f"Would delete {orphan}", self.collect("--dry-run"))
+        self.assertTrue(content_addressed_storage.exists(orphan))
+
+        output = self.collect()
+        self.assertIn("in 1 file(s)", output)
+        self.assertFalse(content_addressed_storage.exists(orphan))
+        for name in (cover, variant, photo, recent):
+            self.assertTrue(content_addressed_storage.exists(name), name)
+
+
+class ImportBooksTests(CatalogueTestCase):
+
+    def import_csv(self, rows):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=["title", "author", "isbn", "genres", "tags"])
+            writer.writeheader()
+            writer.writerows(rows)
+        call_command("import_books", path, stdout=StringIO())
+
+    def test_update_bumps_updated_at_and_leaderboard_genres(self):
+        self.import_csv([
+            {"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "genres": "Science fiction"},
+            {"title": "Emma", "author": "Jane Austen", "isbn": "9780141439587", "genres": "Classics|Romance"},
+        ])
+        dune = Book.objects.get(isbn="9780441172719")
+        self.assertEqual(
+            set(LeaderboardEntry.objects.filter(book=dune).values_list("genre__genre_name", flat=True)),
+            {None, "Science fiction"},
+        )
+        self.assertEqual(LeaderboardEntry.objects.filter(book__isbn="9780141439587").count(), 3)
+
+        Book.objects.filter(pk=dune.pk).update(updated_at=dune.updated_at - timedelta(days=1))
+        self.import_csv([
+            {"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "genres": "SCIENCE FICTION|Classics"},
+        ])
+        updated = Book.objects.get(pk=dune.pk)
+        self.assertGreater(updated.updated_at, dune.updated_at)
+        self.assertEqual(sorted(updated.genre.values_list("genre_name", flat=True)), ["Classics", "Science fiction"])
+        self.assertEqual(
+            set(LeaderboardEntry.objects.filter(book=dune).values_list("genre__genre_name", flat=True)),
+            {None, "Classics", "Science fiction"},
+        )
+        self.assertEqual(Genre.objects.count(), 3)
+
+    def test_rows_without_lists_keep_the_links(self):
+        self.import_csv([
+            {"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "genres": "Science fiction",
+             "tags": "desert|spice"},
+        ])
+        self.import_csv([
+            {"title": "Dune", "author": "Frank Herbert", "isbn": "9780441172719", "tags": "classic"},
+        ])
+        dune = Book.objects.get(isbn="9780441172719")
+        self.assertEqual(list(dune.genre.values_list("genre_name", flat=True)), ["Science fiction"])
+        self.assertEqual(list(dune.tags.values_list("tag_title", flat=True)), ["classic"])
+        self.assertEqual(
+            set(LeaderboardEntry.objects.filter(book=dune).values_list("genre__genre_name", flat=True)),
+            {None, "Science fiction"},
+        )
+
+        self.import_csv([{"title": "Dune Messiah", "author": "Frank Herbert", "isbn": "9780441172719"}])
+        dune.refresh_from_db()
+        self.assertEqual(dune.title, "Dune Messiah")
+        self.assertEqual((dune.genre.count(), dune.tags.count()), (1, 1))
+
+    def test_name_cache_resolves_more_names_than_one_lookup(self):
+        count = NAME_LOOKUP_SIZE * 2 + 1
+        Tag.objects.bulk_create([Tag(tag_title=f"tag {i}") for i in range(0, count, 2)])
+        ids = NameCache(Tag, "tag_title").resolve({f"TAG {i}" for i in range(count)})
+
+        self.assertEqual(len(ids), count)
+        self.assertEqual(Tag.objects.count(), count)
+        self.assertEqual(ids["tag 2"], Tag.objects.get(tag_title="tag 2").pk)
+        self.assertEqual(Tag.objects.get(pk=ids["tag 3"]).tag_title, "TAG 3")
+
+
+class ExportBooksTests(CatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        fantasy, classics = Genre.objects.create(genre_name="Fantasy"), Genre.objects.create(genre_name="Classics")
+        hobbit = Book.objects.create(title="The Hobbit", author="J. R. R. Tolkien", isbn="9780261103344")
+        hobbit.genre.set([fantasy, classics])
+        hobbit.tags.add(Tag.objects.create(tag_title="dragons"))
+        Vote.objects.create(user=create_user("voter@example.com"), book=hobbit, rating=5)
+        Book.objects.create(title="Emma", author="Jane Austen")
+
+    def export(self, *args):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command("export_books", "--output", path, *args)
+        with open(path, newline="", encoding="utf-8") as fh:
+            return fh.read()
+
+    def test_csv_rows_newest_first(self):
+        rows = list(csv.DictReader(StringIO(self.export("--chunk-size", "1"))))
+        self.assertEqual([row["title"] for row in rows], ["Emma", "The Hobbit"])
+        hobbit = rows[1]
+        self.assertEqual(hobbit["isbn"], "9780261103344")
+        self.assertEqual(sorted(hobbit["genres"].split("|")), ["Classics", "Fantasy"])
+        self.assertEqual(hobbit["tags"], "dragons")
+        self.assertEqual((hobbit["vote_count"], hobbit["average_rating"]), ("1", "5.0"))
+        self.assertEqual(rows[0]["publisher"], "")
+
+    def test_jsonl_is_filtered_like_the_index(self):
+        output = self.export("--format", "jsonl", "--author", "j. r. r. tolkien")
+        rows = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["title"], "The Hobbit")
+        self.assertEqual((sorted(rows[0]["genres"]), rows[0]["tags"]), (["Classics", "Fantasy"], ["dragons"]))
+
+    def test_empty_catalogue(self):
+        Book.objects.all().delete()
+        self.assertEqual(self.export(), ",".join(catalogue_io.EXPORT_COLUMNS) + "\r\n")
+        self.assertEqual(self.export("--format", "jsonl"), "")
+
+    def test_view_streams_the_export_to_staff(self):
+        self.client.force_login(create_user("admin@example.com", is_admin=True))
+        response = self.client.get(reverse("export_books"), {"format": "jsonl"})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="books.jsonl"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["title"] for line in lines], ["Emma", "The Hobbit"])
+
+        Book.objects.all().delete()
+        response = self.client.get(reverse("export_books"))
+        self.assertEqual(b"".join(response.streaming_content).decode(), ",".join(catalogue_io.EXPORT_COLUMNS) + "\r\n")
+
+    def test_view_is_staff_only(self):
+        self.client.force_login(create_user())
+        response = self.client.get(reverse("export_books"))
+        self.assertRedirects(response, reverse("book_index"), fetch_redirect_response=False)
+
+
+class ApiTests(CatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.books = create_books(5)
+        self.book = self.books[0]
+        for i in range(3):
+            Comment.objects.create(book=self.book, content=f"Comment {i}")
+
+    def test_book_list_follows_cursor(self):
+        response = self.client.get(reverse("api_book_list"), {"limit": 3, "fields": "title"})
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+        self.assertEqual(len(first["results"]), 3)
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(len(second["results"]), 2)
+        self.assertIsNone(second["next"])
+        ids = [row["id"] for row in first["results"] + second["results"]]
+        self.assertEqual(ids, sorted((book.pk for book in self.books), reverse=True))
+
+    def test_cursor_of_another_endpoint_is_rejected(self):
+        comments = self.client.get(reverse("api_book_comments", args=[self.book.pk]), {"limit": 1}).json()
+        books = self.client.get(reverse("api_book_list"), {"limit": 1}).json()
+        comment_cursor = parse_qs(urlsplit(comments["next"]).query)["cursor"][0]
+        book_cursor = parse_qs(urlsplit(books["next"]).query)["cursor"][0]
+
+        response = self.client.get(reverse("api_book_list"), {"cursor": comment_cursor})
+        self.assertEqual((response.status_code, response.json()), (400, {"error": "Invalid cursor."}))
+        response = self.client.get(reverse("api_book_comments", args=[self.book.pk]), {"cursor": book_cursor})
+        self.assertEqual((response.status_code, response.json()), (400, {"error": "Invalid cursor."}))
+
+    def test_malformed_parameters_are_rejected(self):
+        for params in ({"limit": "ten"}, {"genre": "fantasy"}, {"rating": "high"}, {"cursor": "garbage"}):
+            with self.subTest(params=params):
+                response = self.client.get(reverse("api_book_list"), params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+        response = self.client.get(reverse("api_book_comments", args=[self.book.pk]), {"limit": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_vote_bulk_rejects_booleans(self):
+        self.client.force_login(create_user())
+        for vote in ({"book": True, "rating": 5}, {"book": self.book.pk, "rating": True}):
+            with self.subTest(vote=vote):
+                response = self.client.post(
+                    reverse("api_vote_bulk"), json.dumps({"votes": [vote]}), content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+        response = self.client.post(
+            reverse("api_vote_bulk"), json.dumps({"votes": [{"book": self.book.pk, "rating": 5}]}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.json(), {"created": 1, "changed": 0})
+
+
+class CommentCursorTests(CatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.book, = create_books(1)
+        user = create_user()
+        comments = [Comment.objects.create(book=self.book, user=user, content=f"Comment {i}") for i in range(45)]
+        # The newest 25 posted in the same instant straddle the 20-per-page boundary, the id orders them
+        now = timezone.now()
+        Comment.objects.filter(pk__in=[c.pk for c in comments[20:]]).update(created_at=now)
+        for age, comment in enumerate(reversed(comments[:20]), start=1):
+            Comment.objects.filter(pk=comment.pk).update(created_at=now - timedelta(minutes=age))
+        self.expected = [c.pk for c in reversed(comments)]
+
+    def comment_pages(self):
+        """Comment ids of every page of the "Load older comments" view"""
+        pages, cursor = [], None
+        while True:
+            params = {"cursor": cursor} if cursor else {}
+            response = self.client.get(reverse("book_comments", args=[self.book.pk]), params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([comment.pk for comment in response.context["comments"]])
+            cursor = response.context["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_pages_follow_the_cursor_through_tied_timestamps(self):
+        pages = self.comment_pages()
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_api_pages_follow_the_cursor_through_tied_timestamps(self):
+        ids, url, params = [], reverse("api_book_comments", args=[self.book.pk]), {"limit": 7}
+        while url:
+            payload = self.client.get(url, params).json()
+            ids += [row["id"] for row in payload["results"]]
+            url, params = payload["next"], {}
+        self.assertEqual(ids, self.expected)
+
+    def test_bad_cursor_falls_back_to_the_first_page(self):
+        first = self.client.get(reverse("book_comments", args=[self.book.pk]))
+        tampered = first.context["next_cursor"][:-1] + ("A" if first.context["next_cursor"][-1] != "A" else "B")
+        forged = signing.dumps(["2000-01-01T00:00:00+00:00", 1], salt="another-salt")
+        for cursor in (tampered, forged, "garbage"):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse("book_comments", args=[self.book.pk]), {"cursor": cursor})
+                self.assertEqual([c.pk for c in response.context["comments"]], self.expected[:20])
+
+    def test_api_rejects_a_bad_cursor(self):
+        url = reverse("api_book_comments", args=[self.book.pk])
+        token = parse_qs(urlsplit(self.client.get(url, {"limit": 5}).json()["next"]).query)["cursor"][0]
+        tampered = token[:-1] + ("A" if token[-1] != "A" else "B")
+        unparsable = signing.dumps({"created_at": "yesterday", "pk": 1}, salt=API_COMMENT_CURSOR_SALT)
+        for cursor in (tampered, unparsable, "garbage"):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual((response.status_code, response.json()), (400, {"error": "Invalid cursor."}))
+
+
+class QueryBudgetTests(QueryStatsAssertions, ThreadedCatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        genres = [Genre.objects.create(genre_name=name) for name in ("Fantasy", "History")]
+        self.voters = [create_user(f"voter{i}@example.com") for i in range(3)]
+        self.books = create_books(25, genres=genres, voters=self.voters)
+        for book in self.books[:3]:
+            Comment.objects.create(book=book, user=self.voters[0], content="Worth it")
+
+    def assertWithinBudget(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+        self.assertNoRepeatedQueries(response)
+
+    def test_index(self):
+        for params in ({}, {"page": 2}, {"paging": "cursor"}, {"genre": self.books[0].genre.first().pk},
+                       {"author": "Ann Author"}, {"q": "Book"}):
+            with self.subTest(params=params):
+                self.assertWithinBudget(self.client.get(reverse("book_index"), params))
+
+    def test_index_counts_the_facet_thread(self):
+        # Cold caches: the facets are built in index_snapshot()'s own thread and connection
+        response = self.client.get(reverse("book_index"))
+        self.assertEqual(response.query_stats.count, 6)
+        self.assertWithinBudget(response)
+
+    def test_detail(self):
+        book = self.books[0]
+        self.assertWithinBudget(self.client.get(reverse("book_detail", args=[book.pk])))
+        self.client.force_login(self.voters[0])
+        self.assertWithinBudget(self.client.get(reverse("book_detail", args=[book.pk])))
+
+    def test_api(self):
+        book = self.books[0]
+        requests = [
+            (reverse("api_book_list"), {"fields": "title,genres,tags", "limit": 100}),
+            (reverse("api_book_detail", args=[book.pk]), {}),
+            (reverse("api_book_votes", args=[book.pk]), {}),
+            (reverse("api_book_comments", args=[book.pk]), {}),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url):
+                self.assertWithinBudget(self.client.get(url, params))
+
+    async def test_async_handler(self):
+        response = await self.async_client.get(reverse("book_index"))
+        self.assertWithinBudget(response)
+        self.assertEqual(response.query_stats.count, 6)
+
+    def test_middleware_follows_the_handler_mode(self):
+        async def async_view(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(QueryCountMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(QueryCountMiddleware(lambda request: HttpResponse())))
+
+    @override_settings(ROOT_URLCONF="projectcv.tests", QUERY_BUDGET_STRICT=True)
+    def test_over_budget_raises_when_strict(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "ran 2 queries, the budget of"):
+            self.client.get("/over-budget/")
+
+    @override_settings(ROOT_URLCONF="projectcv.tests", QUERY_BUDGET_STRICT=True)
+    async def test_over_budget_raises_when_strict_async(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, "ran 2 queries, the budget of"):
+            await self.async_client.get("/over-budget-async/")
+
+    @override_settings(ROOT_URLCONF="projectcv.tests", QUERY_BUDGET_STRICT=False)
+    def test_over_budget_logs_a_warning(self):
+        with self.assertLogs("projectcv.queries", "WARNING") as logs:
+            response = self.client.get("/over-budget/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"queries": 2', logs.output[0])
+
+
+class AdminTests(CatalogueTestCase):
+    """The changelists and change forms run as many queries for 3 books as for 33"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(create_user("admin@example.com", is_admin=True))
+        self.genres = [Genre.objects.create(genre_name=name) for name in ("Fantasy", "History")]
+        self.add_books(3)
+
+    def add_books(self, count):
+        voters = [create_user(f"voter{Vote.objects.count()}-{i}@example.com") for i in range(2)]
+        create_books(count, genres=self.genres, voters=voters)
+
+    def assertPageQueries(self, expected, url, params=None):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+
+    def test_changelists(self):
+        pages = [
+            (6, reverse("admin:projectcv_book_changelist"), {}),
+            (6, reverse("admin:projectcv_book_changelist"), {"q": "Book"}),
+            (4, reverse("admin:projectcv_vote_changelist"), {}),
+            (4, reverse("admin:projectcv_vote_changelist"), {"q": "Book"}),
+            (5, reverse("admin:projectcv_job_changelist"), {}),
+        ]
+        for books in (3, 33):
+            for expected, url, params in pages:
+                with self.subTest(books=books, url=url, params=params):
+                    self.assertPageQueries(expected, url, params)
+            self.add_books(30)
+
+    def test_change_forms(self):
+        book, vote = Book.objects.first(), Vote.objects.first()
+        forms = [
+            (12, reverse("admin:projectcv_book_change", args=[book.pk])),
+            (11, reverse("admin:projectcv_vote_change", args=[vote.pk])),
+        ]
+        # The first visit of each form fills the content type cache
+        for _expected, url in forms:
+            self.client.get(url)
+        for books in (3, 33):
+            for expected, url in forms:
+                with self.subTest(books=books, url=url):
+                    self.assertPageQueries(expected, url)
+            self.add_books(30)
+
+
+class QueryPlanTests(CatalogueTestCase):
+
+    def test_hot_queries_use_indexes(self):
+        for name, plan, problems in query_plans.check_plans():
+            with self.subTest(name):
+                self.assertEqual(problems, [], "\n".join(plan))
+
+    def test_full_scan_is_reported(self):
+        hot_query = query_plans.HotQuery(lambda: Book.objects.filter(title="Dune"))
+        plan = query_plans.explain(hot_query.build())
+        self.assertEqual(query_plans.problems(plan, hot_query), ["full scan of projectcv_book"])
+
+    def test_author_filter_ignores_case_as_the_facet_does(self):
+        create_books(2, author="Ann Author")
+        create_books(1, author="ann author")
+        create_books(1, author="Bob Writer")
+        for spelling in ("Ann Author", "ann author", "ANN AUTHOR"):
+            with self.subTest(spelling):
+                self.assertEqual(filter_books(Book.objects.all(), {"author": spelling}).count(), 3)
+        self.assertEqual(facets.build_facets()["authors"], [
+            {"author": "Ann Author", "book_count": 3}, {"author": "Bob Writer", "book_count": 1},
+        ])
+
+
+@mock.patch("projectcv.backends.retry.time.sleep")
+class RetryOnBusyTests(SimpleTestCase):
+
+    def flaky(self, *errors):
+        """Callable raising the given errors in turn, then returning "written"; counts its calls"""
+        calls = []
+
+        def write():
+            calls.append(None)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return "written"
+        return write, calls
+
+    def test_busy_write_is_retried(self, sleep):
+        write, calls = self.flaky(OperationalError("database is locked"), OperationalError("database is locked"))
+        self.assertEqual(retry_on_busy(write, attempts=3)(), "written")
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_gives_up_after_the_attempts(self, sleep):
+        write, calls = self.flaky(*[OperationalError("database is locked")] * 3)
+        with self.assertRaisesMessage(OperationalError, "database is locked"):
+            retry_on_busy(write, attempts=3)()
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_other_errors_are_not_retried(self, sleep):
+        write, calls = self.flaky(OperationalError("no such table: projectcv_book"))
+        with self.assertRaises(OperationalError):
+            retry_on_busy(write)()
+        self.assertEqual(len(calls), 1)
+        sleep.assert_not_called()
+
+
+class SqliteBackendTests(TransactionTestCase):
+
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            for name, value in [("busy_timeout", 5000), ("cache_size", -64000), ("synchronous", 1)]:
+                cursor.execute(f"PRAGMA {name}")
+                self.assertEqual(cursor.fetchone()[0], value, name)
+
+    def test_atomic_begins_immediate(self):
+        self.assertEqual(connection.transaction_mode, "IMMEDIATE")
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Genre.objects.create(genre_name="Poetry")
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    def test_busy_error_in_an_atomic_block_is_not_retried(self):
+        calls = []
+
+        def write():
+            calls.append(None)
+            raise OperationalError("database is locked")
+        with self.assertRaises(OperationalError), transaction.atomic():
+            retry_on_busy(write)()
+        self.assertEqual(len(calls), 1)
+
+    def test_unknown_transaction_mode_is_rejected(self):
+        wrapper = DatabaseWrapper({**connection.settings_dict, "OPTIONS": {"transaction_mode": "eventually"}})
+        with self.assertRaisesMessage(ValueError, "transaction_mode must be one of"):
+            wrapper.get_connection_params()
+
+
+@override_settings(ROOT_URLCONF="projectcv.tests", DATABASE_REPLICAS=["replica"])
+class ReplicaPinningTests(CatalogueTestCase):
+
+    async def test_reads_go_to_the_replica(self):
+        response = await self.async_client.get("/routed/")
+        self.assertEqual(response.json(), {"before": "replica", "after": "replica"})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    async def test_write_in_a_thread_pins_the_request(self):
+        response = await self.async_client.get("/routed/", {"write": 1})
+        self.assertEqual(response.json(), {"before": "replica", "after": "default"})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    async def test_pin_cookie_and_unsafe_methods_read_the_primary(self):
+        self.async_client.cookies[PIN_COOKIE] = "1"
+        self.assertEqual((await self.async_client.get("/routed/")).json()["before"], "default")
+        del self.async_client.cookies[PIN_COOKIE]
+        self.assertEqual((await self.async_client.post("/routed/")).json()["before"], "default")
+
+    def test_vote_pins_the_client(self):
+        book, = create_books(1)
+        self.client.force_login(create_user())
+        requests = [
+            (reverse("book_detail", args=[book.pk]), {"vote_rating": "4"}, {}),
+            (reverse("api_vote_bulk"), '{"votes": [{"book": %d, "rating": 5}]}' % book.pk,
+             {"content_type": "application/json"}),
+        ]
+        for url, data, extra in requests:
+            with self.subTest(url=url):
+                response = self.client.post(url, data, **extra)
+                self.assertIn(response.status_code, (200, 302))
+                self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(Vote.objects.get(book=book).rating, 5)
+
+    def test_sync_handler(self):
+        response = self.client.get("/routed/", {"write": 1})
+        self.assertEqual(response.json(), {"before": "replica", "after": "default"})
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_middleware_follows_the_handler_mode(self):
+        async def async_view(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(ReplicaPinningMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(ReplicaPinningMiddleware(lambda request: HttpResponse())))
+
+    @override_settings(DEBUG=True, ROOT_URLCONF="mycv.urls", DATABASE_REPLICAS=[])
+    async def test_async_handler_adapts_no_middleware(self):
+        # Django logs each sync-only middleware it has to wrap for the async handler, when DEBUG is on
+        with self.assertNoLogs("django.request", "DEBUG"):
+            response = await self.async_client.get(reverse("book_index"))
+        self.assertEqual(response.status_code, 200)
+
+
+class RecommendationTests(CatalogueTestCase):
+
+    def book(self, title, tags=(), author="Ann Author", votes=()):
+        book = Book.objects.create(title=title, author=author)
+        book.tags.set(tags)
+        for user, rating in votes:
+            Vote.objects.create(user=user, book=book, rating=rating)
+        return book
+
+    def neighbours(self, book):
+        return list(SimilarBook.objects.filter(book=book).order_by("rank").values_list("similar__title", flat=True))
+
+    def test_neighbours_are_ranked_by_similarity(self):
+        dragons, wizards, ships = [Tag.objects.create(tag_title=title) for title in ("dragons", "wizards", "ships")]
+        voters = [create_user(f"voter{i}@example.com") for i in range(3)]
+        self.book("Seed", [dragons, wizards], votes=[(user, 5) for user in voters])
+        self.book("Same tags, liked", [dragons, wizards], author="Other", votes=[(user, 5) for user in voters])
+        self.book("Same tags, disliked", [dragons, wizards], author="Other", votes=[(user, 1) for user in voters])
+        self.book("One tag", [dragons], author="Other")
+        self.book("Same author", author="Ann Author")
+        self.book("Unrelated", [ships], author="Nobody")
+
+        self.assertEqual(recommendations.rebuild(workers=1), 6)
+        # The opposite votes outweigh the shared tags, the disliked one is no neighbour at all
+        self.assertEqual(
+            self.neighbours(Book.objects.get(title="Seed")), ["Same tags, liked", "One tag", "Same author"],
+        )
+        self.assertEqual(self.neighbours(Book.objects.get(title="Unrelated")), [])
+
+    def test_refresh_recomputes_changed_books_only(self):
+        dragons = Tag.objects.create(tag_title="dragons")
+        first, second = self.book("First", [dragons]), self.book("Second", [dragons])
+        lonely = self.book("Lonely", author="Nobody")
+        recommendations.rebuild(workers=1)
+        # A book without neighbours is looked at again on every refresh
+        self.assertEqual(recommendations.stale_book_ids(), [lonely.pk])
+
+        third = self.book("Third", [dragons])
+        self.assertEqual(sorted(recommendations.stale_book_ids()), [lonely.pk, third.pk])
+        self.assertEqual(recommendations.refresh(workers=1), 2)
+        self.assertEqual(self.neighbours(third), ["First", "Second"])
+        # first kept its list until the next rebuild()
+        self.assertEqual(self.neighbours(first), ["Second"])
+
+
+class LeaderboardTests(CatalogueTestCase):
+
+    def entries(self):
+        return {
+            (entry.book_id, entry.genre_id): (round(entry.top_rated, 9), entry.recent_votes, entry.comment_count)
+            for entry in LeaderboardEntry.objects.all()
+        }
+
+    def test_top_rated_is_the_bayesian_average(self):
+        voters = [create_user(f"voter{i}@example.com") for i in range(30)]
+        few, many, middling = [Book.objects.create(title=title) for title in ("Two fives", "Many votes", "Middling")]
+        for i, user in enumerate(voters):
+            if i < 2:
+                Vote.objects.create(user=user, book=few, rating=5)
+            Vote.objects.create(user=user, book=many, rating=4 + i % 2)
+            Vote.objects.create(user=user, book=middling, rating=3)
+
+        leaderboards.rebuild()
+        mean = (2 * 5 + 15 * 4 + 15 * 5 + 30 * 3) / 62
+        self.assertAlmostEqual(leaderboards.mean_rating(), mean)
+        self.assertAlmostEqual(
+            LeaderboardEntry.objects.get(book=few, genre=None).top_rated,
+            (leaderboards.PRIOR_VOTES * mean + 10) / (leaderboards.PRIOR_VOTES + 2),
+        )
+        # Two 5-star votes do not outrank thirty 4.5s
+        self.assertEqual(
+            [entry.book.title for entry in leaderboards.page("top_rated")], ["Many votes", "Two fives", "Middling"],
+        )
+
+    def test_incremental_updates_match_a_rebuild(self):
+        fantasy, history = [Genre.objects.create(genre_name=name) for name in ("Fantasy", "History")]
+        voters = [create_user(f"voter{i}@example.com") for i in range(4)]
+        first, = create_books(1, genres=[fantasy], voters=voters)
+        second, = create_books(1, genres=[fantasy, history], voters=voters)
+        third, = create_books(1, voters=voters)
+        leaderboards.rebuild()
+
+        # Every change below leaves the mean vote at 4, the C a rebuild takes afresh
+        newcomer = create_user("newcomer@example.com")
+        votes.record_votes(newcomer, {first.pk: 3, second.pk: 5})
+        votes.record_votes(voters[0], {first.pk: 5})
+        votes.record_votes(voters[1], {second.pk: 3})
+        Vote.objects.get(user=voters[2], book=third).delete()
+        comments = [Comment.objects.create(book=first, user=voters[0], content="Again") for _ in range(2)]
+        comments[0].delete()
+        Comment.objects.create(book=third, user=voters[1], content="Fine")
+        second.genre.remove(history)
+        third.genre.add(history)
+
+        incremental = self.entries()
+        self.assertEqual(incremental[first.pk, None][1:], (5, 1))
+        leaderboards.rebuild()
+        self.assertEqual(self.entries(), incremental)
+
+
+class WriteBehindVoteTests(CatalogueTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann, cls.bob = create_user("ann@example.com"), create_user("bob@example.com")
+        cls.first, cls.second = create_books(2)
+        Vote.objects.create(user=cls.ann, book=cls.first, rating=2)
+
+    def test_flush_keeps_the_newest_vote_per_pair(self):
+        for user, book, rating in [
+            (self.ann, self.first, 5), (self.ann, self.first, 3), (self.bob, self.first, 4),
+            (self.ann, self.second, 1), (self.bob, self.second, 2), (self.bob, self.second, 5),
+        ]:
+            vote_buffer.enqueue(user, book, rating)
+
+        # Two batches: bob's votes on the second book are split across them
+        self.assertEqual(vote_buffer.flush_all(batch_size=4), (6, 3, 1))
+        self.assertEqual(vote_buffer.depth(), 0)
+        self.assertEqual(
+            set(Vote.objects.values_list("user__email", "book_id", "rating")),
+            {("ann@example.com", self.first.pk, 3), ("bob@example.com", self.first.pk, 4),
+             ("ann@example.com", self.second.pk, 1), ("bob@example.com", self.second.pk, 5)},
+        )
+        for book, count, total in [(self.first, 2, 7), (self.second, 2, 6)]:
+            book.refresh_from_db()
+            self.assertEqual((book.vote_count, book.vote_sum), (count, total))
+            self.assertEqual(LeaderboardEntry.objects.get(book=book, genre=None).recent_votes, count)
+
+    @override_settings(VOTE_WRITE_BEHIND=True)
+    async def test_user_sees_their_pending_vote(self):
+        await sync_to_async(vote_buffer.enqueue)(self.ann, self.first, 4)
+        await sync_to_async(vote_buffer.enqueue)(self.ann, self.first, 5)
+        self.assertEqual((await vote_buffer.auser_vote(self.ann, self.first)).rating, 5)
+        self.assertIsNone(await vote_buffer.auser_vote(self.ann, self.second))
+        self.assertTrue(await PendingVote.objects.aexists())
+
+
+@override_settings(CACHES=TEST_CACHES, PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ConcurrentVoteTests(TransactionTestCase):
+    threads = 8
+
+    def test_concurrent_votes_on_the_same_pairs(self):
+        users = [create_user(f"voter{i}@example.com") for i in range(3)]
+        books = create_books(3)
+        start = threading.Barrier(self.threads)
+
+        def vote(i):
+            # Every thread votes on every book, each user from several threads at once
+            try:
+                ratings = {book.pk: 1 + (i + j) % 5 for j, book in enumerate(books)}
+                start.wait()
+                return votes.record_votes(users[i % len(users)], ratings)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            results = list(pool.map(vote, range(self.threads)))  # re-raises an IntegrityError of any thread
+
+        self.assertEqual(sum(created for created, _ in results), len(users) * len(books))
+        self.assertEqual(Vote.objects.count(), len(users) * len(books))
+        for book in Book.objects.all():
+            with self.subTest(book=book.pk):
+                stored = Vote.objects.filter(book=book).aggregate(count=Count("id"), total=Sum("rating"))
+                self.assertEqual((book.vote_count, book.vote_sum), (stored["count"], stored["total"]))
+
+
+class JobTests(CatalogueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        job_calls.clear()
+
+    def enqueue(self, name, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue(name, *args, **kwargs)
+
+    def test_identical_pending_jobs_are_queued_once(self):
+        self.enqueue("tests.record", 1)
+        self.enqueue("tests.record", 1)
+        self.enqueue("tests.record", 2)
+        self.assertEqual(sorted(Job.objects.values_list("args", flat=True)), [[1], [2]])
+        # Once it runs, the same job can be queued again
+        jobs.claim("worker")
+        self.enqueue("tests.record", 1)
+        self.assertEqual(Job.objects.filter(args=[1]).count(), 2)
+
+    def test_claim_takes_due_jobs_in_order(self):
+        self.enqueue("tests.record", "later", delay=60)
+        self.enqueue("tests.record", "first")
+        self.enqueue("tests.record", "second")
+        self.assertEqual(jobs.claim("worker").args, ["first"])
+        self.assertEqual(jobs.claim("worker").args, ["second"])
+        self.assertIsNone(jobs.claim("worker"))
+        self.assertEqual(
+            list(Job.objects.values_list("status", "worker", "attempts").order_by("id")),
+            [(Job.PENDING, "", 0), (Job.RUNNING, "worker", 1), (Job.RUNNING, "worker", 1)],
+        )
+
+    def test_run_passes_the_database(self):
+        self.enqueue("tests.record", "value")
+        self.assertTrue(jobs.run_next("worker"))
+        self.assertEqual(job_calls, [("value", "default")])
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_failed_job_is_retried_after_a_backoff(self):
+        self.enqueue("tests.fail")
+        with self.assertLogs("projectcv.jobs", "WARNING"):
+            self.assertFalse(jobs.run_next("worker"))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn("RuntimeError: Nothing works", job.last_error)
+        wait = (job.run_at - job.started_at).total_seconds()
+        self.assertTrue(jobs.BACKOFF_SECONDS * 0.5 <= wait <= jobs.BACKOFF_SECONDS * 1.5, wait)
+        self.assertIsNone(jobs.claim("worker"))
+
+        # The second failure is the last of max_attempts
+        Job.objects.update(run_at=job.started_at)
+        with self.assertLogs("projectcv.jobs", "WARNING") as logs:
+            self.assertFalse(jobs.run_next("worker"))
+        self.assertIn("failed for good after 2 attempts", logs.output[-1])
+        self.assertEqual(Job.objects.get().status, Job.FAILED)
+
+    def test_recovered_job_is_not_finished_by_its_old_worker(self):
+        self.enqueue("tests.record", "slow")
+        stale = jobs.claim("gone")
+        with override_settings(JOBS_TIMEOUT=-1):
+            self.assertEqual(jobs.recover(), 1)
+        Job.objects.update(run_at=stale.started_at)
+        current = jobs.claim("alive")
+        self.assertEqual(current.attempts, 2)
+
+        # The first worker comes back: its outcome no longer touches the row
+        self.assertTrue(jobs.run(stale))
+        current.refresh_from_db()
+        self.assertEqual((current.status, current.worker), (Job.RUNNING, "alive"))
+        self.assertTrue(jobs.run(current))
+        self.assertEqual(Job.objects.get().status, Job.DONE)
@@ -1,5 +1,8 @@
 
 from django.shortcuts import redirect
 
-def index_handler(request):
+from .instrumentation import query_budget
+
+@query_budget(0)
+async def index_handler(request):
     return redirect("book_index")
\ No newline at end of file
@@ -1,5 +1,6 @@
 
 from django.urls import path
+from . import api
 from . import views
 from . import url_handlers
 
@@ -7,10 +8,21 @@ from . import url_handlers
 urlpatterns = [
     path("book_index/", views.BookIndex.as_view(), name="book_index"),
     path("<int:pk>/book_detail/", views.CurrentBook.as_view(), name="book_detail"),
+    path("<int:pk>/comments/", views.BookComments.as_view(), name="book_comments"),
+    path("leaderboards/", views.Leaderboards.as_view(), name="leaderboards"),
+    path("leaderboards/<str:board>/", views.Leaderboards.as_view(), name="leaderboard"),
+    path("export/", views.ExportBooks.as_view(), name="export_books"),
     path("add_book/", views.AddBook.as_view(), name="add_book"),
     path("<int:pk>/edit/", views.EditBook.as_view(), name="edit_book"),
     path("register/", views.UserViewRegister.as_view(), name="registration"),
     path("login/", views.UserViewLogin.as_view(), name="login"),
     path("logout/", views.logout_user, name="logout"),
+    path("cache_stats/", views.cache_stats, name="cache_stats"),
+    path("job_stats/", views.job_stats, name="job_stats"),
+    path("api/v1/books/", api.book_list, name="api_book_list"),
+    path("api/v1/books/<int:pk>/", api.book_detail, name="api_book_detail"),
+    path("api/v1/books/<int:pk>/votes/", api.book_votes, name="api_book_votes"),
+    path("api/v1/books/<int:pk>/comments/", api.book_comments, name="api_book_comments"),
+    path("api/v1/votes/", api.vote_bulk, name="api_vote_bulk"),
     path("", url_handlers.index_handler),
 ]
\ No newline at end of file
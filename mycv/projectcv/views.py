@@ -1,60 +1,161 @@
-from django.http import Http404
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import InvalidPage
+from django.db import connections
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.context_processors import request
 from django.urls import reverse, reverse_lazy
+from django.utils.http import urlencode
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views import generic
 from django.contrib.auth import login, logout, authenticate
 from django.contrib import messages
-from django.db.models import Q
 from django.views.generic import FormView
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 
-from .models import Book, User, Genre, Vote, Comment
+from .models import Book, User, Genre, Vote, Comment, SimilarBook
 from .forms import BookForm, UserForm, LoginForm, VoteForm
+from .backends.retry import retry_on_busy
+from . import catalogue_io, jobs, leaderboards, vote_buffer, votes
+from .cache import fragment_cache_stats
+from .instrumentation import query_budget
+from .conditional import (
+    book_etag, book_last_modified, catalogue_changed, index_etag, index_last_modified, revalidated,
+)
+from .facets import get_facets, get_version as get_facets_version
+from .pagination import EstimatedCountPaginator, apaginate_by_cursor, decode_cursor, paginate_comments
+from .filters import INDEX_FILTERS, filter_books
 
 
-RATING_CHOICES = [(i, i) for i in range(1, 6)]
-RATING_VALUES = [choice[0] for choice in RATING_CHOICES]
+COMMENTS_PER_PAGE = 20
+# What the "Similar books" list renders of each neighbour
+SIMILAR_BOOK_FIELDS = ("rank", "similar__title", "similar__author", "similar__average_rating", "similar__rating")
+
+# Revalidate on every request (the pages contain per-user parts), answer 304 when nothing changed
+revalidate = [cache_control(private=True, no_cache=True), vary_on_cookie]
+
+
+async def aget_user(request):
+    """request.user loaded off the event loop - it reads the session (Django 5 has request.auser())"""
+    def load():
+        request.user.is_authenticated
+        return request.user
+    return await sync_to_async(load)()
+
+
+def index_snapshot():
+    """Facets and the versions keying the cached fragments of the book index.
+
+    Run in a worker thread of its own while the page of books is queried, so
+    the thread's database connection is closed before it goes back to the pool.
+    """
+    try:
+        return get_facets(), get_facets_version(), catalogue_changed().isoformat()
+    finally:
+        connections.close_all()
+
 
 # Create your views here.
+@query_budget(6)
 class BookIndex(generic.ListView):
     template_name = "projectcv/book_index.html"  # cesta k šabloně ze složky tamplates (je možné sdílet mezi aplikacemi)
     context_object_name = "books"  # pod tímto jménem budeme volat seznam objektů v šabloně
     paginate_by = 20 # this line enable to pagination with 20 items per page
+    paginator_class = EstimatedCountPaginator  # numbered links without a full COUNT(*)
+
+    def get_filters(self):
+        """Filters of this request - taken from the cursor token when paging by cursor"""
+        if not hasattr(self, "_filters"):
+            cursor = decode_cursor(self.request.GET.get("cursor"))
+            source = cursor[2] if cursor else self.request.GET
+            self._filters = {name: source.get(name, "") for name in INDEX_FILTERS}
+        return self._filters
 
+    def use_cursor(self):
+        # Opt-in with ?paging=cursor; search results are ordered by rank, so they keep numbered pages
+        wants_cursor = self.request.GET.get("paging") == "cursor" or "cursor" in self.request.GET
+        return wants_cursor and not self.get_filters()["q"]
 
     def get_queryset(self):
-        # Get filtered parameters from request
-        qs = Book.objects.prefetch_related("genre").order_by("-id")
-        q = self.request.GET.get("q")
-        author = self.request.GET.get("author")
-        genre = self.request.GET.get("genre")
-        rating = self.request.GET.get("rating")
-
-        # Apply filters if parameters exist
-        if q:
-            qs = qs.filter(Q(title__icontains=q) | Q(author__icontains=q))
-        if author:
-            qs = qs.filter(author=author)
-        if genre:
-            qs = qs.filter(genre__id=genre)
-        if rating:
-            qs = qs.filter(rating=rating)
-        return qs
+        qs = Book.objects.with_listing_stats().order_by("-id")
+        return filter_books(qs, self.get_filters())
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """ListView.paginate_queryset() with the count and the page rows queried asynchronously"""
+        if self.use_cursor():
+            page = await apaginate_by_cursor(queryset, self.request.GET.get("cursor"), page_size, self.get_filters())
+            return None, page, page.object_list, page.has_other_pages()
+
+        paginator = self.get_paginator(
+            queryset, page_size, orphans=self.get_paginate_orphans(), allow_empty_first_page=self.get_allow_empty(),
+        )
+        await paginator.acount()
+        page_number = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+        try:
+            page = paginator.page(paginator.num_pages if page_number == "last" else page_number)
+        except InvalidPage as e:
+            raise Http404(f"Invalid page ({page_number}): {e}")
+        # The rows stay a lazy queryset, get() reads them only when the cached rows fragment misses
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def paginate_queryset(self, queryset, page_size):
+        # Fetched ahead by apaginate_queryset() in get()
+        return self.paginated
+
+    async def arows_cached(self, catalogue_version):
+        """Whether book_index.html will find the rows of this page in the fragment cache"""
+        key = make_template_fragment_key("book_index_rows", [catalogue_version, self.request.get_full_path()])
+        return await caches["fragments"].ahas_key(key)
+
+    @revalidated(index_etag, index_last_modified)
+    async def get(self, request, *args, **kwargs):
+        self.object_list = self.get_queryset()
+        # Independent of each other: facets from the cache (or the DB on a miss) and the page's count
+        self.snapshot, self.paginated = await asyncio.gather(
+            sync_to_async(index_snapshot, thread_sensitive=False)(),
+            self.apaginate_queryset(self.object_list, self.get_paginate_by(self.object_list)),
+        )
+        paginator, page, _, is_paginated = self.paginated
+        if paginator is not None and not await self.arows_cached(self.snapshot[2]):
+            page.object_list = [book async for book in page.object_list]
+            if not page.object_list and page.number > 1:
+                # Past the end of the estimated count (deleted books): to the last page with books
+                await paginator.aclamp()
+                query = request.GET.copy()
+                query[self.page_kwarg] = paginator.num_pages
+                return redirect(f"{request.path}?{query.urlencode()}")
+            self.paginated = paginator, page, page.object_list, is_paginated
+        # Rendered by the handler in a thread, the template reads the session and messages
+        return self.render_to_response(self.get_context_data())
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["authors"] = Book.objects.order_by("author").values_list("author", flat=True).distinct()
-        ctx["genres"] = Genre.objects.order_by("genre_name")
-        ctx["ratings"] = RATING_VALUES
+        filters = self.get_filters()
+        facets, facets_version, catalogue_version = self.snapshot
+        ctx["authors"] = facets["authors"]
+        ctx["genres"] = facets["genres"]
+        ctx["ratings"] = facets["ratings"]
+        ctx["cursor_mode"] = self.use_cursor()
+        ctx["export_query"] = urlencode({name: value for name, value in filters.items() if value})
+        # Versions the fragment cache keys in book_index.html depend on
+        ctx["facets_version"] = facets_version
+        ctx["catalogue_version"] = catalogue_version
         ctx["current"] = {
-            "q": self.request.GET.get("q", ""),
-            "author": self.request.GET.get("author", ""),
-            "genre": self.request.GET.get("genre", ""),
-            "rating": self.request.GET.get("rating") or None,
+            "q": filters["q"],
+            "author": filters["author"],
+            "genre": filters["genre"],
+            "rating": filters["rating"] or None,
         }
         return ctx
 
+@query_budget(15)
 class CurrentBook(generic.DetailView):
 
     model = Book
@@ -62,41 +163,55 @@ class CurrentBook(generic.DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        book = self.get_object()
+        book = self.object
 
-        # Add voting context
-        if self.request.user.is_authenticated:
-            user_vote = book.get_user_vote(self.request.user)
-            context['user_vote'] = user_vote
-            context['vote_form'] = VoteForm(instance=user_vote)
-        else:
-            context['user_vote'] = None
-            context['vote_form'] = VoteForm()
+        # Add voting context (the user's vote is loaded by get())
+        user_vote = kwargs.get("user_vote")
+        context['user_vote'] = user_vote
+        context['vote_form'] = VoteForm(instance=user_vote)
 
         context['average_rating'] = book.get_average_rating()
         context['vote_count'] = book.get_vote_count()
+        # Callable, so the comments are only queried when the cached fragment has to be rendered
+        context['first_comment_page'] = lambda: paginate_comments(book.comments.all(), None, COMMENTS_PER_PAGE)
+        # Precomputed by build_recommendations, one query on similarbook_book_rank_uniq
+        context['similar_books'] = lambda: [
+            entry.similar for entry in
+            SimilarBook.objects.filter(book=book).select_related("similar").only(*SIMILAR_BOOK_FIELDS)
+        ]
 
         return context
 
-    def get(self, request, *args, **kwargs):
+    @revalidated(book_etag, book_last_modified)
+    async def get(self, request, *args, **kwargs):
         try:
-            self.object = self.get_object()
-        except (Book.DoesNotExist, Http404):
+            self.object = await self.get_queryset().aget(pk=self.kwargs["pk"])
+        except Book.DoesNotExist:
             return redirect("book_index")
-        return render(request, self.template_name, self.get_context_data())
+        user = await aget_user(request)
+        # In write-behind mode the user's newest vote may still be queued, they see it all the same
+        user_vote = await vote_buffer.auser_vote(user, self.object) if user.is_authenticated else None
+        # Rendered by the handler in a thread, the template reads the session and messages
+        return self.render_to_response(self.get_context_data(user_vote=user_vote))
 
-    def post(self, request, pk):
+    async def post(self, request, pk):
+        # A view's handlers are all sync or all async; the form handling stays sync
+        return await sync_to_async(self.handle_post)(request, pk)
+
+    def handle_post(self, request, pk):
         book = self.get_object()
 
         # Handle voting
         if 'vote_rating' in request.POST and request.user.is_authenticated:
             rating = request.POST.get('vote_rating')
             if rating and rating.isdigit() and 1 <= int(rating) <= 5:
-                vote, created =Vote.objects.update_or_create(
-                    user=request.user,
-                    book=book,
-                    defaults={'rating': int(rating)}
-                )
+                if vote_buffer.is_enabled():
+                    # One INSERT into the queue, flush_votes applies it with the aggregates
+                    vote_buffer.enqueue(request.user, book, int(rating))
+                    messages.success(request, "Your vote has been recorded!")
+                    return redirect("book_detail", pk=pk)
+                # One INSERT ... ON CONFLICT DO UPDATE, concurrent clicks cannot collide on unique (user, book)
+                created, _ = votes.record_votes(request.user, {book.pk: int(rating)})
 
                 action = "updated" if not created else "added"
                 messages.success(request, f"Your vote has been {action}!")
@@ -109,7 +224,7 @@ class CurrentBook(generic.DetailView):
         if 'comment' in request.POST and request.user.is_authenticated:
             comment_content = request.POST.get('comment', '').strip()
             if comment_content:
-                Comment.objects.create(
+                retry_on_busy(Comment.objects.create)(
                     book=book,
                     user=request.user,
                     content=comment_content
@@ -126,11 +241,80 @@ class CurrentBook(generic.DetailView):
         if "edit" in request.POST:
             return redirect("edit_book", pk=book.pk)
         if "delete" in request.POST:
-            book.delete()
+            retry_on_busy(book.delete)()
             return redirect("book_index")
         return redirect("book_detail", pk=pk)
 
 
+@query_budget(6)
+@method_decorator(revalidate + [condition(etag_func=book_etag, last_modified_func=book_last_modified)], name="get")
+class BookComments(generic.View):
+    """Older comments of a book, one page at a time, fetched by the "Load older comments" button"""
+    template_name = "projectcv/comment_list.html"
+
+    def get(self, request, pk):
+        book = get_object_or_404(Book.objects.only("id"), pk=pk)
+        comments, next_cursor = paginate_comments(book.comments.all(), request.GET.get("cursor"), COMMENTS_PER_PAGE)
+        return render(request, self.template_name, {"book": book, "comments": comments, "next_cursor": next_cursor})
+
+
+# No @query_budget: the rows are read as the response streams, after the middleware has counted
+# the request, and export_rows() runs a few queries per chunk of books
+class ExportBooks(UserPassesTestMixin, generic.View):
+    """Stream the catalogue as CSV or JSON Lines, filtered like the book index"""
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def handle_no_permission(self):
+        messages.info(self.request, "Only the admin can export books.")
+        return redirect("book_index")
+
+    def get(self, request):
+        fmt = request.GET.get("format", "csv")
+        if fmt not in catalogue_io.WRITERS:
+            fmt = "csv"
+        writer, content_type = catalogue_io.WRITERS[fmt]
+        qs = filter_books(Book.objects.order_by("-id"), request.GET)
+        response = StreamingHttpResponse(writer(catalogue_io.export_rows(qs)), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="books.{fmt}"'
+        return response
+
+
+@query_budget(6)
+class Leaderboards(generic.TemplateView):
+    """Top rated, trending and most discussed books, overall or within one genre (?genre=<id>)"""
+    template_name = "projectcv/leaderboard.html"
+
+    async def get(self, request, board="top_rated"):
+        if board not in leaderboards.BOARDS:
+            raise Http404(f"No leaderboard {board!r}")
+        genre = request.GET.get("genre", "")
+        genre_id = int(genre) if genre.isdigit() else None
+        # Independent of each other: the genre list from the cached facets and one range read of the board's index
+        snapshot, entries = await asyncio.gather(
+            sync_to_async(index_snapshot, thread_sensitive=False)(),
+            self.aentries(board, genre_id),
+        )
+        genres = snapshot[0]["genres"]
+        # Rendered by the handler in a thread, the template reads the session and messages
+        return self.render_to_response(self.get_context_data(
+            board=board,
+            boards=leaderboards.BOARDS,
+            entries=entries,
+            genres=genres,
+            current_genre=next((g for g in genres if g["id"] == genre_id), None),
+            trending_days=leaderboards.TRENDING_DAYS,
+        ))
+
+    async def aentries(self, board, genre_id):
+        field = leaderboards.BOARDS[board].field
+        return [
+            (entry.book, getattr(entry, field)) async for entry in leaderboards.page(board, genre_id)
+        ]
+
+
+@query_budget(25)
 class AddBook(UserPassesTestMixin, generic.edit.CreateView):
 
     form_class = BookForm
@@ -156,6 +340,7 @@ class AddBook(UserPassesTestMixin, generic.edit.CreateView):
             return redirect("book_detail", pk=book.pk)
         return render(request, self.template_name, {"form": form})
 
+@query_budget(35)
 class EditBook(LoginRequiredMixin, UserPassesTestMixin, generic.edit.UpdateView):
     model = Book
     form_class = BookForm
@@ -180,6 +365,7 @@ class EditBook(LoginRequiredMixin, UserPassesTestMixin, generic.edit.UpdateView)
         return reverse("book_detail", kwargs={"pk": self.object.pk})
 
 
+@query_budget(10)
 class UserViewRegister(generic.edit.CreateView):
     form_class = UserForm
     model = User
@@ -201,6 +387,7 @@ class UserViewRegister(generic.edit.CreateView):
         return super().form_valid(form)
 
 
+@query_budget(8)
 class UserViewLogin(FormView):
     form_class = LoginForm
     template_name = "projectcv/user_form.html"
@@ -223,9 +410,29 @@ class UserViewLogin(FormView):
                 form.add_error(None, "This account doesn't exist")
             return self.form_invalid(form)
 
-def logout_user(request):
-    if request.user.is_authenticated:
-        logout(request)
+@query_budget(5)
+async def logout_user(request):
+    user = await aget_user(request)
+    if user.is_authenticated:
+        await sync_to_async(logout)(request)
     else:
         messages.info(request, "You can't log out if you're not logged in.")
     return redirect("login")
+
+
+@query_budget(3)
+def cache_stats(request):
+    """Template fragment cache hit/miss counters of the worker process answering"""
+    if not request.user.is_staff:
+        messages.info(request, "Only the admin can see cache statistics.")
+        return redirect("book_index")
+    return JsonResponse(fragment_cache_stats())
+
+
+@query_budget(6)
+def job_stats(request):
+    """Background job queue depth and latency (see projectcv.jobs)"""
+    if not request.user.is_staff:
+        messages.info(request, "Only the admin can see job statistics.")
+        return redirect("book_index")
+    return JsonResponse(jobs.stats())
@@ -0,0 +1,91 @@
+"""Write-behind votes (settings.VOTE_WRITE_BEHIND).
+
+A star click normally records the vote with projectcv.votes: the upsert,
+the book's aggregates and its leaderboard rows, all while holding SQLite's
+single write lock. When a book is promoted those
+requests queue up behind each other. In write-behind mode the click only
+appends a PendingVote row, one short INSERT, and the flush_votes command
+applies the queue in batches:
+
+- the newest pending vote of each (user, book) wins, older ones are dropped;
+- the votes are upserted and each book's aggregates and leaderboard rows
+  updated once with the summed deltas (projectcv.votes.apply()), so they
+  stay consistent with the Vote table;
+- the applied PendingVote rows are deleted in the same transaction.
+
+The queue is a table of the same database, so an accepted vote survives a
+crash or a restart. Until it is flushed, the book page shows the user their
+own pending vote (auser_vote()); the aggregates follow at the next flush.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Max
+
+from . import conditional, votes
+from .backends.retry import retry_on_busy
+from .models import PendingVote, Vote
+
+
+# Pending votes applied per transaction, keeps the write lock short
+FLUSH_BATCH_SIZE = 1000
+
+
+def is_enabled():
+    return getattr(settings, "VOTE_WRITE_BEHIND", False)
+
+
+@retry_on_busy
+def enqueue(user, book, rating):
+    """Accept a vote for the next flush"""
+    return PendingVote.objects.create(user=user, book=book, rating=rating)
+
+
+async def auser_vote(user, book):
+    """The user's vote on the book as they last cast it: the newest pending one, else the stored Vote"""
+    vote = await Vote.objects.filter(book=book, user=user).afirst()
+    if is_enabled():
+        pending = await PendingVote.objects.filter(user=user, book=book).order_by("-id").only("rating").afirst()
+        if pending is not None:
+            vote = vote or Vote(user=user, book=book)
+            vote.rating = pending.rating
+    return vote
+
+
+def _coalesce(pending):
+    """{(user id, book id): rating} of the newest pending vote per pair"""
+    latest = {}
+    for user_id, book_id, rating in pending:  # oldest first, a later vote overwrites
+        latest[user_id, book_id] = rating
+    return latest
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Apply up to batch_size pending votes, returns (pending votes read, votes created, votes changed)"""
+    with transaction.atomic(using=using):
+        pending = list(
+            PendingVote.objects.using(using).select_for_update(skip_locked=True)
+            .order_by("id").values_list("id", "user_id", "book_id", "rating")[:batch_size]
+        )
+        if not pending:
+            return 0, 0, 0
+        created, changed = votes.apply(_coalesce(row[1:] for row in pending), using)
+        PendingVote.objects.using(using).filter(pk__in=[row[0] for row in pending]).delete()
+    if created or changed:
+        conditional.touch_catalogue()
+    return len(pending), created, changed
+
+
+def flush_all(batch_size=FLUSH_BATCH_SIZE, using=DEFAULT_DB_ALIAS):
+    """Flush until the queue is empty (as it was when called), returns the totals of flush()"""
+    totals = [0, 0, 0]
+    last_id = PendingVote.objects.using(using).aggregate(last=Max("id"))["last"]
+    while last_id is not None:
+        result = retry_on_busy(flush, using=using)(batch_size, using)
+        totals = [total + n for total, n in zip(totals, result)]
+        if not result[0] or not PendingVote.objects.using(using).filter(pk__lte=last_id).exists():
+            break
+    return tuple(totals)
+
+
+def depth(using=DEFAULT_DB_ALIAS):
+    return PendingVote.objects.using(using).count()
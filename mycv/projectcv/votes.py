@@ -0,0 +1,109 @@
+"""Recording votes with one upsert statement.
+
+Vote.objects.update_or_create() reads the vote and then inserts or updates
+it; two concurrent first votes of the same user on the same book both find
+nothing, and the second INSERT fails on unique (user, book). Here votes are
+written with INSERT ... ON CONFLICT (user_id, book_id) DO UPDATE SET rating
+(bulk_create(update_conflicts=True)), whatever their number, so there is
+nothing to race on.
+
+The book aggregates need the rating each vote replaces, so the current
+ratings of the pairs are read first, in the same transaction and after
+locking the books' rows (SELECT ... FOR UPDATE where the database has it;
+SQLite serializes the writing transactions itself, see the IMMEDIATE
+transaction_mode in settings). Upserts send no signals: the aggregates,
+leaderboard rows and catalogue timestamp the Vote receivers in
+projectcv.signals maintain are updated here, one UPDATE per distinct delta
+rather than per book.
+"""
+from collections import defaultdict
+
+from django.db import router, transaction
+
+from . import conditional, leaderboards
+from .backends.retry import retry_on_busy
+from .models import Book, Vote
+
+
+# Most (book, rating) pairs one record_votes() call accepts
+MAX_VOTES = 500
+RATINGS = range(1, 6)
+
+
+def apply(latest, using=None):
+    """Upsert {(user id, book id): rating} and adjust the books' aggregates; call inside a transaction.
+
+    Returns (votes created, votes changed); pairs already carrying the rating are not written.
+    Raises ValueError, before writing anything, when a book does not exist. using defaults to
+    the database the router writes votes to.
+    """
+    using = using or router.db_for_write(Vote)
+    book_ids = {book_id for _, book_id in latest}
+    user_ids = {user_id for user_id, _ in latest}
+    # Concurrent votes on these books wait here until this transaction commits
+    unknown = book_ids - set(
+        Book.objects.using(using).select_for_update().filter(pk__in=book_ids).values_list("pk", flat=True)
+    )
+    if unknown:
+        raise ValueError(f"Unknown book(s): {', '.join(map(str, sorted(unknown)))}.")
+    previous = {
+        (user_id, book_id): rating
+        for user_id, book_id, rating in Vote.objects.using(using)
+        .filter(book_id__in=book_ids, user_id__in=user_ids).values_list("user_id", "book_id", "rating")
+        if (user_id, book_id) in latest
+    }
+
+    upserts = []
+    deltas = defaultdict(lambda: [0, 0, 0])  # book id -> [new votes, rating sum delta, recent votes delta]
+    for (user_id, book_id), rating in latest.items():
+        old = previous.get((user_id, book_id))
+        if old == rating:
+            continue
+        upserts.append(Vote(user_id=user_id, book_id=book_id, rating=rating))
+        delta = deltas[book_id]
+        delta[1] += rating - (old or 0)
+        if old is None:
+            delta[0] += 1
+            delta[2] += 1
+
+    Vote.objects.using(using).bulk_create(
+        upserts, batch_size=500, update_conflicts=True, unique_fields=["user", "book"], update_fields=["rating"],
+    )
+    # Books with the same deltas share their UPDATEs, a bulk of new votes needs at most five
+    by_totals, by_recent = defaultdict(list), defaultdict(list)
+    for book_id, (count_delta, sum_delta, recent_delta) in deltas.items():
+        by_totals[count_delta, sum_delta].append(book_id)
+        by_recent[recent_delta].append(book_id)
+    for (count_delta, sum_delta), ids in by_totals.items():
+        Book.objects.using(using).filter(pk__in=ids).adjust_vote_totals(count_delta, sum_delta)
+    for recent_delta, ids in by_recent.items():
+        leaderboards.votes_changed(ids, recent_delta, using)
+    created = sum(delta[0] for delta in deltas.values())
+    return created, len(upserts) - created
+
+
+def record_votes(user, ratings, using=None):
+    """Record the user's {book id: rating} votes, returns (votes created, votes changed).
+
+    The writes bypass the model signals, not the router: using defaults to its
+    db_for_write(), which also pins the rest of the request to the primary.
+    Raises ValueError for a rating outside 1-5, more than MAX_VOTES votes or unknown books.
+    """
+    if len(ratings) > MAX_VOTES:
+        raise ValueError(f"At most {MAX_VOTES} votes at a time.")
+    invalid = sorted(book_id for book_id, rating in ratings.items() if rating not in RATINGS)
+    if invalid:
+        raise ValueError(f"Ratings must be 1-5, not for book(s) {', '.join(map(str, invalid))}.")
+    if not ratings:
+        return 0, 0
+    using = using or router.db_for_write(Vote)
+
+    @retry_on_busy(using=using)
+    def write():
+        with transaction.atomic(using=using):
+            return apply({(user.pk, book_id): rating for book_id, rating in ratings.items()}, using)
+
+    created, changed = write()
+    if created or changed:
+        conditional.touch_catalogue()
+    return created, changed